@@ -2,14 +2,28 @@
 
 MODE="${APP_MODE:=web}"
 
+# Metric files shared by the processes of this container, cleared so a restart does not report stale values
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:=/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 if [ "$MODE" = "web" ]; then
   echo "Running web mode"
   echo "Preparing static files"
   python manage.py collectstatic --no-input --no-color
-  echo "Starting webserver"
-  gunicorn -b :80 bringel.wsgi
+  echo "Starting webserver (${APP_SERVER:=wsgi})"
+  gunicorn -c python:bringel.gunicorn
 else
   echo "Running worker mode"
-  echo "Starting worker"
-  celery -A bringel worker -l INFO
+  # One worker per queue keeps the interactive tasks from waiting behind bulk ones (WORKER_QUEUES=interactive)
+  QUEUES="${WORKER_QUEUES:=interactive,bulk,maintenance}"
+  # Short tasks are reserved a few at a time, long ones one at a time so an idle worker can take the next
+  if [ "$QUEUES" = "interactive" ]; then
+    PREFETCH="${WORKER_PREFETCH_MULTIPLIER:=4}"
+  else
+    PREFETCH="${WORKER_PREFETCH_MULTIPLIER:=1}"
+  fi
+  echo "Starting worker for ${QUEUES} (concurrency ${WORKER_CONCURRENCY:=$(nproc)}, prefetch ${PREFETCH})"
+  celery -A bringel worker -l INFO -Q "$QUEUES" -n "$(echo "$QUEUES" | tr , -)@%h" \
+    --concurrency "$WORKER_CONCURRENCY" --prefetch-multiplier "$PREFETCH"
 fi
@@ -11,6 +11,8 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from bringel.health import HealthCheckASGIMiddleware
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bringel.settings')
 
-application = get_asgi_application()
+application = HealthCheckASGIMiddleware(get_asgi_application())
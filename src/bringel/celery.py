@@ -1,8 +1,73 @@
 from os import environ
 
 from celery import Celery
+from celery.signals import task_prerun, task_postrun, task_failure, before_task_publish, worker_ready, \
+    worker_process_shutdown
 
 environ.setdefault('DJANGO_SETTINGS_MODULE', 'bringel.settings')
 app = Celery('bringel')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@task_prerun.connect
+def route_read_only_task(task=None, **_):
+    # Tasks declared with @shared_task(read_only=True) read from the replicas
+    from bringel.db.routers import set_replica_reads
+
+    set_replica_reads(getattr(task, 'read_only', False))
+
+
+@task_postrun.connect
+def reset_task_routing(**_):
+    from bringel.db.routers import set_replica_reads
+
+    set_replica_reads(False)
+
+
+@before_task_publish.connect
+def add_published_at(headers=None, **_):
+    from bringel.metrics import task_published
+
+    task_published(headers)
+
+
+@task_prerun.connect
+def start_task_metrics(task_id=None, task=None, **_):
+    from bringel.metrics import task_started
+
+    task_started(task_id, task)
+
+
+@task_postrun.connect
+def finish_task_metrics(task_id=None, task=None, state=None, **_):
+    from bringel.metrics import task_finished
+
+    task_finished(task_id, task, state)
+
+
+@task_failure.connect
+def count_task_failure(sender=None, exception=None, **_):
+    from bringel.metrics import task_failed
+
+    task_failed(sender, exception)
+
+
+@worker_ready.connect
+def serve_worker_metrics(**_):
+    # The pool processes write to PROMETHEUS_MULTIPROC_DIR, the main process serves their aggregate
+    from django.conf import settings
+    from prometheus_client import start_http_server
+    from bringel.metrics import get_registry
+
+    if settings.PROMETHEUS_METRICS and settings.WORKER_METRICS_PORT:
+        start_http_server(settings.WORKER_METRICS_PORT, registry=get_registry())
+
+
+@worker_process_shutdown.connect
+def remove_worker_metrics(pid=None, **_):
+    from os import getpid
+    from prometheus_client import multiprocess
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in environ:
+        multiprocess.mark_process_dead(pid or getpid())
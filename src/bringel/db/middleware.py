@@ -0,0 +1,55 @@
+from hashlib import md5
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+from bringel.db.routers import replica_reads
+
+
+class ReplicaRoutingMiddleware:
+    """Read from the replicas on safe requests, unless the client wrote in the last READ_YOUR_WRITES_WINDOW seconds
+
+    Clients are told apart by their Authorization header, session cookie or address. Successful unsafe requests
+    pin the client to the primary (through the cache, so every worker sees it) until the replicas caught up.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def get_client_key(self, request):
+        client = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME) or \
+            request.META.get('REMOTE_ADDR', '')
+        return f'db:primary:{md5(client.encode()).hexdigest()}'
+
+    def is_write(self, request, response):
+        return request.method not in SAFE_METHODS and response.status_code < 400
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DB_REPLICAS:
+            return self.get_response(request)
+        key = self.get_client_key(request)
+        use_replicas = request.method in SAFE_METHODS and cache.get(key) is None
+        with replica_reads(use_replicas):
+            response = self.get_response(request)
+        if self.is_write(request, response):
+            cache.set(key, 1, timeout=settings.READ_YOUR_WRITES_WINDOW)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DB_REPLICAS:
+            return await self.get_response(request)
+        key = self.get_client_key(request)
+        use_replicas = request.method in SAFE_METHODS and await cache.aget(key) is None
+        with replica_reads(use_replicas):
+            response = await self.get_response(request)
+        if self.is_write(request, response):
+            await cache.aset(key, 1, timeout=settings.READ_YOUR_WRITES_WINDOW)
+        return response
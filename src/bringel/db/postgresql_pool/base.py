@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+from time import monotonic
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base
+from psycopg import IsolationLevel
+from psycopg_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+_last_reports = {}
+
+
+def get_pool_key(alias, conn_params):
+    # Pools are never shared across fork, nor between settings (e.g. the test database renames NAME)
+    return alias, os.getpid(), tuple(sorted((name, str(value)) for name, value in conn_params.items()))
+
+
+def get_pool(alias, conn_params, options):
+    """Return the pool of the alias and connection parameters in this process"""
+    key = get_pool_key(alias, conn_params)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    kwargs=conn_params,
+                    min_size=options.get('MIN_SIZE', 1),
+                    max_size=options.get('MAX_SIZE', 4),
+                    timeout=options.get('TIMEOUT', 10),
+                    max_idle=options.get('MAX_IDLE', 300),
+                    max_lifetime=options.get('MAX_LIFETIME', 3600),
+                    check=ConnectionPool.check_connection,
+                    name=alias,
+                    open=True,
+                )
+                _pools[key] = pool
+    return pool
+
+
+def get_pool_stats():
+    """Return the stats of the pools of this process by alias, including whether they are saturated"""
+    stats = {}
+    for (alias, pid, _), pool in list(_pools.items()):
+        if pid != os.getpid():
+            continue
+        pool_stats = pool.get_stats()
+        busy = pool_stats['pool_available'] == 0 and pool_stats['pool_size'] >= pool_stats['pool_max']
+        pool_stats['saturated'] = busy or pool_stats['requests_waiting'] > 0
+        stats[alias] = pool_stats
+    return stats
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL backend that checks connections out of a psycopg_pool ConnectionPool
+
+    Closing the connection (at the end of every request with CONN_MAX_AGE = 0) returns it to the pool. The pool is
+    configured by the POOL dict of the database settings: MIN_SIZE, MAX_SIZE, TIMEOUT (seconds to wait for a
+    connection), MAX_IDLE, MAX_LIFETIME, WAIT_WARNING (seconds) and STATS_INTERVAL (seconds between stats logs).
+    """
+
+    pool = None
+    pool_key = None
+
+    def get_pool(self, conn_params):
+        self.pool_key = get_pool_key(self.alias, conn_params)
+        return get_pool(self.alias, conn_params, self.settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = IsolationLevel(options.get('isolation_level', IsolationLevel.READ_COMMITTED))
+        except ValueError:
+            raise ImproperlyConfigured(
+                f'Invalid transaction isolation level {options["isolation_level"]} specified. '
+                'Use one of the psycopg.IsolationLevel values.'
+            )
+        self.pool = self.get_pool(conn_params)
+        started = monotonic()
+        connection = self.pool.getconn()
+        self.report_checkout(self.pool, monotonic() - started)
+        if 'isolation_level' in options:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def report_checkout(self, pool, waited):
+        pool_options = self.settings_dict.get('POOL', {})
+        if waited >= pool_options.get('WAIT_WARNING', 0.1):
+            logger.warning(f'Waited {waited:.3f}s for a {self.alias} database connection',
+                           extra={'database': self.alias, 'wait_seconds': waited})
+        last_report = _last_reports.get(self.alias)
+        now = monotonic()
+        if last_report is None or now - last_report >= pool_options.get('STATS_INTERVAL', 60):
+            _last_reports[self.alias] = now
+            stats = pool.pop_stats()
+            logger.info(f'Database pool {self.alias} stats', extra={'database': self.alias, **stats})
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                if self.pool is not _pools.get(self.pool_key) or self.pool_key[1] != os.getpid():
+                    return self.connection.close()  # Checked out before a fork, from the pool of the parent
+                # The pool rolls back unfinished transactions and discards broken connections
+                self.pool.putconn(self.connection)
@@ -0,0 +1,55 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PRIMARY = 'default'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Send the reads of the block to the replicas (or keep them on the primary with enabled=False)"""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def set_replica_reads(enabled):
+    _replica_reads.set(enabled)
+
+
+def reads_from_replicas():
+    return bool(settings.DB_REPLICAS) and _replica_reads.get()
+
+
+class ReplicaRouter:
+    """Route reads to a random replica of settings.DB_REPLICAS inside replica_reads(), everything else to the primary
+
+    Reads outside replica_reads() (writes, management commands, shell, tasks not marked read_only) stay on the
+    primary, so nothing reads stale data unless it opted in.
+    """
+
+    def db_for_read(self, model, **hints):
+        if settings.DB_REPLICAS and _replica_reads.get():
+            return random.choice(settings.DB_REPLICAS)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *settings.DB_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in settings.DB_REPLICAS:
+            return False
+        return None
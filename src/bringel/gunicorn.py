@@ -0,0 +1,81 @@
+"""
+Gunicorn config for bringel project.
+
+Run it with ``gunicorn -c python:bringel.gunicorn``, every setting can be overridden with GUNICORN_* env vars.
+APP_SERVER=asgi serves bringel.asgi with uvicorn workers instead of bringel.wsgi.
+"""
+
+import os
+
+import decouple  # Not imported as config, gunicorn reads every module level name as a setting
+
+
+def get_cpu_count():
+    """CPUs this container may use: the cgroup quota when there is one, otherwise the CPUs the process can run on"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != 'max':
+            return max(1, int(quota) // int(period))
+    except (OSError, ValueError):
+        pass
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+cpu_count = get_cpu_count()
+asgi = decouple.config('APP_SERVER', default='wsgi') == 'asgi'
+
+bind = decouple.config('GUNICORN_BIND', default=':80')
+if asgi:
+    wsgi_app = 'bringel.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    # An event loop keeps its core busy while requests wait on IO, one worker per core is enough
+    workers = decouple.config('GUNICORN_WORKERS', default=cpu_count, cast=int)
+    threads = 1
+else:
+    wsgi_app = 'bringel.wsgi:application'
+    threads = decouple.config('GUNICORN_THREADS', default=2, cast=int)
+    worker_class = 'gthread' if threads > 1 else 'sync'
+    workers = decouple.config('GUNICORN_WORKERS', default=cpu_count * 2 + 1, cast=int)
+
+# Import the project once in the master so workers share its memory copy-on-write
+preload_app = decouple.config('GUNICORN_PRELOAD', default=True, cast=bool)
+# Recycle workers to bound slow memory growth, the jitter keeps them from restarting all at once
+max_requests = decouple.config('GUNICORN_MAX_REQUESTS', default=1000, cast=int)
+max_requests_jitter = decouple.config('GUNICORN_MAX_REQUESTS_JITTER', default=max_requests // 10, cast=int)
+timeout = decouple.config('GUNICORN_TIMEOUT', default=30, cast=int)
+graceful_timeout = decouple.config('GUNICORN_GRACEFUL_TIMEOUT', default=30, cast=int)
+keepalive = decouple.config('GUNICORN_KEEPALIVE', default=5, cast=int)
+accesslog = decouple.config('GUNICORN_ACCESSLOG', default=None)
+
+
+def when_ready(server):
+    # Runs in the master after preloading, so the URL resolver built here is shared by every worker
+    if server.cfg.preload_app:
+        from django.urls import get_resolver
+
+        get_resolver()._populate()
+
+
+def post_worker_init(worker):
+    # Connections can not be shared across fork, each worker opens its own (and loads the driver) before taking
+    # traffic. An unreachable database is reported by the readiness probe instead of crashing the worker. Requests
+    # run on other threads, so the connections go back to the pool instead of being held by this one
+    from django.db import connections, DatabaseError
+
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as error:
+            worker.log.warning(f'Could not warm up database {alias}: {error}')
+    connections.close_all()
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of the exited worker, its counters and histograms stay in the aggregate
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
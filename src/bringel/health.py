@@ -0,0 +1,84 @@
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import connections, DatabaseError
+
+LIVENESS_PATH = '/health/live'
+READINESS_PATH = '/health/ready'
+
+logger = logging.getLogger(__name__)
+
+
+def check_readiness():
+    """Return the status code and body of the readiness probe, ready when every database answers
+
+    The body also has the stats of the connection pools of this worker, if any.
+    """
+    pools = {}
+    for alias in connections:
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError as error:
+            logger.warning(f'Database {alias} is unavailable: {error}', extra={'database': alias})
+            return 503, {'status': 'unavailable', 'database': alias}
+        finally:
+            # As at the end of a request, so a pooled connection goes back to its pool
+            connection.close_if_unusable_or_obsolete()
+        if getattr(connection, 'pool', None) is not None:
+            pools[alias] = connection.pool.get_stats()
+    body = {'status': 'ok'}
+    if pools:
+        body['pools'] = pools
+    return 200, body
+
+
+def check_liveness():
+    return 200, {'status': 'ok'}
+
+
+class HealthCheckWSGIMiddleware:
+    """Answer the probes before Django, so they skip the middleware stack, authentication and request logging"""
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO')
+        if path == LIVENESS_PATH:
+            status, body = check_liveness()
+        elif path == READINESS_PATH:
+            status, body = check_readiness()
+        else:
+            return self.application(environ, start_response)
+        content = json.dumps(body).encode()
+        start_response(f'{status} {"OK" if status == 200 else "Service Unavailable"}', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(content))),
+        ])
+        return [content]
+
+
+class HealthCheckASGIMiddleware:
+    """ASGI version of HealthCheckWSGIMiddleware"""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get('path') if scope['type'] == 'http' else None
+        if path == LIVENESS_PATH:
+            status, body = check_liveness()
+        elif path == READINESS_PATH:
+            status, body = await sync_to_async(check_readiness)()
+        else:
+            return await self.application(scope, receive, send)
+        content = json.dumps(body).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(content)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': content})
@@ -0,0 +1,218 @@
+import hmac
+import logging
+import os
+import time
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, Http404
+from kombu.exceptions import ChannelError
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, \
+    generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from bringel.timing import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Metrics are kept in memory, or in files of PROMETHEUS_MULTIPROC_DIR shared by the gunicorn and celery workers
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Latency of the requests by route, method and status',
+    ['view', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Size of the response bodies by route and method, streaming responses excluded',
+    ['view', 'method'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_queries', 'Database queries made by the requests by route',
+    ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+REQUEST_DB_DURATION = Histogram(
+    'http_request_db_duration_seconds', 'Time the requests spent in the database by route',
+    ['view'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Connections of the database pools of each process: size, available, max and waiting',
+    ['database', 'state'],
+    multiprocess_mode='liveall',
+)
+TASK_DURATION = Histogram(
+    'celery_task_duration_seconds', 'Runtime of the tasks by name and final state',
+    ['task', 'state'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+TASK_QUEUE_WAIT = Histogram(
+    'celery_task_queue_wait_seconds', 'Time between publishing a task and a worker starting it, by name and queue',
+    ['task', 'queue'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+TASK_FAILURES = Counter(
+    'celery_task_failures', 'Tasks that raised, by name and exception',
+    ['task', 'exception'],
+)
+
+POOL_STATES = {'size': 'pool_size', 'available': 'pool_available', 'max': 'pool_max', 'waiting': 'requests_waiting'}
+
+_task_started = {}
+
+
+def get_registry():
+    """Registry to expose: the one of this process, or one aggregating every process in multiprocess mode"""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+class ResponseCacheCollector:
+    """Hits, misses and lock waits of the response cache, read from the cache when scraped"""
+
+    def collect(self):
+        from store.cache import get_stats
+
+        try:
+            stats = get_stats()
+        except Exception as error:  # An unreachable cache must not fail the scrape
+            logger.warning(f'Could not read the response cache stats: {error}')
+            return
+        requests = CounterMetricFamily('response_cache_requests', 'Response cache lookups by result',
+                                       labels=['result'])
+        for result in ('hits', 'misses', 'waits'):
+            requests.add_metric([result], stats[result])
+        yield requests
+        if stats['hit_ratio'] is not None:
+            yield GaugeMetricFamily('response_cache_hit_ratio', 'Share of the response cache lookups that hit',
+                                    value=stats['hit_ratio'])
+
+
+def get_queue_depths():
+    """Messages waiting in each of TASK_QUEUES, reserved and countdown tasks excluded, {} when tasks run eagerly"""
+    from bringel.celery import app
+
+    if app.conf.task_always_eager:
+        return {}
+    depths = {}
+    with app.connection_for_read() as connection:
+        connection.ensure_connection(max_retries=1)
+        channel = connection.default_channel
+        for queue in settings.TASK_QUEUES:
+            try:
+                depths[queue] = channel.queue_declare(queue, passive=True).message_count
+            except ChannelError:  # Not declared yet, as no worker consumed it and nothing was sent to it
+                depths[queue] = 0
+    return depths
+
+
+class CeleryQueueCollector:
+    """Depth of the task queues, read from the broker when scraped. Their latency is celery_task_queue_wait_seconds"""
+
+    def collect(self):
+        try:
+            depths = get_queue_depths()
+        except Exception as error:  # An unreachable broker must not fail the scrape
+            logger.warning(f'Could not read the task queue depths: {error}')
+            return
+        metric = GaugeMetricFamily('celery_queue_length', 'Tasks waiting in each queue', labels=['queue'])
+        for queue, depth in depths.items():
+            metric.add_metric([queue], depth)
+        yield metric
+
+
+# Stats shared by every process, so they are read once by the scrape instead of by each worker
+_shared_registry = CollectorRegistry(auto_describe=False)
+_shared_registry.register(ResponseCacheCollector())
+_shared_registry.register(CeleryQueueCollector())
+
+
+def metrics_view(request):
+    """Prometheus exposition of every process, requires Authorization: Bearer METRICS_TOKEN when it is set"""
+    if not settings.PROMETHEUS_METRICS:
+        raise Http404
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return HttpResponse(status=401)
+    content = generate_latest(get_registry()) + generate_latest(_shared_registry)
+    return HttpResponse(content, content_type=CONTENT_TYPE_LATEST)
+
+
+class PrometheusMiddleware:
+    """Observe the latency, response size, queries and database time of every request by DRF route
+
+    Must come after RequestMetricsMiddleware, whose query counts it reuses. The pool gauges are updated after
+    every request, as the pools live in each worker.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROMETHEUS_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, perf_counter() - started)
+        return response
+
+    def observe(self, request, response, duration):
+        # Route names instead of paths, so ids do not multiply the series
+        view = request.resolver_match.view_name if request.resolver_match else '<unresolved>'
+        REQUEST_DURATION.labels(view, request.method, response.status_code).observe(duration)
+        if not response.streaming:
+            RESPONSE_SIZE.labels(view, request.method).observe(len(response.content))
+        metrics = get_metrics()
+        if metrics is not None:
+            REQUEST_QUERIES.labels(view).observe(metrics.queries)
+            REQUEST_DB_DURATION.labels(view).observe(metrics.db_time)
+        update_pool_gauges()
+
+
+def update_pool_gauges():
+    from bringel.db.postgresql_pool.base import get_pool_stats
+
+    for alias, stats in get_pool_stats().items():
+        for state, key in POOL_STATES.items():
+            DB_POOL_CONNECTIONS.labels(alias, state).set(stats[key])
+
+
+def task_published(headers):
+    # Sent with the task, so the worker can tell how long it waited in the queue
+    headers.setdefault('published_at', time.time())
+
+
+def task_started(task_id, task):
+    _task_started[task_id] = perf_counter()
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is not None:
+        queue = (task.request.delivery_info or {}).get('routing_key') or ''
+        TASK_QUEUE_WAIT.labels(task.name, queue).observe(max(time.time() - published_at, 0))
+
+
+def task_finished(task_id, task, state):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task.name, state or 'UNKNOWN').observe(perf_counter() - started)
+
+
+def task_failed(task, exception):
+    TASK_FAILURES.labels(task.name, type(exception).__name__).inc()
@@ -1,6 +1,6 @@
 from pathlib import Path
 
-from decouple import config
+from decouple import config, Csv
 from django.urls import reverse_lazy
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,6 +38,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'log_request_id.middleware.RequestIDMiddleware',
+    'bringel.timing.RequestMetricsMiddleware',
+    'bringel.metrics.PrometheusMiddleware',
+    'bringel.db.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -72,16 +75,40 @@ WSGI_APPLICATION = 'bringel.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Check connections out of a psycopg_pool pool per process, or keep one connection per thread when disabled
+DB_POOL = config('DB_POOL', default=True, cast=bool)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'bringel.db.postgresql_pool' if DB_POOL else 'django.db.backends.postgresql',
         'HOST': config('DB_HOST'),
         'USER': config('DB_USER'),
         'PASSWORD': config('DB_PASSWORD'),
         'NAME': config('DB_NAME'),
+        # Pooled connections go back to the pool at the end of every request, others are kept (seconds)
+        'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            'MIN_SIZE': config('DB_POOL_MIN_SIZE', default=1, cast=int),
+            'MAX_SIZE': config('DB_POOL_MAX_SIZE', default=4, cast=int),
+            'TIMEOUT': config('DB_POOL_TIMEOUT', default=10, cast=float),
+            'MAX_IDLE': config('DB_POOL_MAX_IDLE', default=300, cast=float),
+            'MAX_LIFETIME': config('DB_POOL_MAX_LIFETIME', default=3600, cast=float),
+            'WAIT_WARNING': config('DB_POOL_WAIT_WARNING', default=0.1, cast=float),
+            'STATS_INTERVAL': config('DB_POOL_STATS_INTERVAL', default=60, cast=float),
+        },
     }
 }
 
+# Read replicas of the primary database, used by safe API requests and read_only celery tasks
+DB_REPLICAS = []
+for index, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv())):
+    DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    DB_REPLICAS.append(f'replica_{index}')
+DATABASE_ROUTERS = ['bringel.db.routers.ReplicaRouter']
+# Seconds a client reads from the primary after writing, so it does not read its own writes stale
+READ_YOUR_WRITES_WINDOW = config('DB_READ_YOUR_WRITES_WINDOW', default=10, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -128,6 +155,16 @@ LOG_REQUEST_ID_HEADER = "HTTP_X_REQUEST_ID"
 GENERATE_REQUEST_ID_IF_NOT_IN_HEADER = True
 REQUEST_ID_RESPONSE_HEADER = "X-Request-ID"
 
+# Send the queries, database time and serialize and render times of requests in the Server-Timing header
+SERVER_TIMING_HEADER = config('SERVER_TIMING_HEADER', default=True, cast=bool)
+# Requests making more queries log their query fingerprints
+REQUEST_QUERY_THRESHOLD = config('REQUEST_QUERY_THRESHOLD', default=20, cast=int)
+# Prometheus metrics at /metrics (protected by a bearer token when METRICS_TOKEN is set), and on this port of the
+# celery workers (0 disables it). Set PROMETHEUS_MULTIPROC_DIR to aggregate the gunicorn and celery processes
+PROMETHEUS_METRICS = config('PROMETHEUS_METRICS', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+WORKER_METRICS_PORT = config('WORKER_METRICS_PORT', default=9808, cast=int)
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -172,23 +209,98 @@ LOGGING = {
 }
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'store.api.pagination.CatalogPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
+        'store.api.authentication.JWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 }
+# Text search configuration of the product search vectors (PostgreSQL)
+SEARCH_CONFIG = config('SEARCH_CONFIG', default='portuguese')
+# Render the compiled_actions of the viewsets with compiled serializers, the output is the same of the serializers
+COMPILED_SERIALIZERS = config('COMPILED_SERIALIZERS', default=True, cast=bool)
+# Products read per query (and per server-side cursor fetch) by the catalog export
+CATALOG_EXPORT_CHUNK_SIZE = config('CATALOG_EXPORT_CHUNK_SIZE', default=1000, cast=int)
+# Encode and decode API JSON with orjson, the output is the same of the stdlib renderer
+if config('API_ORJSON', default=True, cast=bool):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'store.api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'] = [
+        'store.api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ]
 
 
 CELERY_BROKER_URL = config('CELERY_BROKER_URL')
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 
+# Queues with the soft and hard time limits (seconds) of their tasks: interactive for the short tasks that follow a
+# request, bulk for imports and rebuilds, maintenance for cleanups. Workers are bound to queues by entrypoint.sh
+TASK_QUEUES = {
+    'interactive': {
+        'soft_time_limit': config('INTERACTIVE_TASK_SOFT_TIME_LIMIT', default=30, cast=int),
+        'time_limit': config('INTERACTIVE_TASK_TIME_LIMIT', default=60, cast=int),
+    },
+    'bulk': {
+        'soft_time_limit': config('BULK_TASK_SOFT_TIME_LIMIT', default=3600, cast=int),
+        'time_limit': config('BULK_TASK_TIME_LIMIT', default=3900, cast=int),
+    },
+    'maintenance': {
+        'soft_time_limit': config('MAINTENANCE_TASK_SOFT_TIME_LIMIT', default=1800, cast=int),
+        'time_limit': config('MAINTENANCE_TASK_TIME_LIMIT', default=2100, cast=int),
+    },
+}
+CELERY_TASK_DEFAULT_QUEUE = 'interactive'
+CELERY_TASK_ROUTES = {
+    'store.tasks.update_rating': {'queue': 'interactive'},
+    'store.tasks.flush_ratings': {'queue': 'interactive'},
+    'store.tasks.update_related_products': {'queue': 'bulk'},
+    'store.tasks.rebuild_related_products': {'queue': 'bulk'},
+    'store.tasks.import_catalog': {'queue': 'bulk'},
+    'store.tasks.compact_price_history': {'queue': 'maintenance'},
+}
+CELERY_TASK_ANNOTATIONS = {task: TASK_QUEUES[route['queue']] for task, route in CELERY_TASK_ROUTES.items()}
+# Tasks are acknowledged after running, so the ones reserved by a worker that stops run again (they are idempotent)
+CELERY_TASK_ACKS_LATE = True
+# Redis redelivers unacknowledged tasks after the visibility timeout, which must outlast the longest task
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': max(queue['time_limit'] for queue in TASK_QUEUES.values()) + 300,
+}
+
+# Collect rating events in redis and recompute the dirty products once per flush interval (seconds)
+RATING_COALESCE = config('RATING_COALESCE', default=False, cast=bool)
+RATING_FLUSH_INTERVAL = config('RATING_FLUSH_INTERVAL', default=10, cast=int)
+RATING_REDIS_URL = config('RATING_REDIS_URL', default=CELERY_BROKER_URL)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_REDIS_URL', default=CELERY_BROKER_URL),
+    }
+}
+
+# Cache product list and detail responses (seconds), invalidated by the signals that change products
+RESPONSE_CACHE = config('RESPONSE_CACHE', default=True, cast=bool)
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=300, cast=int)
+RESPONSE_CACHE_LOCK_TIMEOUT = config('RESPONSE_CACHE_LOCK_TIMEOUT', default=5, cast=int)
+
+# How price history rows are written: immediate, on_commit or buffered (one INSERT per transaction)
+PRICE_HISTORY_WRITE = config('PRICE_HISTORY_WRITE', default='immediate')
+
+# Seconds a process trusts its own view of the revoked JWTs before asking redis again, and how many it remembers
+JWT_DENYLIST_LOCAL_TTL = config('JWT_DENYLIST_LOCAL_TTL', default=5, cast=int)
+JWT_DENYLIST_LOCAL_SIZE = config('JWT_DENYLIST_LOCAL_SIZE', default=10000, cast=int)
+
 OAUTH2_PROVIDER = {
     'ACCESS_TOKEN_GENERATOR': 'bringel.jwt.jwt_token_generator',
+    'REFRESH_TOKEN_GENERATOR': 'bringel.jwt.jwt_refresh_token_generator',
     'SCOPES': {
         'admin': 'Admin scope',
         'user': 'User scope',
@@ -1,11 +1,40 @@
+import asyncio
+import importlib
+import json
 import logging
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
 
 import jwt
 from django.conf import settings
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connection, connections
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from prometheus_client import REGISTRY, Counter, CollectorRegistry, generate_latest, values
+from prometheus_client.parser import text_string_to_metric_families
 
-from bringel.jwt import jwt_token_generator
+from bringel import gunicorn
+from bringel.celery import app as celery_app, route_read_only_task, reset_task_routing, add_published_at, \
+    start_task_metrics, finish_task_metrics, count_task_failure
+from bringel.db.middleware import ReplicaRoutingMiddleware
+from bringel.db.postgresql_pool import base as pool_backend
+from bringel.db.routers import ReplicaRouter, replica_reads
+from bringel.health import HealthCheckWSGIMiddleware, HealthCheckASGIMiddleware
+from bringel.jwt import jwt_token_generator, jwt_refresh_token_generator, decode_access_token, revoke_token, \
+    is_jti_revoked, denylist_key
 from bringel.logs import JSONFormatter
+from bringel.metrics import get_registry
+from bringel.timing import fingerprint
+from store.cache import increment
+from store.factories import ProductFactory
+from store.models import Tag
+from store.tasks import update_rating, import_catalog, compact_price_history
 
 
 class JWTTestCase(TestCase):
@@ -17,6 +46,53 @@ class JWTTestCase(TestCase):
         self.assertIn('jti', decoded)
         self.assertIn('exp', decoded)
 
+    def oauth_request(self, scopes=('user',), user_id=None):
+        return SimpleNamespace(expires_in=60, scopes=list(scopes), user=None, client=SimpleNamespace(user_id=user_id))
+
+    def test_access_token_has_scope_and_owner(self):
+        token = jwt_token_generator(self.oauth_request(['user', 'admin'], user_id=7))
+        decoded = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        self.assertEqual(decoded['scope'], 'user admin')
+        self.assertEqual(decoded['sub'], '7')
+
+    def test_refresh_token_is_not_an_access_token(self):
+        token = jwt_refresh_token_generator(self.oauth_request())
+        self.assertIsNone(decode_access_token(token))
+
+    def test_decode_access_token_checks_scopes_and_expiry(self):
+        access_token = decode_access_token(jwt_token_generator(self.oauth_request(['user'])))
+        self.assertTrue(access_token.is_valid(['user']))
+        self.assertFalse(access_token.is_valid(['admin']))
+        expired = jwt.encode({'jti': 'a', 'exp': int(now().timestamp()) - 1, 'scope': 'user'}, settings.SECRET_KEY)
+        with self.assertRaises(jwt.ExpiredSignatureError):
+            decode_access_token(expired)
+
+
+class JWTDenylistTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.token = jwt_token_generator(SimpleNamespace(expires_in=60, scopes=['user'], user=None, client=None))
+        self.jti = decode_access_token(self.token).jti
+
+    def test_revoked_token_is_denied(self):
+        self.assertFalse(is_jti_revoked(self.jti))
+        revoke_token(self.token)
+        self.assertTrue(is_jti_revoked(self.jti))
+
+    @override_settings(JWT_DENYLIST_LOCAL_TTL=60)
+    def test_not_revoked_lookups_are_cached_in_process(self):
+        self.assertFalse(is_jti_revoked(self.jti))
+        with patch('bringel.jwt.cache.get') as mock:
+            self.assertFalse(is_jti_revoked(self.jti))
+        mock.assert_not_called()
+
+    @override_settings(JWT_DENYLIST_LOCAL_TTL=0)
+    def test_revocation_by_another_process_is_seen_through_redis(self):
+        self.assertFalse(is_jti_revoked(self.jti))
+        cache.set(denylist_key(self.jti), 1)
+        self.assertTrue(is_jti_revoked(self.jti))
+
 
 class JSONFormatterTestCase(TestCase):
     def test_json_record_contains_level_pathname_lineno(self):
@@ -35,3 +111,397 @@ class JSONFormatterTestCase(TestCase):
         self.assertIn('level', extra)
         self.assertIn('pathname', extra)
         self.assertIn('lineno', extra)
+
+
+class HealthCheckTestCase(TestCase):
+    databases = {'default', 'replica'}  # Readiness checks every database
+
+    def wsgi_get(self, path):
+        application = MagicMock(return_value=[b'django'])
+        start_response = MagicMock()
+        body = HealthCheckWSGIMiddleware(application)({'PATH_INFO': path}, start_response)
+        return start_response.call_args.args[0] if start_response.called else None, b''.join(body), application
+
+    def asgi_get(self, path):
+        messages = []
+        application = MagicMock()
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(HealthCheckASGIMiddleware(application)({'type': 'http', 'path': path}, None, send))
+        return messages, application
+
+    def test_liveness_skips_django(self):
+        status, body, application = self.wsgi_get('/health/live')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(json.loads(body), {'status': 'ok'})
+        application.assert_not_called()
+
+    def test_readiness_checks_the_database(self):
+        status, _, _ = self.wsgi_get('/health/ready')
+        self.assertEqual(status, '200 OK')
+        with patch('django.db.backends.base.base.BaseDatabaseWrapper.cursor', side_effect=DatabaseError('down')):
+            status, body, _ = self.wsgi_get('/health/ready')
+        self.assertEqual(status, '503 Service Unavailable')
+        self.assertEqual(json.loads(body), {'status': 'unavailable', 'database': 'default'})
+
+    def test_other_paths_reach_django(self):
+        _, body, application = self.wsgi_get('/api/products/')
+        self.assertEqual(body, b'django')
+        application.assert_called_once()
+
+    def test_asgi_liveness_skips_django(self):
+        messages, application = self.asgi_get('/health/live')
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(json.loads(messages[1]['body']), {'status': 'ok'})
+        application.assert_not_called()
+
+
+class GunicornConfigTestCase(TestCase):
+    def load(self, **environ):
+        with patch.dict(os.environ, environ):
+            return importlib.reload(gunicorn)
+
+    def tearDown(self):
+        importlib.reload(gunicorn)
+
+    def test_workers_are_sized_from_cpu_count(self):
+        config = self.load()
+        self.assertGreaterEqual(config.cpu_count, 1)
+        self.assertEqual(config.workers, config.cpu_count * 2 + 1)
+        self.assertTrue(config.preload_app)
+        self.assertEqual(config.max_requests_jitter, config.max_requests // 10)
+
+    def test_env_overrides(self):
+        config = self.load(GUNICORN_WORKERS='3', GUNICORN_THREADS='1', GUNICORN_MAX_REQUESTS='50')
+        self.assertEqual((config.workers, config.worker_class, config.max_requests), (3, 'sync', 50))
+
+    def test_post_worker_init_returns_the_warm_connections(self):
+        with patch('django.db.connections') as connections:
+            connections.__iter__.return_value = iter(['default'])
+            gunicorn.post_worker_init(MagicMock())
+        connections['default'].ensure_connection.assert_called_once_with()
+        connections.close_all.assert_called_once_with()
+
+    def test_asgi_uses_uvicorn_workers(self):
+        config = self.load(APP_SERVER='asgi')
+        self.assertEqual(config.worker_class, 'uvicorn.workers.UvicornWorker')
+        self.assertEqual(config.wsgi_app, 'bringel.asgi:application')
+        self.assertEqual(config.workers, config.cpu_count)
+
+
+@patch.dict('bringel.db.postgresql_pool.base._pools', clear=True)
+@patch.dict('bringel.db.postgresql_pool.base._last_reports', clear=True)
+@patch('bringel.db.postgresql_pool.base.ConnectionPool')
+class PooledDatabaseWrapperTestCase(TestCase):
+    def wrapper(self, **pool):
+        settings_dict = {**connections.settings['default'], 'OPTIONS': {}, 'POOL': pool}
+        return pool_backend.DatabaseWrapper(settings_dict, alias='pooled')
+
+    def test_connections_come_from_one_pool_per_process_and_params(self, pool_class):
+        wrapper = self.wrapper(MIN_SIZE=2, MAX_SIZE=8)
+        connection = wrapper.get_new_connection({'dbname': 'bringel'})
+        self.assertIs(connection, pool_class.return_value.getconn.return_value)
+        wrapper.get_new_connection({'dbname': 'bringel'})
+        self.assertEqual(pool_class.call_count, 1)
+        self.assertEqual(pool_class.call_args.kwargs['min_size'], 2)
+        self.assertEqual(pool_class.call_args.kwargs['max_size'], 8)
+        self.assertEqual(pool_class.call_args.kwargs['check'], pool_class.check_connection)
+        wrapper.get_new_connection({'dbname': 'test_bringel'})
+        self.assertEqual(pool_class.call_count, 2)
+
+    def test_close_returns_the_connection_to_the_pool(self, pool_class):
+        wrapper = self.wrapper()
+        wrapper.connection = connection = wrapper.get_new_connection({'dbname': 'bringel'})
+        wrapper._close()
+        pool_class.return_value.putconn.assert_called_once_with(connection)
+        connection.close.assert_not_called()
+
+    def test_close_after_fork_closes_the_connection(self, pool_class):
+        wrapper = self.wrapper()
+        wrapper.connection = connection = wrapper.get_new_connection({'dbname': 'bringel'})
+        with patch('bringel.db.postgresql_pool.base.os.getpid', return_value=-1):
+            wrapper._close()
+        connection.close.assert_called_once()
+        pool_class.return_value.putconn.assert_not_called()
+
+    def test_slow_checkout_and_stats_are_logged(self, pool_class):
+        pool_class.return_value.pop_stats.return_value = {'requests_wait_ms': 120}
+        with self.assertLogs('bringel.db.postgresql_pool.base', level='INFO') as logs:
+            self.wrapper(WAIT_WARNING=0).get_new_connection({'dbname': 'bringel'})
+        self.assertEqual([record.levelname for record in logs.records], ['WARNING', 'INFO'])
+        self.assertEqual(logs.records[1].requests_wait_ms, 120)
+
+    def test_pool_stats_report_saturation(self, pool_class):
+        pool_class.return_value.get_stats.return_value = {
+            'pool_min': 1, 'pool_max': 2, 'pool_size': 2, 'pool_available': 0, 'requests_waiting': 3,
+        }
+        self.wrapper().get_new_connection({'dbname': 'bringel'})
+        self.assertTrue(pool_backend.get_pool_stats()['pooled']['saturated'])
+
+
+@override_settings(DB_REPLICAS=['replica'], READ_YOUR_WRITES_WINDOW=10)
+class ReplicaRoutingTestCase(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def read_database(self, request, status=200):
+        def view(request):
+            return HttpResponse(self.router.db_for_read(None), status=status)
+
+        return ReplicaRoutingMiddleware(view)(request).content.decode()
+
+    def test_router_reads_from_primary_by_default(self):
+        self.assertEqual(self.router.db_for_read(None), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(None), 'replica')
+            self.assertEqual(self.router.db_for_write(None), 'default')
+        self.assertEqual(self.router.db_for_read(None), 'default')
+
+    @override_settings(DB_REPLICAS=[])
+    def test_router_without_replicas(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(None), 'default')
+
+    def test_router_does_not_migrate_replicas(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'store'))
+        self.assertIsNone(self.router.allow_migrate('default', 'store'))
+
+    def test_safe_requests_read_from_replica(self):
+        self.assertEqual(self.read_database(self.factory.get('/api/products/')), 'replica')
+
+    def test_writes_pin_client_to_primary(self):
+        self.assertEqual(self.read_database(self.factory.post('/api/products/', HTTP_AUTHORIZATION='Bearer a')),
+                         'default')
+        self.assertEqual(self.read_database(self.factory.get('/api/products/', HTTP_AUTHORIZATION='Bearer a')),
+                         'default')
+        # Other clients still read from the replica
+        self.assertEqual(self.read_database(self.factory.get('/api/products/', HTTP_AUTHORIZATION='Bearer b')),
+                         'replica')
+
+    def test_failed_writes_do_not_pin_client(self):
+        self.read_database(self.factory.post('/api/products/', HTTP_AUTHORIZATION='Bearer a'), status=400)
+        self.assertEqual(self.read_database(self.factory.get('/api/products/', HTTP_AUTHORIZATION='Bearer a')),
+                         'replica')
+
+    @override_settings(READ_YOUR_WRITES_WINDOW=0.1)
+    def test_pin_expires_after_window(self):
+        self.read_database(self.factory.delete('/api/products/1/'))
+        with patch('django.core.cache.backends.locmem.time.time', return_value=now().timestamp() + 1):
+            self.assertEqual(self.read_database(self.factory.get('/api/products/')), 'replica')
+
+    def test_async_requests_read_from_replica(self):
+        async def view(request):
+            return HttpResponse(self.router.db_for_read(None))
+
+        middleware = ReplicaRoutingMiddleware(view)
+        response = asyncio.run(middleware(self.factory.get('/api/async/products/')))
+        self.assertEqual(response.content, b'replica')
+        asyncio.run(middleware(self.factory.put('/api/async/products/1/')))
+        response = asyncio.run(middleware(self.factory.get('/api/async/products/')))
+        self.assertEqual(response.content, b'default')
+
+    def test_queries_run_on_routed_database(self):
+        with replica_reads():
+            self.assertEqual(connections['replica'].settings_dict['NAME'],
+                             connections['default'].settings_dict['NAME'])
+            self.assertFalse(get_user_model().objects.exists())
+            self.assertEqual(get_user_model().objects.all().db, 'replica')
+
+    def test_read_only_tasks_read_from_replica(self):
+        route_read_only_task(task=SimpleNamespace(read_only=True))
+        try:
+            self.assertEqual(self.router.db_for_read(None), 'replica')
+        finally:
+            reset_task_routing()
+        self.assertEqual(self.router.db_for_read(None), 'default')
+        route_read_only_task(task=SimpleNamespace())
+        self.assertEqual(self.router.db_for_read(None), 'default')
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        for name in ['a', 'b', 'c']:
+            Tag.objects.create(name=name)
+
+    def get_timings(self, response):
+        timings = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            timings[name] = dict(param.split('=', 1) for param in params)
+        return timings
+
+    def test_fingerprint(self):
+        sql = 'SELECT "a"."id" FROM "a" U0 WHERE ("a"."name" = \'x\'\'y\' AND "a"."id" IN (%s, %s,%s)) LIMIT 21'
+        self.assertEqual(fingerprint(sql), 'SELECT "a"."id" FROM "a" U0 WHERE ("a"."name" = ? AND "a"."id" IN (...)) '
+                                           'LIMIT ?')
+
+    def test_server_timing_and_log_fields(self):
+        with CaptureQueriesContext(connection) as context, self.assertLogs('bringel.timing', 'INFO') as logs:
+            response = self.client.get('/api/tags/')
+        timings = self.get_timings(response)
+        self.assertEqual(list(timings), ['db', 'serialize', 'render', 'total'])
+        self.assertEqual(timings['db']['desc'], f'"{len(context.captured_queries)} queries"')
+        self.assertGreater(float(timings['total']['dur']), float(timings['db']['dur']))
+        record = logs.records[0]
+        self.assertEqual((record.path, record.status_code, record.queries),
+                         ('/api/tags/', 200, len(context.captured_queries)))
+        self.assertEqual(record.serialize_ms, float(timings['serialize']['dur']))
+        self.assertEqual(len(logs.records), 1)
+        fields = json.loads(JSONFormatter().format(record))
+        self.assertEqual(fields['queries'], len(context.captured_queries))
+        self.assertIn('render_ms', fields)
+
+    @override_settings(REQUEST_QUERY_THRESHOLD=1, SERVER_TIMING_HEADER=False)
+    def test_logs_fingerprints_over_threshold(self):
+        with self.assertLogs('bringel.timing', 'INFO') as logs:
+            response = self.client.get('/api/tags/?name=a')
+        self.assertNotIn('Server-Timing', response)
+        warning = logs.records[1]
+        self.assertEqual(warning.levelname, 'WARNING')
+        self.assertEqual(sum(fingerprint['count'] for fingerprint in warning.fingerprints), warning.queries)
+        self.assertIn('FROM "store_tag" WHERE "store_tag"."name" = ?',
+                      ' '.join(fingerprint['sql'] for fingerprint in warning.fingerprints))
+
+    async def test_async_requests(self):
+        response = await self.async_client.get('/api/async/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.get_timings(response)['db']['desc'], '"0 queries"')
+
+
+class PrometheusMetricsTestCase(TestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def scrape(self, **headers):
+        response = self.client.get('/metrics', **headers)
+        if response.status_code != 200:
+            return response, {}
+        samples = {}
+        for family in text_string_to_metric_families(response.content.decode()):
+            for sample in family.samples:
+                samples[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+        return response, samples
+
+    def test_scrape_has_request_metrics_by_route(self):
+        labels = {'view': 'store:tag-list', 'method': 'GET', 'status': '200'}
+        count = self.sample('http_request_duration_seconds_count', **labels)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/tags/')
+        queries = len(context.captured_queries)
+        response, samples = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(samples[('http_request_duration_seconds_count', tuple(sorted(labels.items())))], count + 1)
+        self.assertIn(('http_response_size_bytes_count', (('method', 'GET'), ('view', 'store:tag-list'))), samples)
+        self.assertGreaterEqual(samples[('http_request_queries_sum', (('view', 'store:tag-list'),))], queries)
+        self.assertIn(('http_request_db_duration_seconds_count', (('view', 'store:tag-list'),)), samples)
+
+    def test_scrape_has_response_cache_stats(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        increment('hits')
+        increment('misses')
+        _, samples = self.scrape()
+        self.assertEqual(samples[('response_cache_requests_total', (('result', 'hits'),))], 1)
+        self.assertEqual(samples[('response_cache_requests_total', (('result', 'misses'),))], 1)
+        self.assertEqual(samples[('response_cache_hit_ratio', ())], 0.5)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_protects_the_scrape(self):
+        response, _ = self.scrape()
+        self.assertEqual(response.status_code, 401)
+        response, samples = self.scrape(HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(samples)
+
+    @override_settings(PROMETHEUS_METRICS=False)
+    def test_disabled(self):
+        response, _ = self.scrape()
+        self.assertEqual(response.status_code, 404)
+
+    def test_task_runtime(self):
+        product = ProductFactory()
+        count = self.sample('celery_task_duration_seconds_count', task='store.tasks.update_rating', state='SUCCESS')
+        update_rating.delay(product.id)
+        self.assertEqual(
+            self.sample('celery_task_duration_seconds_count', task='store.tasks.update_rating', state='SUCCESS'),
+            count + 1,
+        )
+
+    def test_task_queue_wait_and_failures(self):
+        headers = {}
+        add_published_at(headers=headers)
+        task = SimpleNamespace(name='store.tasks.example', request=SimpleNamespace(
+            published_at=headers['published_at'] - 2, delivery_info={'routing_key': 'bulk'},
+        ))
+        start_task_metrics(task_id='1', task=task)
+        finish_task_metrics(task_id='1', task=task, state='FAILURE')
+        count_task_failure(sender=task, exception=ValueError())
+        self.assertGreaterEqual(
+            self.sample('celery_task_queue_wait_seconds_sum', task='store.tasks.example', queue='bulk'), 2)
+        self.assertEqual(self.sample('celery_task_duration_seconds_count', task='store.tasks.example',
+                                     state='FAILURE'), 1)
+        self.assertEqual(self.sample('celery_task_failures_total', task='store.tasks.example',
+                                     exception='ValueError'), 1)
+
+    def test_multiprocess_aggregation(self):
+        with tempfile.TemporaryDirectory() as directory, patch.dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory):
+            for pid in (1, 2):
+                # Metrics of two worker processes, written to their files in the directory
+                with patch.object(values, 'ValueClass', values.MultiProcessValue(lambda: pid)):
+                    counter = Counter('worker_requests', 'Requests', registry=CollectorRegistry())
+                    counter.inc(pid)
+            registry = get_registry()
+            self.assertIsNot(registry, REGISTRY)
+            self.assertEqual(registry.get_sample_value('worker_requests_total'), 3)
+            self.assertIn(b'worker_requests_total 3.0', generate_latest(registry))
+
+    def test_gunicorn_marks_exited_workers_dead(self):
+        with patch.dict(os.environ, PROMETHEUS_MULTIPROC_DIR='/tmp/metrics'), \
+                patch('prometheus_client.multiprocess.mark_process_dead') as mark_process_dead:
+            gunicorn.child_exit(None, SimpleNamespace(pid=10))
+        mark_process_dead.assert_called_once_with(10)
+
+
+class CeleryQueuesTestCase(TestCase):
+    def get_queue(self, task):
+        return celery_app.amqp.router.route({}, task)['queue'].name
+
+    def test_tasks_are_routed_to_their_queues(self):
+        self.assertEqual(self.get_queue('store.tasks.update_rating'), 'interactive')
+        self.assertEqual(self.get_queue('store.tasks.import_catalog'), 'bulk')
+        self.assertEqual(self.get_queue('store.tasks.compact_price_history'), 'maintenance')
+        self.assertEqual(self.get_queue('store.tasks.unrouted'), 'interactive')
+
+    def test_tasks_have_the_limits_of_their_queue(self):
+        self.assertEqual((import_catalog.soft_time_limit, import_catalog.time_limit),
+                         (settings.TASK_QUEUES['bulk']['soft_time_limit'], settings.TASK_QUEUES['bulk']['time_limit']))
+        self.assertEqual(update_rating.time_limit, settings.TASK_QUEUES['interactive']['time_limit'])
+        self.assertTrue(update_rating.acks_late)
+        self.assertGreater(celery_app.conf.broker_transport_options['visibility_timeout'],
+                           max(queue['time_limit'] for queue in settings.TASK_QUEUES.values()))
+
+    def test_scrape_has_queue_depths(self):
+        def memory_connection():
+            return celery_app.connection_for_write('memory://')
+
+        celery_app.conf.CELERY_TASK_ALWAYS_EAGER = False
+        try:
+            with patch.object(celery_app, 'connection_for_read', memory_connection), memory_connection() as broker:
+                update_rating.apply_async((1,), connection=broker)
+                update_rating.apply_async((2,), connection=broker)
+                compact_price_history.apply_async(connection=broker)
+                response = self.client.get('/metrics')
+                broker.default_channel.queue_purge('interactive')
+                broker.default_channel.queue_purge('maintenance')
+        finally:
+            celery_app.conf.CELERY_TASK_ALWAYS_EAGER = True
+        depths = {sample.labels['queue']: sample.value
+                  for family in text_string_to_metric_families(response.content.decode())
+                  for sample in family.samples if sample.name == 'celery_queue_length'}
+        self.assertEqual(depths, {'interactive': 2, 'bulk': 0, 'maintenance': 1})
@@ -0,0 +1,142 @@
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_metrics = ContextVar('request_metrics', default=None)
+
+# Literals and placeholder lists, so queries differing only by their values share a fingerprint
+FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class RequestMetrics:
+    """Queries, database time and the timed sections of a request, in seconds"""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.sections = Counter()
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def get_timings(self):
+        """Milliseconds of the request by name, the sections exclude the database time spent inside them"""
+        timings = {'db': self.db_time, **self.sections, 'total': perf_counter() - self.started}
+        return {name: round(value * 1000, 3) for name, value in timings.items()}
+
+
+def get_metrics():
+    return _metrics.get()
+
+
+@contextmanager
+def timed(section):
+    """Add the time spent in the block, minus its database time, to the section of the current request"""
+    metrics = _metrics.get()
+    if metrics is None:
+        yield
+        return
+    started = perf_counter()
+    db_time = metrics.db_time
+    try:
+        yield
+    finally:
+        metrics.sections[section] += perf_counter() - started - (metrics.db_time - db_time)
+
+
+class RequestMetricsMiddleware:
+    """Count the queries and database time of every request, along with the sections measured with timed()
+
+    They are sent in the Server-Timing header (with SERVER_TIMING_HEADER) and logged as structured fields, with
+    the fingerprints of the queries when a request makes more than REQUEST_QUERY_THRESHOLD queries. Queries of
+    streaming responses made after the response starts are not counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def start(self):
+        metrics = RequestMetrics()
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics))
+        return metrics, stack
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, stack = self.start()
+        token = _metrics.set(metrics)
+        try:
+            with stack:
+                response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        # Started in the thread the sync parts of the request (and the async ORM) run in, which has its own connections
+        metrics, stack = await sync_to_async(self.start)()
+        token = _metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _metrics.reset(token)
+            await sync_to_async(stack.close)()
+        self.report(request, response, metrics)
+        return response
+
+    def report(self, request, response, metrics):
+        timings = metrics.get_timings()
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={duration}' + (f';desc="{metrics.queries} queries"' if name == 'db' else '')
+                for name, duration in timings.items()
+            )
+        extra = {
+            'method': request.method,
+            'path': request.path,
+            'status_code': response.status_code,
+            'queries': metrics.queries,
+            **{f'{name}_ms': duration for name, duration in timings.items()},
+        }
+        logger.info(f'{request.method} {request.path} made {metrics.queries} queries', extra=extra)
+        if metrics.queries > settings.REQUEST_QUERY_THRESHOLD:
+            extra['fingerprints'] = [{'sql': sql, 'count': count} for sql, count in metrics.fingerprints.most_common()]
+            logger.warning(f'{request.method} {request.path} made {metrics.queries} queries, more than '
+                           f'{settings.REQUEST_QUERY_THRESHOLD}', extra=extra)
@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from bringel.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('store.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('oauth2/', include('oauth2_provider.urls', namespace='oauth2_provider')),
 ]
@@ -11,6 +11,8 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from bringel.health import HealthCheckWSGIMiddleware
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bringel.settings')
 
-application = get_wsgi_application()
+application = HealthCheckWSGIMiddleware(get_wsgi_application())
@@ -26,7 +26,8 @@ class SupplierAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    readonly_fields = ['rating']
+    readonly_fields = ['rating', 'rating_count', 'rating_sum', 'rating_1_count', 'rating_2_count', 'rating_3_count',
+                       'rating_4_count', 'rating_5_count']
 
 
 @admin.register(ProductVariant)
@@ -0,0 +1,97 @@
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import Http404
+from django.views import View
+from rest_framework.response import Response
+
+from store.api.planner import plan_queryset
+from store.api.serializers import SimpleProductSerializer, ProductDetailSerializer
+from store.api.viewsets import TagViewSet, ProductViewSet, ProductVariantViewSet
+
+
+class AsyncReadView(View):
+    """Async list and retrieve of a catalog viewset, fetching the rows with the async ORM
+
+    Authentication, permissions, filters, restql planning, pagination and serializers are the ones of the viewset,
+    so both paths answer the same. The view must only serialize prefetched data, any lazy query would fail with
+    SynchronousOnlyOperation.
+    """
+    viewset_class = None
+    viewset_initkwargs = {}
+    http_method_names = ['get']
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Async views can not run inside ATOMIC_REQUESTS transactions, and reads do not need one
+        return transaction.non_atomic_requests(super().as_view(**initkwargs))
+
+    def get_viewset(self, request):
+        action = 'retrieve' if self.is_detail() else 'list'
+        viewset = self.viewset_class(args=self.args, kwargs=self.kwargs, format_kwarg=None, action_map={'get': action},
+                                     **self.viewset_initkwargs)
+        viewset.request = viewset.initialize_request(request, *self.args, **self.kwargs)
+        viewset.headers = viewset.default_response_headers
+        return viewset
+
+    def prepare(self, viewset, request):
+        # Authentication may fall back to the database and filters validate their choices with queries
+        viewset.initial(request)
+        return viewset.filter_queryset(viewset.get_queryset())
+
+    async def get(self, request, *args, **kwargs):
+        viewset = self.get_viewset(request)
+        try:
+            queryset = await sync_to_async(self.prepare)(viewset, viewset.request)
+            if self.is_detail():
+                response = await self.retrieve(viewset, queryset)
+            else:
+                response = await self.list(viewset, queryset)
+        except Exception as exc:
+            response = viewset.handle_exception(exc)
+        return viewset.finalize_response(viewset.request, response).render()
+
+    def is_detail(self):
+        return 'pk' in self.kwargs
+
+    async def get_object(self, viewset, queryset):
+        lookup_url_kwarg = viewset.lookup_url_kwarg or viewset.lookup_field
+        try:
+            instance = await queryset.aget(**{viewset.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except queryset.model.DoesNotExist:
+            raise Http404
+        viewset.check_object_permissions(viewset.request, instance)
+        return instance
+
+    async def list(self, viewset, queryset):
+        page = await viewset.paginator.apaginate_queryset(queryset, viewset.request, viewset)
+        if page is None:
+            page = [obj async for obj in queryset]
+            return Response(viewset.get_serializer(page, many=True).data)
+        return viewset.get_paginated_response(viewset.get_serializer(page, many=True).data)
+
+    async def retrieve(self, viewset, queryset):
+        instance = await self.get_object(viewset, queryset)
+        return Response(viewset.get_serializer(instance).data)
+
+
+class AsyncTagView(AsyncReadView):
+    viewset_class = TagViewSet
+
+
+class AsyncProductVariantView(AsyncReadView):
+    viewset_class = ProductVariantViewSet
+
+
+class AsyncProductView(AsyncReadView):
+    viewset_class = ProductViewSet
+
+
+class AsyncProductDetailView(AsyncReadView):
+    viewset_class = ProductViewSet
+    viewset_initkwargs = {'serializer_class': ProductDetailSerializer}
+
+    async def retrieve(self, viewset, queryset):
+        product = await self.get_object(viewset, queryset)
+        related_products = plan_queryset(product.related_products, SimpleProductSerializer())
+        product.top_related_products = [related async for related in related_products]
+        return Response(viewset.get_serializer(product).data)
@@ -0,0 +1,41 @@
+import jwt
+from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from bringel.jwt import decode_access_token, is_jti_revoked
+
+
+class JWTAuthentication(OAuth2Authentication):
+    """Verify JWT access tokens locally from their signature, expiry and scope claims
+
+    Tokens issued before the scope claim existed (or that are not JWTs) fall back to the AccessToken lookup of
+    OAuth2Authentication.
+    """
+
+    def get_bearer_token(self, request):
+        authorization = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(authorization) != 2 or authorization[0].lower() != 'bearer':
+            return None
+        return authorization[1]
+
+    def authenticate(self, request):
+        token = self.get_bearer_token(request)
+        if token is None:
+            return None
+        try:
+            access_token = decode_access_token(token)
+        except jwt.DecodeError:
+            return super().authenticate(request)
+        except jwt.InvalidTokenError:
+            raise AuthenticationFailed('Invalid or expired token.')
+        if access_token is None:
+            return super().authenticate(request)
+        if is_jti_revoked(access_token.jti):
+            raise AuthenticationFailed('Token has been revoked.')
+        if access_token.user_id is None:
+            return None, access_token  # As OAuth2Authentication for applications without owner
+        # The user is only loaded when the view actually uses it
+        user = SimpleLazyObject(lambda: get_user_model().objects.get(pk=access_token.user_id))
+        return user, access_token
@@ -0,0 +1,87 @@
+from django.db import transaction
+
+from store.api.serializers import ProductVariantBulkItemSerializer
+from store.cache import invalidate_products
+from store.models import Product, ProductVariant, PriceHistory
+
+BULK_MAX_ITEMS = 10000
+BULK_UPDATE_FIELDS = ['product', 'variant_name', 'variant_value', 'in_stock', 'price']
+
+
+def validate_product_variants(items):
+    """Validate the items without touching the database, returns the valid ones keyed by SKU and the errors"""
+    valid = {}
+    errors = []
+    for index, item in enumerate(items):
+        serializer = ProductVariantBulkItemSerializer(data=item)
+        if not serializer.is_valid():
+            errors.append({'index': index, 'sku': item.get('sku') if isinstance(item, dict) else None,
+                           'errors': serializer.errors})
+            continue
+        data = serializer.validated_data
+        if data['sku'] in valid:
+            errors.append({'index': index, 'sku': data['sku'], 'errors': {'sku': ['Duplicated SKU in request.']}})
+            continue
+        valid[data['sku']] = (index, data)
+    return valid, errors
+
+
+def upsert_product_variants(items):
+    """Create or update the product variants keyed by SKU and write price history of the changed prices
+
+    Products are checked with one query, existing SKUs are read (and locked) with another one, variants are upserted
+    with a single INSERT ... ON CONFLICT, versions are bumped with one UPDATE per model and price history is written
+    with a single INSERT.
+    """
+    valid, errors = validate_product_variants(items)
+    product_ids = {data['product'] for _, data in valid.values()}
+    existing_products = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+    for sku, (index, data) in list(valid.items()):
+        if data['product'] not in existing_products:
+            errors.append({'index': index, 'sku': sku, 'errors': {'product': [f'Invalid pk "{data["product"]}".']}})
+            del valid[sku]
+
+    with transaction.atomic():
+        existing = ProductVariant.objects.select_for_update().filter(sku__in=valid).values_list(
+            'sku', 'price', 'product_id'
+        )
+        existing_prices = {}
+        touched_products = {data['product'] for _, data in valid.values()}
+        for sku, price, product_id in existing:
+            existing_prices[sku] = price
+            touched_products.add(product_id)
+        variants = [
+            ProductVariant(
+                sku=sku,
+                product_id=data['product'],
+                variant_name=data['variant_name'],
+                variant_value=data['variant_value'],
+                in_stock=data['in_stock'],
+                price=data['price'],
+            )
+            for sku, (_, data) in valid.items()
+        ]
+        ProductVariant.objects.bulk_create(
+            variants,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['sku'],
+            update_fields=BULK_UPDATE_FIELDS,
+        )
+        # The upsert bypasses the save signals, so the versions seen by conditional requests are bumped here
+        ProductVariant.objects.filter(sku__in=existing_prices).touch()
+        Product.objects.filter(id__in=touched_products).touch()
+        invalidate_products(touched_products)
+        changed = [sku for sku, (_, data) in valid.items() if existing_prices.get(sku) != data['price']]
+        variant_ids = dict(ProductVariant.objects.filter(sku__in=changed).values_list('sku', 'id'))
+        PriceHistory.objects.bulk_create(
+            [PriceHistory(product_variant_id=variant_ids[sku], price=valid[sku][1]['price']) for sku in changed],
+            batch_size=1000,
+        )
+
+    return {
+        'created': len(valid) - len(existing_prices),
+        'updated': len(existing_prices),
+        'price_changes': len(changed),
+        'errors': sorted(errors, key=lambda error: error['index']),
+    }
@@ -0,0 +1,54 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+from rest_framework.response import Response
+
+from bringel.db.routers import reads_from_replicas
+from store.cache import get_or_render, recently_written, response_key
+
+
+class ResponseCacheMixin:
+    """Cache the data of successful list, retrieve and detailed responses of products
+
+    Object responses are keyed by product, list responses by their path, and both by their sorted query parameters
+    and accepted media type. They are dropped by store.cache.invalidate_products, called from the signals and tasks
+    that change products. Reads from the replicas skip the cache for READ_YOUR_WRITES_WINDOW seconds after a change,
+    as a lagging replica would cache the old data under the new generation and serve it to the clients reading their
+    own writes from the primary.
+    """
+
+    def cached_response(self, request, scope, handler, product_id=None):
+        if not settings.RESPONSE_CACHE:
+            return handler()
+        if product_id is not None:
+            try:
+                product_id = int(product_id)  # "05" must share the key invalidated for product 5
+            except ValueError:
+                return handler()
+        if reads_from_replicas() and recently_written(product_id):
+            response = handler()
+            response['X-Cache'] = 'BYPASS'
+            return response
+        # Every query parameter may change the response (restql selection, filters, pagination), in any order
+        params = urlencode(sorted((name, value) for name, values in request.query_params.lists() for value in values))
+        variant = f'{request.path if product_id is None else ""}?{params}|{request.accepted_media_type}'
+        rendered = []
+
+        def render():
+            response = handler()
+            rendered.append(response)
+            return response.data if response.status_code == 200 else None
+
+        data, hit = get_or_render(response_key(scope, variant, product_id), render)
+        response = rendered[0] if rendered else Response(data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        handler = super().list
+        return self.cached_response(request, 'list', lambda: handler(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        handler = super().retrieve
+        product_id = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.cached_response(request, 'retrieve', lambda: handler(request, *args, **kwargs), product_id)
@@ -0,0 +1,204 @@
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.db.models import ForeignObjectRel, ManyToManyRel
+from django.db.models.manager import BaseManager
+from rest_framework.fields import SkipField, SerializerMethodField, IntegerField, CharField, FloatField, BooleanField
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import PKOnlyObject, ManyRelatedField, PrimaryKeyRelatedField, SlugRelatedField, \
+    RelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer, ModelSerializer
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+
+SKIP = object()
+
+# Fields whose to_representation only casts the model value
+CASTS = {IntegerField: int, CharField: str, FloatField: float, BooleanField: bool}
+
+
+def compile_serializer(serializer):
+    """Return a function rendering an instance exactly as serializer.to_representation, for reads only
+
+    The fields are the ones the serializer will render, after the restql selection of DynamicFieldsMixin, so they
+    are resolved (and restql errors raised) once instead of on every row. Model fields, relations and nested
+    serializers read the instance directly, SerializerMethodFields with a PrefetchHint render the prefetched rows
+    with the compiled hint serializer and every other field goes through the DRF field as usual.
+    """
+    if getattr(serializer, 'dynamic_fields_mixin_kwargs', {}).get('return_pk'):
+        return attrgetter('pk')
+    if hasattr(serializer, 'is_ready_to_use_dynamic_fields'):
+        serializer.is_ready_to_use_dynamic_fields = True  # As DynamicFieldsMixin.to_representation does
+    steps = [(field.field_name, _compile_field(serializer, field))
+             for field in serializer.fields.values() if not field.write_only]
+
+    def render(instance):
+        ret = {}
+        for name, step in steps:
+            value = step(instance)
+            if value is not SKIP:
+                ret[name] = value
+        return ret
+
+    return render
+
+
+def _generic_step(field):
+    # Serializer.to_representation for a single field
+    def step(instance):
+        try:
+            attribute = field.get_attribute(instance)
+        except SkipField:
+            return SKIP
+        check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+        return None if check_for_none is None else field.to_representation(attribute)
+
+    return step
+
+
+def _model_field(serializer, field):
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    if model is None or len(field.source_attrs) != 1:
+        return None
+    try:
+        return model._meta.get_field(field.source_attrs[0])
+    except FieldDoesNotExist:
+        return None  # Properties and other attributes, which may be callables
+
+
+def _attribute_step(source, convert, fallback):
+    def step(instance):
+        try:
+            value = getattr(instance, source)
+        except (AttributeError, ObjectDoesNotExist):
+            return fallback(instance)  # Defaults, allow_null and SkipField are handled by the field
+        return None if value is None else convert(value)
+
+    return step
+
+
+def _method_step(serializer, field):
+    method = getattr(serializer, field.method_name)
+    hint = getattr(serializer, 'prefetch_hints', {}).get(field.field_name)
+    if hint is None or hint.serializer_class is None or hint.to_attr is None:
+        return method
+    # Hinted methods render the prefetched rows with the hint serializer, built without context like they do
+    render_row = compile_serializer(hint.serializer_class())
+    to_attr = hint.to_attr
+
+    def step(instance):
+        rows = getattr(instance, to_attr, None)
+        if rows is None:
+            return method(instance)  # Not prefetched, the method queries them
+        return [render_row(row) for row in rows]
+
+    return step
+
+
+def _many_step(render_item):
+    def convert(value):
+        if isinstance(value, BaseManager):
+            value = value.all()
+        return [render_item(item) for item in value]
+
+    return convert
+
+
+def _prefetch_cache_name(model_field):
+    # The key of _prefetched_objects_cache used by the related manager
+    if isinstance(model_field, ManyToManyRel):
+        return model_field.field.related_query_name()
+    if isinstance(model_field, ForeignObjectRel):
+        return model_field.get_cache_name()
+    return model_field.name
+
+
+def _related_step(model_field, source, render_item, fallback):
+    cache_name = _prefetch_cache_name(model_field)
+    related_step = _attribute_step(source, _many_step(render_item), fallback)
+
+    def step(instance):
+        # Prefetched rows are read straight from the cache, skipping the related manager and queryset clone
+        try:
+            rows = instance._prefetched_objects_cache[cache_name]
+        except (AttributeError, KeyError):
+            return related_step(instance)
+        return [render_item(row) for row in rows]
+
+    return step
+
+
+def _compile_field(serializer, field):
+    if isinstance(field, SerializerMethodField):
+        return _method_step(serializer, field)
+    generic = _generic_step(field)
+    model_field = _model_field(serializer, field)
+    if model_field is None:
+        return generic
+    source = field.source_attrs[0]
+    field_class = type(field)
+    if field_class in CASTS:
+        return _attribute_step(source, CASTS[field_class], generic)
+    if field_class is PrimaryKeyRelatedField and field.pk_field is None and model_field.many_to_one:
+        return _attribute_step(model_field.attname, lambda value: value, generic)
+    if field_class is SlugRelatedField:
+        return _attribute_step(source, attrgetter(field.slug_field.replace('__', '.')), generic)
+    many_related = model_field.many_to_many or model_field.one_to_many
+    if field_class is ManyRelatedField and many_related:
+        child = field.child_relation
+        if type(child) is SlugRelatedField:
+            render_item = attrgetter(child.slug_field.replace('__', '.'))
+        else:
+            render_item = child.to_representation
+        related_step = _related_step(model_field, source, render_item, generic)
+
+        def step(instance):
+            if getattr(instance, 'pk', None) is None:
+                return []  # Unsaved instances have no relations yet
+            return related_step(instance)
+
+        return step
+    if isinstance(field, ListSerializer) and isinstance(field.child, ModelSerializer) and many_related:
+        return _related_step(model_field, source, compile_serializer(field.child), generic)
+    if isinstance(field, ModelSerializer):
+        return _attribute_step(source, compile_serializer(field), generic)
+    if isinstance(field, (BaseSerializer, RelatedField, ManyRelatedField)):
+        return generic  # Other relations may need more than the attribute, e.g. PKOnlyObject or __str__
+    return _attribute_step(source, field.to_representation, generic)
+
+
+class CompiledSerializer:
+    """Read only stand-in for a serializer, whose data is rendered by compile_serializer
+
+    Every other attribute is the one of the wrapped serializer, and data is still a ReturnDict or ReturnList
+    pointing to it (the browsable API reads its forms from there).
+    """
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    def __getattr__(self, name):
+        return getattr(self.serializer, name)
+
+    @property
+    def data(self):
+        serializer = self.serializer
+        if isinstance(serializer, ListSerializer):
+            render = compile_serializer(serializer.child)
+            instances = serializer.instance
+            if isinstance(instances, BaseManager):
+                instances = instances.all()
+            return ReturnList([render(instance) for instance in instances], serializer=serializer)
+        return ReturnDict(compile_serializer(serializer)(serializer.instance), serializer=serializer)
+
+
+class CompiledSerializerMixin:
+    """Viewset mixin rendering the read actions listed in compiled_actions with compiled serializers"""
+    compiled_actions = ()
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        compiled = settings.COMPILED_SERIALIZERS and self.action in self.compiled_actions
+        if compiled and self.request.method in SAFE_METHODS and serializer.instance is not None:
+            return CompiledSerializer(serializer)
+        return serializer
@@ -0,0 +1,60 @@
+from hashlib import md5
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """Answer If-None-Match / If-Modified-Since with 304 after a single aggregate query, before serializing
+
+    List ETags are built from the count, the sum of versions and the last modification of the filtered queryset, so
+    any change, insert or delete of a listed row gives a new ETag. Last-Modified is only sent for single objects
+    because deletes do not move the last modification of a list forward.
+    """
+    last_modified_field = 'updated_at'
+    version_field = 'version'
+
+    def get_conditional_aggregates(self):
+        aggregates = {'count': Count('pk'), 'last_modified': Max(self.last_modified_field)}
+        if self.version_field is not None:
+            aggregates['version'] = Sum(self.version_field)
+        return aggregates
+
+    def get_conditional_state(self, queryset):
+        return queryset.order_by().aggregate(**self.get_conditional_aggregates())
+
+    def get_object_queryset(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        return queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+
+    def get_etag(self, request, state):
+        # The same URL may render differently per media type (json, api, ...)
+        media_type = getattr(request, 'accepted_media_type', '')
+        values = '|'.join(str(value) for _, value in sorted(state.items()))
+        return quote_etag(md5(f'{request.get_full_path()}|{media_type}|{values}'.encode()).hexdigest())
+
+    def conditional_response(self, request, state, handler, send_last_modified):
+        if not state['count']:
+            return handler()  # Let the handler answer the empty list or the 404
+        etag = self.get_etag(request, state)
+        last_modified = int(state['last_modified'].timestamp()) if send_last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        state = self.get_conditional_state(self.filter_queryset(self.get_queryset()))
+        handler = super().list
+        return self.conditional_response(request, state, lambda: handler(request, *args, **kwargs), False)
+
+    def retrieve(self, request, *args, **kwargs):
+        state = self.get_conditional_state(self.get_object_queryset())
+        handler = super().retrieve
+        return self.conditional_response(request, state, lambda: handler(request, *args, **kwargs), True)
@@ -0,0 +1,170 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, DateTimeField
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over the model Meta.ordering with an id tie-breaker
+
+    Foreign keys in the ordering are compared by their column (e.g. product_id) so every page is a single range
+    scan over the matching composite index, no matter how deep the cursor is.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    max_limit = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, queryset):
+        ordering = []
+        self.datetime_names = set()
+        for field_name in queryset.model._meta.ordering:
+            descending = field_name.startswith('-')
+            field = queryset.model._meta.get_field(field_name.lstrip('-'))
+            ordering.append((field.attname, descending))
+            if isinstance(field, DateTimeField):
+                self.datetime_names.add(field.attname)
+        if not any(name == 'id' for name, _ in ordering):
+            descending = ordering[0][1] if ordering else False
+            ordering.append(('id', descending))
+        return ordering
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        return min(max(limit, 1), self.max_limit)
+
+    def encode_cursor(self, position):
+        # DjangoJSONEncoder cuts datetimes to milliseconds, which would skip the rows of the rest of the millisecond
+        position = [value.isoformat(timespec='microseconds') if isinstance(value, datetime) else value
+                    for value in position]
+        return urlsafe_b64encode(json.dumps(position, cls=DjangoJSONEncoder).encode()).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(cursor.encode()))
+        except (BinasciiError, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        for index, (name, _) in enumerate(self.ordering):
+            if name in self.datetime_names:
+                try:
+                    position[index] = parse_datetime(position[index])
+                except (TypeError, ValueError):
+                    position[index] = None
+                if position[index] is None:
+                    raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_keyset_filter(self, position):
+        """Build (a > x) OR (a = x AND b > y) OR ... honoring the direction of each column"""
+        keyset_filter = Q()
+        equals = {}
+        for (name, descending), value in zip(self.ordering, position):
+            lookup = 'lt' if descending else 'gt'
+            keyset_filter |= Q(**equals, **{f'{name}__{lookup}': value})
+            equals[name] = value
+        return keyset_filter
+
+    def get_page_queryset(self, queryset, request):
+        """Return the queryset of the page plus one row, that tells whether there is a next page"""
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        self.limit = self.get_limit(request)
+        position = self.decode_cursor(request)
+        queryset = queryset.order_by(*[f'-{name}' if descending else name for name, descending in self.ordering])
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(position))
+        return queryset[:self.limit + 1]
+
+    def get_page(self, results):
+        self.has_next = len(results) > self.limit
+        results = results[:self.limit]
+        self.next_position = [getattr(results[-1], name) for name, _ in self.ordering] if results else None
+        return results
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.get_page([obj async for obj in self.get_page_queryset(queryset, request)])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class CatalogPagination(LimitOffsetPagination):
+    """Limit/offset pagination that switches to keyset pagination when the request sends a cursor (even empty)"""
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() with the async ORM"""
+        self.keyset = None
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [obj async for obj in queryset[self.offset:self.offset + self.limit]]
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append({
+            'name': self.keyset_pagination_class.cursor_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Opt in to keyset pagination, send it empty for the first page',
+            'schema': {'type': 'string'},
+        })
+        return parameters
@@ -8,10 +8,11 @@ class TokenHasAdminScope(TokenHasScope):
 
 
 class UserReadsAdminWrites(IsAuthenticatedOrReadOnly):
+    admin_scope = TokenHasAdminScope()
+
     def is_oauth2_authenticated(self, request):
         return isinstance(request.successful_authenticator, OAuth2Authentication)
 
     def has_permission(self, request, view):
         is_read = request.method in SAFE_METHODS and self.is_oauth2_authenticated(request)
-        is_admin = TokenHasAdminScope().has_permission(request, view)
-        return is_read or is_admin
+        return is_read or self.admin_scope.has_permission(request, view)
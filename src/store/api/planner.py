@@ -0,0 +1,155 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, ManyToOneRel
+from django_restql.exceptions import QueryFormatError
+from django_restql.parser import Query, QueryParser
+from django_restql.settings import restql_settings
+from rest_framework.fields import SerializerMethodField
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import ManyRelatedField, RelatedField, SlugRelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer, ModelSerializer
+
+
+class PrefetchHint:
+    """Tells the planner which relation a SerializerMethodField reads
+
+    The rows are prefetched into ``to_attr`` (limited to the first ``limit`` rows per instance) and planned with
+    ``serializer_class`` when it is given. With both, compiled serializers render the prefetched rows with
+    ``serializer_class`` instead of calling the method, which must do the same.
+    """
+
+    def __init__(self, lookup, serializer_class=None, to_attr=None, limit=None):
+        self.lookup = lookup
+        self.serializer_class = serializer_class
+        self.to_attr = to_attr
+        self.limit = limit
+
+    def prefetch(self, model, prefix=''):
+        model_field = model._meta.get_field(self.lookup)
+        queryset = model_field.related_model._default_manager.all()
+        if self.serializer_class is not None:
+            queryset = plan_queryset(queryset, self.serializer_class(), required=_remote_fields(model_field))
+        if self.limit is not None:
+            queryset = queryset[:self.limit]
+        return Prefetch(prefix + self.lookup, queryset=queryset, to_attr=self.to_attr)
+
+
+class QueryPlan:
+    def __init__(self):
+        self.select_related = []
+        self.prefetch_related = []
+        self.only = []
+        self.load_all_fields = False
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.only and not self.load_all_fields:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+
+def get_parsed_restql_query(request):
+    raw_query = request.query_params.get(restql_settings.QUERY_PARAM_NAME)
+    if raw_query is None:
+        return None
+    try:
+        return QueryParser().parse(raw_query)
+    except (SyntaxError, QueryFormatError):
+        return None  # DynamicFieldsMixin reports the error to the client
+
+
+def selected_fields(serializer, parsed_query=None):
+    """Return (name, field, nested parsed query) for every field the serializer will render"""
+    fields = {name: field for name, field in serializer.fields.items() if not field.write_only}
+    if parsed_query is None:
+        return [(name, field, None) for name, field in fields.items()]
+    nested_queries = {item.field_name: item for item in parsed_query.included_fields if isinstance(item, Query)}
+    included = {item for item in parsed_query.included_fields if not isinstance(item, Query)}
+    included.update(nested_queries)
+    if parsed_query.excluded_fields:
+        names = [name for name in fields if name not in parsed_query.excluded_fields]
+    elif '*' in included:
+        names = list(fields)
+    else:
+        names = [name for name in fields if name in included]
+    return [(name, fields[name], nested_queries.get(name)) for name in names]
+
+
+def plan_queryset(queryset, serializer, parsed_query=None, required=()):
+    """Apply select_related, prefetch_related and only() needed to render queryset with serializer"""
+    plan = QueryPlan()
+    plan.only.extend(required)
+    _plan_serializer(plan, queryset.model, serializer, parsed_query)
+    return plan.apply(queryset)
+
+
+def _remote_fields(model_field):
+    # Reverse foreign keys are matched back to their parent through the FK column, so it must be loaded
+    if isinstance(model_field, ManyToOneRel):
+        return [model_field.field.name]
+    return []
+
+
+def _plan_serializer(plan, model, serializer, parsed_query, prefix=''):
+    hints = getattr(serializer, 'prefetch_hints', {})
+    for name, field, nested_query in selected_fields(serializer, parsed_query):
+        if isinstance(field, SerializerMethodField):
+            if name in hints:
+                plan.prefetch_related.append(hints[name].prefetch(model, prefix))
+            else:
+                plan.load_all_fields = True  # Unknown method, it may read any column
+            continue
+        source_attrs = getattr(field, 'source_attrs', [])
+        if len(source_attrs) != 1:
+            plan.load_all_fields = True  # source='*' or dotted sources
+            continue
+        try:
+            model_field = model._meta.get_field(source_attrs[0])
+        except FieldDoesNotExist:
+            plan.load_all_fields = True  # Properties and other plain attributes
+            continue
+        lookup = prefix + model_field.name
+        if isinstance(field, (ManyRelatedField, ListSerializer)):
+            plan.prefetch_related.append(_prefetch(model_field, field, nested_query, lookup))
+        elif isinstance(field, RelatedField):
+            plan.only.append(lookup)
+            if field.use_pk_only_optimization():
+                continue
+            plan.select_related.append(lookup)
+            if isinstance(field, SlugRelatedField):
+                plan.only.append(f'{lookup}__{field.slug_field}')
+            else:
+                plan.load_all_fields = True  # e.g. StringRelatedField calls __str__
+        elif isinstance(field, BaseSerializer):
+            plan.only.append(lookup)
+            plan.select_related.append(lookup)
+            _plan_serializer(plan, model_field.related_model, field, nested_query, prefix=f'{lookup}__')
+        else:
+            plan.only.append(lookup)
+
+
+def _prefetch(model_field, field, parsed_query, lookup):
+    queryset = model_field.related_model._default_manager.all()
+    required = _remote_fields(model_field)
+    if isinstance(field, ManyRelatedField):
+        child = field.child_relation
+        if isinstance(child, SlugRelatedField):
+            queryset = queryset.only('pk', child.slug_field, *required)
+        elif child.use_pk_only_optimization():
+            queryset = queryset.only('pk', *required)
+    elif isinstance(field.child, ModelSerializer):
+        queryset = plan_queryset(queryset, field.child, parsed_query, required=required)
+    return Prefetch(lookup, queryset=queryset)
+
+
+class QueryPlannerMixin:
+    """Viewset mixin that plans get_queryset() of read requests from the serializer and the restql query"""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset  # Writes save every loaded field, so they must not see deferred ones
+        serializer = self.get_serializer_class()()
+        return plan_queryset(queryset, serializer, get_parsed_restql_query(self.request))
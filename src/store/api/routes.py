@@ -1,5 +1,7 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
+from store.api.asynchronous import AsyncTagView, AsyncProductVariantView, AsyncProductView, AsyncProductDetailView
 from store.api.viewsets import TagViewSet, SupplierViewSet, ProductViewSet, ProductVariantViewSet, CustomerRatingViewset
 
 router = DefaultRouter()
@@ -8,3 +10,13 @@ router.register(r'suppliers', SupplierViewSet)
 router.register(r'products/variants', ProductVariantViewSet)
 router.register(r'products/rating', CustomerRatingViewset)
 router.register(r'products', ProductViewSet)
+
+async_urlpatterns = [
+    path('tags/', AsyncTagView.as_view()),
+    path('tags/<int:pk>/', AsyncTagView.as_view()),
+    path('products/variants/', AsyncProductVariantView.as_view()),
+    path('products/variants/<int:pk>/', AsyncProductVariantView.as_view()),
+    path('products/', AsyncProductView.as_view()),
+    path('products/<int:pk>/', AsyncProductView.as_view()),
+    path('products/<int:pk>/detailed/', AsyncProductDetailView.as_view()),
+]
@@ -1,11 +1,12 @@
 from django_restql.mixins import DynamicFieldsMixin
 from drf_yasg.utils import swagger_serializer_method
 from rest_framework.fields import CharField, FloatField, IntegerField, BooleanField, DecimalField, DateTimeField, \
-    SerializerMethodField
+    SerializerMethodField, ListField, DictField
 from rest_framework.relations import SlugRelatedField, PrimaryKeyRelatedField
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import ModelSerializer, Serializer
 from rest_framework.validators import UniqueValidator
 
+from store.api.planner import PrefetchHint, plan_queryset
 from store.models import Tag, Supplier, ProductVariant, Product, CustomerRating, PriceHistory
 
 
@@ -53,13 +54,60 @@ class ProductVariantSerializer(DynamicFieldsMixin, ModelSerializer):
     price = DecimalField(label='Price', max_digits=8, decimal_places=2, required=True)
     price_history = SerializerMethodField(label='Price History', read_only=True)
 
+    prefetch_hints = {
+        'price_history': PrefetchHint('price_history', PriceHistorySerializer, to_attr='last_price_history', limit=10),
+    }
+
     @swagger_serializer_method(serializer_or_field=PriceHistorySerializer(many=True))
     def get_price_history(self, instance):
-        query = instance.price_history.all()[:10]  # Only show last 10 prices
+        query = getattr(instance, 'last_price_history', None)
+        if query is None:
+            query = instance.price_history.all()[:10]  # Only show last 10 prices
         serializer = PriceHistorySerializer(query, many=True)
         return serializer.data
 
 
+class ProductVariantBulkItemSerializer(Serializer):
+    class Meta:
+        ref_name = 'ProductVariantBulkItem'
+    sku = CharField(label='SKU', help_text='SKU code, used as the upsert key', max_length=8, required=True)
+    product = IntegerField(label='Product', help_text='Product ID', required=True)
+    variant_name = CharField(label='Variant Name', help_text='Name of variant', max_length=20, required=True)
+    variant_value = CharField(label='Variant Value', help_text='Value of variant', max_length=50, required=True)
+    in_stock = BooleanField(label='In Stock', help_text='', default=False)
+    price = DecimalField(label='Price', max_digits=8, decimal_places=2, required=True)
+
+
+class ProductVariantBulkResultSerializer(Serializer):
+    class Meta:
+        ref_name = 'ProductVariantBulkResult'
+    created = IntegerField(help_text='Variants created', read_only=True)
+    updated = IntegerField(help_text='Variants updated', read_only=True)
+    price_changes = IntegerField(help_text='Price history rows written', read_only=True)
+    errors = ListField(child=DictField(), help_text='Index, SKU and errors of each rejected item', read_only=True)
+
+
+class CatalogImportVariantSerializer(Serializer):
+    class Meta:
+        ref_name = 'CatalogImportVariant'
+    sku = CharField(label='SKU', help_text='SKU code, used as the upsert key', max_length=8, required=True)
+    variant_name = CharField(label='Variant Name', help_text='Name of variant', max_length=20, required=True)
+    variant_value = CharField(label='Variant Value', help_text='Value of variant', max_length=50, required=True)
+    in_stock = BooleanField(label='In Stock', help_text='', default=False)
+    price = DecimalField(label='Price', max_digits=8, decimal_places=2, required=True)
+
+
+class CatalogImportProductSerializer(Serializer):
+    class Meta:
+        ref_name = 'CatalogImportProduct'
+    supplier = CharField(help_text='Supplier Name', max_length=100, required=True)
+    name = CharField(label='Name', help_text='Product name, unique by supplier', max_length=50, required=True)
+    description = CharField(label='Description', required=True)
+    tags = ListField(child=CharField(max_length=50), help_text='Tag Names, replacing the ones of the product',
+                     default=list)
+    variants = CatalogImportVariantSerializer(many=True, required=False)
+
+
 class ProductVariantNestedSerializer(DynamicFieldsMixin, ModelSerializer):
     class Meta:
         model = ProductVariant
@@ -89,6 +137,16 @@ class SimpleProductSerializer(ProductSerializer):
         fields = ['id', 'supplier', 'name', 'description', 'tags', 'rating']
 
 
+class ProductSearchSerializer(ProductSerializer):
+    class Meta:
+        model = Product
+        fields = ['id', 'supplier', 'name', 'description', 'tags', 'rating', 'variants', 'rank', 'snippet']
+        ref_name = 'ProductSearchResult'
+    rank = FloatField(source='search_rank', help_text='Relevance of the product, higher first', read_only=True)
+    snippet = CharField(source='search_snippet', help_text='Description excerpt with the matches in <b> tags',
+                        read_only=True)
+
+
 class CustomerRatingSerializer(DynamicFieldsMixin, ModelSerializer):
     class Meta:
         model = CustomerRating
@@ -117,13 +175,22 @@ class ProductDetailSerializer(DynamicFieldsMixin, ModelSerializer):
     ratings = SerializerMethodField(label='Ratings', read_only=True)
     related_products = SerializerMethodField(label='Related Products', read_only=True)
 
+    prefetch_hints = {
+        'ratings': PrefetchHint('ratings', CustomerRatingReadSerializer, to_attr='last_ratings', limit=10),
+    }
+
     @swagger_serializer_method(serializer_or_field=CustomerRatingReadSerializer(many=True))
     def get_ratings(self, instance):
-        query = instance.ratings.all()[:10]  # Only show last 10 ratings
+        query = getattr(instance, 'last_ratings', None)
+        if query is None:
+            query = instance.ratings.all()[:10]  # Only show last 10 ratings
         serializer = CustomerRatingReadSerializer(query, many=True)
         return serializer.data
 
     @swagger_serializer_method(serializer_or_field=SimpleProductSerializer(many=True))
     def get_related_products(self, instance):
-        serializer = SimpleProductSerializer(instance.related_products, many=True)
+        query = getattr(instance, 'top_related_products', None)
+        if query is None:
+            query = plan_queryset(instance.related_products, SimpleProductSerializer())
+        serializer = SimpleProductSerializer(query, many=True)
         return serializer.data
@@ -1,19 +1,42 @@
+import csv
+import random
 from collections import namedtuple
+from datetime import datetime, timezone
 from decimal import Decimal
+from io import BytesIO, StringIO
+from itertools import combinations
+from uuid import uuid4
 from unittest.mock import patch
 
-from django.test import TestCase
+import jwt
+import orjson
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
 from factory.fuzzy import FuzzyText, FuzzyInteger, FuzzyDecimal
 from oauth2_provider.contrib.rest_framework import OAuth2Authentication
-from oauth2_provider.models import Application
-from rest_framework.test import APITestCase, APIClient
+from oauth2_provider.models import AccessToken, Application
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory
 
+from store.api.compiler import compile_serializer, CompiledSerializer
+from store.api.parsers import ORJSONParser
 from store.api.permissions import TokenHasAdminScope, UserReadsAdminWrites
-from store.api.serializers import ProductVariantSerializer, ProductDetailSerializer, SimpleProductSerializer
-from store.api.viewsets import ProductViewSet
+from store.api.planner import plan_queryset
+from store.api.renderers import ORJSONRenderer
+from store.api.serializers import ProductVariantSerializer, ProductDetailSerializer, SimpleProductSerializer, \
+    ProductSerializer
+from store.api.viewsets import ProductViewSet, ProductVariantViewSet, CustomerRatingViewset
+from store.cache import get_stats as get_cache_stats
+from store.explain import find_sequential_scans
 from store.factories import ProductVariantFactory, PriceHistoryFactory, CustomerRatingFactory, ProductFactory, \
     TagFactory
-from store.models import Tag, PriceHistory
+from store.models import Tag, PriceHistory, Product, ProductVariant, Supplier, CustomerRating
 
 
 class TagAPITestCase(APITestCase):
@@ -115,8 +138,7 @@ class ProductDetailSerializerTestCase(TestCase):
 class ProductViewSetTestCase(TestCase):
     def test_detailed_uses_ProductDetailSerializer(self):
         product = ProductFactory()
-        Request = namedtuple('Request', ['query_params'])
-        request = Request(query_params={})
+        request = Request(APIRequestFactory().get(f'/api/products/{product.id}/detailed/'))
         viewset = ProductViewSet()
         viewset.request = request
         viewset.kwargs = {'pk': product.id}
@@ -293,3 +315,712 @@ class PriceHistoryTestCase(OAuth2AuthMixin, APITestCase):
         for history in response.data['price_history']:
             price_history.append(Decimal(history['price']))
         self.assertEqual(price_history, list(reversed(price_changes)))
+
+
+class QueryPlannerTestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.oauth_headers = self.get_oauth_headers()
+        tags = TagFactory.create_batch(3)
+        for product in ProductFactory.create_batch(12, tags=tags):
+            for product_variant in ProductVariantFactory.create_batch(2, product=product):
+                PriceHistoryFactory.create_batch(2, product_variant=product_variant)
+            CustomerRatingFactory.create_batch(2, product=product)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, headers=self.oauth_headers)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_product_list_queries_does_not_depend_on_page_size(self):
+        self.assertEqual(self.count_queries('/api/products/?limit=2'), self.count_queries('/api/products/?limit=10'))
+
+    def test_product_variant_list_queries_does_not_depend_on_page_size(self):
+        self.assertEqual(
+            self.count_queries('/api/products/variants/?limit=2'),
+            self.count_queries('/api/products/variants/?limit=10'),
+        )
+
+    def test_product_list_with_restql_query_skips_unselected_relations(self):
+        self.assertLess(
+            self.count_queries('/api/products/?query={id, name}'),
+            self.count_queries('/api/products/'),
+        )
+
+    def test_product_detailed_queries_does_not_depend_on_related_products(self):
+        product = Product.objects.first()
+        queries = self.count_queries(f'/api/products/{product.id}/detailed/')
+        ProductFactory.create_batch(5, tags=product.tags.all())
+        self.assertEqual(self.count_queries(f'/api/products/{product.id}/detailed/'), queries)
+
+    def test_planned_product_list_renders_same_data(self):
+        response = self.client.get('/api/products/?query={id, supplier, tags, variants{sku}}',
+                                   headers=self.oauth_headers)
+        product = Product.objects.get(id=response.data['results'][0]['id'])
+        self.assertEqual(response.data['results'][0]['supplier'], product.supplier.name)
+        self.assertEqual(set(response.data['results'][0]['tags']), {tag.name for tag in product.tags.all()})
+        self.assertEqual(len(response.data['results'][0]['variants']), product.variants.count())
+        self.assertEqual(set(response.data['results'][0]['variants'][0]), {'sku'})
+
+    def test_plan_queryset_uses_prefetched_price_history(self):
+        queryset = plan_queryset(ProductVariant.objects.all(), ProductVariantSerializer())
+        with self.assertNumQueries(2):
+            data = ProductVariantSerializer(queryset, many=True).data
+        self.assertEqual(len(data[0]['price_history']), 3)
+
+
+class KeysetPaginationTestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.oauth_headers = self.get_oauth_headers()
+
+    def fetch_all(self, url):
+        results = []
+        pages = 0
+        while url:
+            response = self.client.get(url, headers=self.oauth_headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            results.extend(response.data['results'])
+            url = response.data['next']
+            pages += 1
+        return results, pages
+
+    def test_products_cursor_walks_every_product_once_in_order(self):
+        for name in ['b', 'a', 'c', 'a', 'b', 'a', 'd']:
+            ProductFactory(name=name)
+        results, pages = self.fetch_all('/api/products/?cursor=&limit=2')
+        self.assertEqual(pages, 4)
+        expected = list(Product.objects.order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual([product['id'] for product in results], expected)
+
+    def test_ratings_cursor_is_descending_by_created_at(self):
+        product = ProductFactory()
+        CustomerRatingFactory.create_batch(5, product=product)
+        results, _ = self.fetch_all('/api/products/rating/?cursor=&limit=2')
+        created_at = [rating['created_at'] for rating in results]
+        self.assertEqual(len(created_at), 5)
+        self.assertEqual(created_at, sorted(created_at, reverse=True))
+
+    def test_ratings_cursor_keeps_the_microseconds_of_created_at(self):
+        product = ProductFactory()
+        ratings = CustomerRatingFactory.create_batch(6, product=product)
+        for microsecond, rating in enumerate(ratings):
+            created_at = datetime(2024, 1, 1, 12, 0, 0, 100 + microsecond * 100, tzinfo=timezone.utc)
+            CustomerRating.objects.filter(id=rating.id).update(created_at=created_at, description=str(microsecond))
+        results, pages = self.fetch_all('/api/products/rating/?cursor=&limit=2')
+        self.assertEqual(pages, 3)
+        self.assertEqual([rating['description'] for rating in results], ['5', '4', '3', '2', '1', '0'])
+
+    def test_variants_cursor_returns_every_variant(self):
+        ProductVariantFactory.create_batch(3, product=ProductFactory())
+        ProductVariantFactory.create_batch(2, variant_name='same', variant_value='same')
+        results, _ = self.fetch_all('/api/products/variants/?cursor=&limit=2')
+        self.assertEqual(sorted(variant['id'] for variant in results),
+                         sorted(ProductVariant.objects.values_list('id', flat=True)))
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get('/api/products/?cursor=invalid', headers=self.oauth_headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_limit_offset_is_still_default(self):
+        ProductFactory()
+        response = self.client.get('/api/products/', headers=self.oauth_headers)
+        self.assertEqual(response.data['count'], 1)
+
+
+class ProductVariantBulkTestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_headers = self.get_oauth_headers(admin=True)
+        self.product = ProductFactory()
+
+    def variant(self, sku, price='10.00', **kwargs):
+        payload = {'sku': sku, 'product': self.product.id, 'variant_name': 'size', 'variant_value': 'M',
+                   'price': price}
+        payload.update(kwargs)
+        return payload
+
+    def post(self, payload):
+        return self.client.post('/api/products/variants/bulk/', payload, format='json', headers=self.admin_headers)
+
+    def test_bulk_creates_and_updates_variants_by_sku(self):
+        existing = ProductVariantFactory(sku='EXISTING', price=Decimal('5.00'))
+        response = self.post([self.variant('EXISTING', price='6.00'), self.variant('NEW1'), self.variant('NEW2')])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'created': 2, 'updated': 1, 'price_changes': 3, 'errors': []})
+        existing.refresh_from_db()
+        self.assertEqual(existing.price, Decimal('6.00'))
+        self.assertEqual(existing.product, self.product)
+        self.assertEqual(existing.price_history.count(), 2)
+        self.assertEqual(ProductVariant.objects.get(sku='NEW1').price_history.count(), 1)
+
+    def test_bulk_skips_history_when_price_is_unchanged(self):
+        existing = ProductVariantFactory(sku='EXISTING', price=Decimal('5.00'))
+        response = self.post([self.variant('EXISTING', price='5.00', in_stock=True)])
+        self.assertEqual(response.data['price_changes'], 0)
+        self.assertEqual(existing.price_history.count(), 1)
+
+    def test_bulk_reports_errors_per_item(self):
+        response = self.post([
+            self.variant('OK'),
+            self.variant('BADPROD', product=0),
+            self.variant('OK'),
+            self.variant('TOO_LONG_SKU'),
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3])
+        self.assertIn('product', response.data['errors'][0]['errors'])
+        self.assertIn('sku', response.data['errors'][1]['errors'])
+        self.assertFalse(ProductVariant.objects.filter(sku='BADPROD').exists())
+
+    def test_bulk_requires_a_list(self):
+        response = self.post(self.variant('OK'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_requires_admin(self):
+        response = self.client.post('/api/products/variants/bulk/', [self.variant('OK')], format='json',
+                                    headers=self.get_oauth_headers())
+        self.assertEqual(response.status_code, 403)
+
+    def test_bulk_runs_constant_queries(self):
+        with CaptureQueriesContext(connection) as small:
+            self.post([self.variant(f'S{index}') for index in range(2)])
+        with CaptureQueriesContext(connection) as large:
+            self.post([self.variant(f'L{index}') for index in range(50)])
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+class ConditionalGetTestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.oauth_headers = self.get_oauth_headers()
+        self.tag = TagFactory()
+        self.product = ProductFactory(tags=[self.tag])
+        self.variant = ProductVariantFactory(product=self.product)
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers={**self.oauth_headers, **headers})
+
+    def assertModifiedAfter(self, url, change):
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url, **{'If-None-Match': etag}).status_code, 304)
+        change()
+        response = self.get(url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_retrieve_returns_304_on_matching_etag(self):
+        url = f'/api/products/{self.product.id}/'
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(url, **{'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(len([query for query in queries if 'store_' in query['sql']]), 1)
+
+    def test_retrieve_returns_304_on_if_modified_since(self):
+        url = f'/api/products/{self.product.id}/'
+        last_modified = self.get(url)['Last-Modified']
+        self.assertEqual(self.get(url, **{'If-Modified-Since': last_modified}).status_code, 304)
+
+    def test_list_etag_changes_on_insert_and_delete(self):
+        product = ProductFactory()
+        self.assertModifiedAfter('/api/products/', ProductFactory)
+        self.assertModifiedAfter('/api/products/', product.delete)
+
+    def test_list_does_not_send_last_modified(self):
+        self.assertNotIn('Last-Modified', self.get('/api/products/'))
+
+    def test_list_etag_depends_on_query_params(self):
+        self.assertNotEqual(self.get('/api/products/')['ETag'], self.get('/api/products/?limit=1')['ETag'])
+
+    def test_product_etag_changes_on_variant_price_change(self):
+        def change_price():
+            self.variant.price += 1
+            self.variant.save()
+        self.assertModifiedAfter(f'/api/products/{self.product.id}/', change_price)
+
+    def test_product_etag_changes_on_tag_rename(self):
+        def rename_tag():
+            self.tag.name = 'renamed'
+            self.tag.save()
+        self.assertModifiedAfter(f'/api/products/{self.product.id}/', rename_tag)
+
+    def test_product_etag_changes_on_tag_delete(self):
+        self.assertModifiedAfter(f'/api/products/{self.product.id}/', self.tag.delete)
+
+    def test_detailed_etag_changes_on_rating(self):
+        self.assertModifiedAfter(f'/api/products/{self.product.id}/detailed/',
+                                 lambda: CustomerRatingFactory(product=self.product))
+
+    def test_detailed_etag_changes_on_related_product_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            related = ProductFactory(tags=[self.tag])
+
+        def change_related():
+            related.name = 'renamed'
+            related.save()
+        self.assertModifiedAfter(f'/api/products/{self.product.id}/detailed/', change_related)
+
+    def test_missing_object_is_still_404(self):
+        self.assertEqual(self.get('/api/products/0/').status_code, 404)
+        self.assertEqual(self.get('/api/products/0/detailed/').status_code, 404)
+
+
+@override_settings(RESPONSE_CACHE=True)
+class ResponseCacheTestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.oauth_headers = self.get_oauth_headers()
+        self.tag = TagFactory()
+        self.product = ProductFactory(tags=[self.tag])
+        self.variant = ProductVariantFactory(product=self.product)
+
+    def get(self, url):
+        return self.client.get(url, headers=self.oauth_headers)
+
+    def test_detailed_is_served_from_cache(self):
+        url = f'/api/products/{self.product.id}/detailed/'
+        with CaptureQueriesContext(connection) as miss_queries:
+            miss = self.get(url)
+        with CaptureQueriesContext(connection) as hit_queries:
+            hit = self.get(url)
+        self.assertEqual((miss['X-Cache'], hit['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(hit.json(), miss.json())
+        self.assertEqual(hit['ETag'], miss['ETag'])
+        self.assertLess(len(hit_queries), len(miss_queries))
+
+    def test_restql_selection_is_cached_separately(self):
+        url = f'/api/products/{self.product.id}/'
+        self.get(url)
+        response = self.get(f'{url}?query={{name}}')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json(), {'name': self.product.name})
+
+    def test_every_query_param_is_part_of_the_key(self):
+        other = ProductFactory(tags=[self.tag])
+        url = f'/api/products/{self.product.id}/'
+        first = self.get(f'/api/products/?supplier={self.product.supplier_id}')
+        second = self.get(f'/api/products/?supplier={other.supplier_id}')
+        self.assertEqual(second['X-Cache'], 'MISS')
+        self.assertEqual([product['id'] for product in first.json()['results']], [self.product.id])
+        self.assertEqual([product['id'] for product in second.json()['results']], [other.id])
+        self.get(f'{url}?query={{name}}&format=json')
+        self.assertEqual(self.get(f'{url}?format=json&query={{name}}')['X-Cache'], 'HIT')
+        self.assertEqual(self.get(f'{url}?format=json&query={{id}}')['X-Cache'], 'MISS')
+
+    def test_list_is_invalidated_by_new_product(self):
+        self.assertEqual(self.get('/api/products/')['X-Cache'], 'MISS')
+        self.assertEqual(self.get('/api/products/')['X-Cache'], 'HIT')
+        ProductFactory()
+        response = self.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_detailed_is_invalidated_by_changes(self):
+        url = f'/api/products/{self.product.id}/detailed/'
+        with self.captureOnCommitCallbacks(execute=True):
+            related = ProductFactory(tags=[self.tag])
+
+        def change_price():
+            self.variant.price += 1
+            self.variant.save()
+
+        def rename_related():
+            related.name = 'renamed'
+            related.save()
+
+        changes = [change_price, rename_related, lambda: CustomerRatingFactory(product=self.product)]
+        for change in changes:
+            self.get(url)
+            change()
+            self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+        data = self.get(url).json()
+        self.assertEqual(data['variants'][0]['price'], str(self.variant.price))
+        self.assertEqual(data['related_products'][0]['name'], 'renamed')
+        self.assertEqual(len(data['ratings']), 1)
+
+    def test_detailed_and_list_are_invalidated_by_tag_delete(self):
+        urls = [f'/api/products/{self.product.id}/', '/api/products/']
+        for url in urls:
+            self.get(url)
+        self.tag.delete()
+        for url in urls:
+            response = self.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertNotIn(self.tag.name, response.content.decode())
+
+    @override_settings(DB_REPLICAS=['replica'])
+    @patch('bringel.db.routers.ReplicaRouter.db_for_read', return_value='default')
+    def test_lagging_replica_reads_are_not_cached_after_a_write(self, _):
+        url = f'/api/products/{self.product.id}/'
+        admin_headers = self.get_oauth_headers(admin=True)
+        old_name = self.product.name
+        response = self.client.patch(url, {'name': 'renamed'}, headers=admin_headers, format='json')
+        self.assertEqual(response.status_code, 200)
+        # Another client reads from a replica that still has the old name, simulated on the primary
+        Product.objects.filter(id=self.product.id).update(name=old_name)
+        response = self.get(url)
+        self.assertEqual((response['X-Cache'], response.json()['name']), ('BYPASS', old_name))
+        Product.objects.filter(id=self.product.id).update(name='renamed')
+        # The writer reads from the primary
+        response = self.client.get(url, headers=admin_headers)
+        self.assertEqual((response['X-Cache'], response.json()['name']), ('MISS', 'renamed'))
+
+    def test_missing_product_is_not_cached(self):
+        self.assertEqual(self.get('/api/products/0/').status_code, 404)
+        self.assertEqual(self.get('/api/products/0/').status_code, 404)
+        self.assertEqual(get_cache_stats()['misses'], 2)
+
+
+class JWTAuthenticationTestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = ProductFactory()
+
+    def get(self, token):
+        return self.client.get(f'/api/products/{self.product.id}/', headers={'Authorization': f'Bearer {token}'})
+
+    def test_authenticated_read_does_not_query_tokens(self):
+        token = self.get_oauth_token()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'oauth2_provider' in query['sql']])
+
+    def test_scopes_come_from_claims(self):
+        response = self.client.delete(f'/api/products/{self.product.id}/',
+                                      headers={'Authorization': f'Bearer {self.get_oauth_token()}'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_revoked_token_is_rejected(self):
+        token = self.get_oauth_token()
+        AccessToken.objects.get(token=token).revoke()
+        self.assertEqual(self.get(token).status_code, 401)
+
+    def test_forged_token_is_rejected(self):
+        token = self.get_oauth_token()
+        claims = jwt.decode(token, options={'verify_signature': False})
+        claims['scope'] = 'user admin'
+        self.assertEqual(self.get(jwt.encode(claims, 'another key')).status_code, 401)
+
+    def test_token_without_scope_claim_falls_back_to_database(self):
+        token = self.get_oauth_token()
+        access_token = AccessToken.objects.get(token=token)
+        claims = jwt.decode(token, options={'verify_signature': False})
+        del claims['scope']
+        access_token.token = jwt.encode(claims, settings.SECRET_KEY)
+        access_token.save()
+        self.assertEqual(self.get(access_token.token).status_code, 200)
+
+
+class AsyncReadPathTestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.oauth_headers = self.get_oauth_headers()
+        tag = TagFactory()
+        self.products = ProductFactory.create_batch(3, tags=[tag])
+        for product in self.products:
+            CustomerRatingFactory(product=product)
+            PriceHistoryFactory(product_variant=ProductVariantFactory(product=product))
+
+    def assertSameResponse(self, path):
+        sync_response = self.client.get(f'/api/{path}', headers=self.oauth_headers)
+        async_response = self.client.get(f'/api/async/{path}', headers=self.oauth_headers)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        # Only the pagination links point to the async path
+        self.assertEqual(async_response.content.replace(b'/api/async/', b'/api/'), sync_response.content)
+
+    def test_async_endpoints_answer_like_the_viewsets(self):
+        product = self.products[0]
+        variant = product.variants.first()
+        paths = [
+            'tags/',
+            f'tags/{product.tags.first().id}/',
+            'products/',
+            'products/?limit=1&offset=1',
+            'products/?cursor=',
+            f'products/?supplier={product.supplier_id}',
+            'products/?query={name,variants{sku}}',
+            f'products/{product.id}/',
+            f'products/{product.id}/detailed/',
+            'products/variants/',
+            f'products/variants/?product={product.id}',
+            f'products/variants/{variant.id}/',
+            'products/0/',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertSameResponse(path)
+
+    def test_async_endpoints_require_authentication(self):
+        self.assertEqual(self.client.get('/api/async/products/').status_code, 401)
+        self.assertEqual(self.client.get('/api/async/tags/').status_code, 200)
+
+    def test_async_endpoints_are_read_only(self):
+        response = self.client.post('/api/async/tags/', {'name': 'new'}, headers=self.oauth_headers)
+        self.assertEqual(response.status_code, 405)
+
+
+class ORJSONTestCase(OAuth2AuthMixin, APITestCase):
+    def assertSameRendering(self, data, accepted_media_type=None):
+        self.assertEqual(ORJSONRenderer().render(data, accepted_media_type),
+                         JSONRenderer().render(data, accepted_media_type))
+
+    def test_renders_like_json_renderer(self):
+        self.assertSameRendering({
+            'price': Decimal('10.50'),
+            'updated_at': datetime(2023, 9, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+            'date': datetime(2023, 9, 1).date(),
+            'id': uuid4(),
+            'label': gettext_lazy('Price'),
+            'text': 'ação \u2028 \u2029',
+            1: [None, True, 1.5, 2 ** 70],
+        })
+        self.assertSameRendering({'name': 'indented'}, 'application/json; indent=4')
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_parser(self):
+        parser = ORJSONParser()
+        self.assertEqual(parser.parse(BytesIO('{"name": "ação"}'.encode())), {'name': 'ação'})
+        latin = BytesIO('{"name": "ação"}'.encode('latin-1'))
+        self.assertEqual(parser.parse(latin, parser_context={'encoding': 'latin-1'}), {'name': 'ação'})
+        for content in (b'{"name": ', b'{"rating": NaN}'):
+            with self.subTest(content=content):
+                with self.assertRaises(ParseError):
+                    parser.parse(BytesIO(content))
+
+    def test_api_uses_orjson(self):
+        ProductVariantFactory.create_batch(3)
+        headers = self.get_oauth_headers(admin=True)
+        response = self.client.get('/api/products/', headers=headers)
+        self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+        response = self.client.post('/api/tags/', b'{"name": "ofertas"}', content_type='application/json',
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/tags/', b'{"name": ', content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class CompiledSerializerTestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.oauth_headers = self.get_oauth_headers()
+        tags = TagFactory.create_batch(2)
+        for product in ProductFactory.create_batch(3, tags=tags):
+            for product_variant in ProductVariantFactory.create_batch(2, product=product):
+                PriceHistoryFactory.create_batch(2, product_variant=product_variant)
+        ProductFactory(rating=None)
+
+    def assertSameResponse(self, path):
+        compiled = self.client.get(path, headers=self.oauth_headers)
+        with override_settings(COMPILED_SERIALIZERS=False):
+            serialized = self.client.get(path, headers=self.oauth_headers)
+        self.assertEqual(compiled.status_code, serialized.status_code)
+        self.assertEqual(compiled.content, serialized.content)
+        return compiled
+
+    def test_compiled_actions_answer_like_the_serializers(self):
+        variant = ProductVariant.objects.first()
+        product = variant.product
+        paths = [
+            '/api/products/',
+            '/api/products/?limit=2&offset=1',
+            '/api/products/?query={id, name, variants{sku, price}}',
+            '/api/products/?query={-description, -variants}',
+            '/api/products/?query={*}',
+            '/api/products/?query={unknown}',
+            '/api/products/?query={name{id}}',
+            f'/api/products/{product.id}/',
+            f'/api/products/{product.id}/?query={{tags, supplier}}',
+            '/api/products/variants/',
+            '/api/products/variants/?query={sku, price_history}',
+            f'/api/products/variants/{variant.id}/',
+            f'/api/async/products/{product.id}/',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertSameResponse(path)
+
+    def test_only_compiled_actions_are_compiled(self):
+        product = Product.objects.first()
+        with patch('store.api.compiler.compile_serializer', wraps=compile_serializer) as compiled:
+            self.client.get(f'/api/products/{product.id}/detailed/', headers=self.oauth_headers)
+            self.assertFalse(compiled.called)
+            self.client.get('/api/products/', headers=self.oauth_headers)
+            self.assertTrue(compiled.called)
+
+    def test_compiled_serializer_uses_prefetched_rows(self):
+        queryset = plan_queryset(ProductVariant.objects.all(), ProductVariantSerializer())
+        with self.assertNumQueries(2):
+            data = CompiledSerializer(ProductVariantSerializer(queryset, many=True)).data
+        self.assertEqual(data, ProductVariantSerializer(queryset, many=True).data)
+        self.assertEqual(len(data[0]['price_history']), 3)
+
+    def test_compiled_serializer_without_prefetch(self):
+        variant = ProductVariant.objects.first()
+        product = variant.product
+        self.assertEqual(compile_serializer(ProductSerializer())(product), ProductSerializer(product).data)
+        self.assertEqual(compile_serializer(ProductVariantSerializer())(variant),
+                         ProductVariantSerializer(variant).data)
+        self.assertEqual(compile_serializer(ProductSerializer(return_pk=True))(product), product.id)
+
+
+class ProductSearchAPITestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.oauth_headers = self.get_oauth_headers()
+        self.tag = TagFactory(name='inverno')
+        self.coat = ProductFactory(name='Casaco', description='Casaco forrado de lã', tags=[self.tag])
+        self.scarf = ProductFactory(name='Cachecol', description='Cachecol de lã para o inverno')
+        ProductVariantFactory(product=self.coat)
+        ProductFactory(name='Camiseta', description='Camiseta de algodão')
+
+    def test_search_ranks_products(self):
+        response = self.client.get('/api/products/search/?q=inverno', headers=self.oauth_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        results = response.data['results']
+        self.assertEqual({result['id'] for result in results}, {self.coat.id, self.scarf.id})
+        self.assertGreaterEqual(results[0]['rank'], results[1]['rank'])
+        self.assertIn('<b>inverno</b>', next(result['snippet'] for result in results if result['id'] == self.scarf.id))
+        self.assertEqual(len(next(result['variants'] for result in results if result['id'] == self.coat.id)), 1)
+
+    def test_search_with_filters_and_restql(self):
+        response = self.client.get(f'/api/products/search/?q=lã&tags={self.tag.id}&query={{id, rank}}',
+                                   headers=self.oauth_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'rank'})
+
+    def test_search_requires_text(self):
+        response = self.client.get('/api/products/search/?q= ', headers=self.oauth_headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('q', response.data)
+        self.assertEqual(self.client.get('/api/products/search/?q=lã').status_code, 401)
+
+
+class CatalogExportTestCase(OAuth2AuthMixin, APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.oauth_headers = self.get_oauth_headers()
+        self.tag = TagFactory()
+        self.products = sorted(ProductFactory.create_batch(5, tags=[self.tag]), key=lambda product: product.id)
+        for product in self.products[:4]:
+            ProductVariantFactory.create_batch(2, product=product)
+
+    def get_export(self, params):
+        response = self.client.get('/api/products/export/', params, headers=self.oauth_headers)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    @override_settings(CATALOG_EXPORT_CHUNK_SIZE=2)
+    def test_export_ndjson(self):
+        with CaptureQueriesContext(connection) as context:
+            lines = self.get_export({}).splitlines()
+        # One cursor over the products with their supplier, then tags and variants for each of the 3 chunks
+        self.assertEqual(len([query for query in context.captured_queries if 'store_product' in query['sql']]), 7)
+        expected = self.client.get('/api/products/', {'limit': 10}, headers=self.oauth_headers).json()['results']
+        self.assertEqual([orjson.loads(line) for line in lines], sorted(expected, key=lambda product: product['id']))
+
+    def test_export_csv(self):
+        rows = list(csv.DictReader(StringIO(self.get_export({'output': 'csv'}))))
+        self.assertEqual(len(rows), 9)
+        self.assertEqual(rows[0]['tags'], self.tag.name)
+        self.assertEqual({row['variant_id'] for row in rows if row['id'] == str(self.products[0].id)},
+                         {str(variant.id) for variant in self.products[0].variants.all()})
+        self.assertEqual(rows[-1]['id'], str(self.products[-1].id))
+        self.assertEqual(rows[-1]['sku'], '')
+
+    def test_export_resumes_after_key(self):
+        lines = self.get_export({'after': self.products[2].id}).splitlines()
+        self.assertEqual([orjson.loads(line)['id'] for line in lines], [product.id for product in self.products[3:]])
+        lines = self.get_export({'supplier': self.products[0].supplier_id}).splitlines()
+        self.assertEqual([orjson.loads(line)['id'] for line in lines], [self.products[0].id])
+
+    def test_export_validates_params(self):
+        for params in ({'output': 'xml'}, {'after': 'x'}):
+            response = self.client.get('/api/products/export/', params, headers=self.oauth_headers)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(list(params)[0], response.data)
+        self.assertEqual(self.client.get('/api/products/export/').status_code, 401)
+
+
+class FilterIndexTestCase(OAuth2AuthMixin, APITestCase):
+    """Every combination of the declared filters must be served by indexes, with both paginations"""
+    products = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        # Bulk created, the signals are not needed to plan queries and would take most of the time
+        seeded = random.Random(0)
+        suppliers = Supplier.objects.bulk_create([Supplier(name=f'Supplier {i}') for i in range(50)])
+        tags = Tag.objects.bulk_create([Tag(name=f'Tag {i}') for i in range(20)])
+        products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='Description', supplier=seeded.choice(suppliers))
+            for i in range(cls.products)
+        ])
+        Product.tags.through.objects.bulk_create([
+            Product.tags.through(product=product, tag=tag) for product in products for tag in seeded.sample(tags, 2)
+        ])
+        ProductVariant.objects.bulk_create([
+            ProductVariant(product=product, variant_name=seeded.choice(['color', 'size', 'voltage']),
+                           variant_value=str(seeded.randint(1, 30)), sku=f'{product.id}-{index}',
+                           in_stock=seeded.random() < 0.3, price=Decimal('9.90'))
+            for product in products for index in range(3)
+        ])
+        CustomerRating.objects.bulk_create([
+            CustomerRating(product=seeded.choice(products), rating=seeded.randint(1, 5), description='Rating')
+            for _ in range(cls.products * 2)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        variant = ProductVariant.objects.filter(in_stock=True).first()
+        cls.filter_values = {
+            ProductViewSet: {'supplier': variant.product.supplier_id, 'tags': variant.product.tags.first().id},
+            ProductVariantViewSet: {'product': variant.product_id, 'variant_name': variant.variant_name,
+                                    'variant_value': variant.variant_value, 'in_stock': 'true'},
+            CustomerRatingViewset: {'product': CustomerRating.objects.first().product_id},
+        }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.oauth_headers = self.get_oauth_headers()
+
+    def get_url(self, viewset):
+        return {ProductViewSet: '/api/products/', ProductVariantViewSet: '/api/products/variants/',
+                CustomerRatingViewset: '/api/products/rating/'}[viewset]
+
+    def test_filters_do_not_scan_tables(self):
+        for viewset, values in self.filter_values.items():
+            self.assertEqual(set(values), set(viewset.filterset_fields))  # A new filter needs a value here
+            for size in range(1, len(values) + 1):
+                for fields in combinations(values, size):
+                    for pagination in ({}, {'cursor': ''}):
+                        params = {**{field: values[field] for field in fields}, **pagination}
+                        with self.subTest(viewset=viewset.__name__, params=params):
+                            self.assertNoSequentialScans(self.get_url(viewset), params)
+
+    def assertNoSequentialScans(self, url, params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params, headers=self.oauth_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'])
+        for query in context.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                self.assertEqual(find_sequential_scans(query['sql']), [], query['sql'])
+
+    def test_finds_sequential_scans(self):
+        self.assertEqual(find_sequential_scans('SELECT * FROM store_productvariant WHERE sku LIKE %s', ['%1']),
+                         ['store_productvariant'])
+        sql = 'SELECT * FROM "store_customerrating" U0 WHERE U0."description" = %s'
+        self.assertEqual(find_sequential_scans(sql, ['Rating']), ['store_customerrating'])
+        self.assertEqual(find_sequential_scans('SELECT * FROM store_customerrating WHERE product_id = %s', [1]), [])
@@ -0,0 +1,36 @@
+from rest_framework.response import Response
+
+from bringel.timing import get_metrics, timed
+
+
+class TimedSerializer:
+    """Stand-in for a serializer, adding the rendering of its data to the serialize time of the request"""
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    def __getattr__(self, name):
+        return getattr(self.serializer, name)
+
+    @property
+    def data(self):
+        with timed('serialize'):
+            return self.serializer.data
+
+
+class RequestTimingMixin:
+    """Viewset mixin measuring the serialize and render times of the request for RequestMetricsMiddleware"""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        # Only serializers of instances, the ones built for validation or the schema are left untouched
+        if get_metrics() is not None and serializer.instance is not None:
+            return TimedSerializer(serializer)
+        return serializer
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if get_metrics() is not None and isinstance(response, Response) and not response.is_rendered:
+            with timed('render'):
+                response.render()
+        return response
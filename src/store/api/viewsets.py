@@ -1,54 +1,149 @@
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from oauth2_provider.contrib.rest_framework import TokenHasScope
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.mixins import CreateModelMixin, ListModelMixin, RetrieveModelMixin
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 
+from bringel.timing import timed
+from store.api.bulk import BULK_MAX_ITEMS, upsert_product_variants
+from store.api.cache import ResponseCacheMixin
+from store.api.compiler import CompiledSerializerMixin
+from store.api.conditional import ConditionalGetMixin
 from store.api.permissions import UserReadsAdminWrites
+from store.api.planner import QueryPlannerMixin
+from store.api.timing import RequestTimingMixin
 from store.api.serializers import TagSerializer, SupplierSerializer, ProductSerializer, ProductVariantSerializer, \
-    CustomerRatingSerializer, ProductDetailSerializer
+    CustomerRatingSerializer, ProductDetailSerializer, ProductVariantBulkItemSerializer, \
+    ProductVariantBulkResultSerializer, ProductSearchSerializer
+from store.export import NDJSON, CSV, CONTENT_TYPES, export_catalog
 from store.models import Tag, Supplier, Product, ProductVariant, CustomerRating
+from store.search import search_products
 
 
-class TagViewSet(ModelViewSet):
+class TagViewSet(RequestTimingMixin, ConditionalGetMixin, QueryPlannerMixin, ModelViewSet):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     filterset_fields = ['name']
     permission_classes = [AllowAny]  # Allow anonymoys users
 
 
-class SupplierViewSet(ModelViewSet):
+class SupplierViewSet(RequestTimingMixin, ConditionalGetMixin, QueryPlannerMixin, ModelViewSet):
     serializer_class = SupplierSerializer
     queryset = Supplier.objects.all()
     filterset_fields = ['name']
     permission_classes = [UserReadsAdminWrites]
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(RequestTimingMixin, ConditionalGetMixin, ResponseCacheMixin, CompiledSerializerMixin,
+                     QueryPlannerMixin, ModelViewSet):
     serializer_class = ProductSerializer
+    compiled_actions = ['list', 'retrieve']
     queryset = Product.objects.all()
     filterset_fields = ['supplier', 'tags']
     permission_classes = [UserReadsAdminWrites]
 
     @swagger_auto_schema(operation_description="Return product with all related data",
                          responses={200: ProductDetailSerializer()})
-    @action(detail=True, methods=['get'])
-    def detailed(self, _, pk=None):
+    @action(detail=True, methods=['get'], serializer_class=ProductDetailSerializer)
+    def detailed(self, request, pk=None):
+        state = self.get_object_queryset().order_by().aggregate(
+            count=Count('pk', distinct=True),
+            version=Max('version'),
+            product_modified=Max('updated_at'),
+            related_modified=Max('related_to__related__updated_at'),
+        )
+        if state['count']:
+            state['last_modified'] = max(filter(None, [state['product_modified'], state['related_modified']]))
+        handler = self.render_detailed
+        return self.conditional_response(
+            request, state, lambda: self.cached_response(request, 'detailed', handler, pk), True
+        )
+
+    @swagger_auto_schema(operation_description="Full-text search of products by name, description, tags and "
+                                               "supplier, ordered by relevance",
+                         manual_parameters=[openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                                                              required=True, description='Search text')],
+                         responses={200: ProductSearchSerializer(many=True)})
+    @action(detail=False, methods=['get'], serializer_class=ProductSearchSerializer,
+            pagination_class=LimitOffsetPagination)  # Results are ordered by rank, keyset pagination does not apply
+    def search(self, request):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': ['This field is required.']})
+        queryset = search_products(self.filter_queryset(self.get_queryset()), text)
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    @swagger_auto_schema(operation_description="Stream every product with its variants, tags and supplier, ordered "
+                                               "by id, as NDJSON (one product per line) or CSV (one variant per "
+                                               "line). A broken download resumes with after set to the last id read",
+                         manual_parameters=[
+                             openapi.Parameter('output', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                                               enum=[NDJSON, CSV], default=NDJSON, description='Export format'),
+                             openapi.Parameter('after', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                                               description='Only export products with a greater id'),
+                         ],
+                         responses={200: 'NDJSON or CSV stream'})
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def export(self, request):
+        export_format = request.query_params.get('output', NDJSON)
+        if export_format not in CONTENT_TYPES:
+            raise ValidationError({'output': [f'Choose one of {NDJSON}, {CSV}.']})
+        after = request.query_params.get('after')
+        if after is not None:
+            try:
+                after = int(after)
+            except ValueError:
+                raise ValidationError({'after': ['A valid integer is required.']})
+        queryset = self.filter_queryset(self.queryset.all())
+        # Chosen now, the stream is read after the routing of the request has been reset
+        queryset = queryset.using(queryset.db)
+        response = StreamingHttpResponse(
+            export_catalog(export_format, queryset, after, settings.CATALOG_EXPORT_CHUNK_SIZE),
+            content_type=CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="catalog.{export_format}"'
+        return response
+
+    def render_detailed(self):
         product = self.get_object()
         serializer = ProductDetailSerializer(product)
-        return Response(serializer.data)
+        with timed('serialize'):
+            return Response(serializer.data)
 
 
-class ProductVariantViewSet(ModelViewSet):
+class ProductVariantViewSet(RequestTimingMixin, ConditionalGetMixin, CompiledSerializerMixin, QueryPlannerMixin,
+                            ModelViewSet):
     serializer_class = ProductVariantSerializer
+    compiled_actions = ['list', 'retrieve']
     queryset = ProductVariant.objects.all()
     filterset_fields = ['product', 'variant_name', 'variant_value', 'in_stock']
     permission_classes = [UserReadsAdminWrites]
 
+    @swagger_auto_schema(operation_description="Create or update variants keyed by SKU",
+                         request_body=ProductVariantBulkItemSerializer(many=True),
+                         responses={200: ProductVariantBulkResultSerializer()})
+    @action(detail=False, methods=['post'], serializer_class=ProductVariantBulkItemSerializer)
+    def bulk(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of variants.']})
+        if len(request.data) > BULK_MAX_ITEMS:
+            raise ValidationError({'non_field_errors': [f'Send at most {BULK_MAX_ITEMS} variants per request.']})
+        return Response(upsert_product_variants(request.data))
+
 
-class CustomerRatingViewset(CreateModelMixin, ListModelMixin, RetrieveModelMixin, GenericViewSet):
+class CustomerRatingViewset(RequestTimingMixin, ConditionalGetMixin, QueryPlannerMixin, CreateModelMixin,
+                            ListModelMixin, RetrieveModelMixin, GenericViewSet):
+    last_modified_field = 'created_at'
+    version_field = None  # Ratings are never updated
     serializer_class = CustomerRatingSerializer
     queryset = CustomerRating.objects.all()
     filterset_fields = ['product']
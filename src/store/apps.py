@@ -1,7 +1,9 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 
-from store.signals import customer_rating_post_save, product_variant_post_save
+from store.signals import customer_rating_post_save, customer_rating_post_delete, product_variant_post_save, \
+    product_variant_post_delete, product_tags_m2m_changed, versioned_pre_save, tag_post_save, supplier_post_save, \
+    product_post_save, product_post_delete, access_token_post_delete, tag_pre_delete, tag_post_delete
 
 
 class StoreConfig(AppConfig):
@@ -9,5 +11,19 @@ class StoreConfig(AppConfig):
     name = 'store'
 
     def ready(self):
+        from oauth2_provider.models import get_access_token_model
+
+        for model_name in ['Tag', 'Supplier', 'Product', 'ProductVariant']:
+            pre_save.connect(versioned_pre_save, sender=f'store.{model_name}')
+        post_save.connect(tag_post_save, sender='store.Tag')
+        pre_delete.connect(tag_pre_delete, sender='store.Tag')
+        post_delete.connect(tag_post_delete, sender='store.Tag')
+        post_save.connect(supplier_post_save, sender='store.Supplier')
+        post_save.connect(product_post_save, sender='store.Product')
+        post_delete.connect(product_post_delete, sender='store.Product')
         post_save.connect(customer_rating_post_save, sender='store.CustomerRating')
+        post_delete.connect(customer_rating_post_delete, sender='store.CustomerRating')
         post_save.connect(product_variant_post_save, sender='store.ProductVariant')
+        post_delete.connect(product_variant_post_delete, sender='store.ProductVariant')
+        m2m_changed.connect(product_tags_m2m_changed, sender=self.get_model('Product').tags.through)
+        post_delete.connect(access_token_post_delete, sender=get_access_token_model())
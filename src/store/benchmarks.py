@@ -0,0 +1,195 @@
+import random
+from collections import namedtuple
+from time import perf_counter
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from oauth2_provider.generators import generate_client_secret
+from oauth2_provider.models import Application
+
+from store.factories import SupplierFactory, TagFactory, ProductFactory, ProductVariantFactory, \
+    CustomerRatingFactory, PriceHistoryFactory
+from store.models import Supplier, Tag, Product, ProductVariant, CustomerRating, PriceHistory
+from store.search import update_search_index
+from store.tasks import update_rating, reconcile_ratings
+
+# Catalog sizes by number of variants
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+VARIANTS_PER_PRODUCT = 5
+VARIANT_NAMES = ['color', 'size', 'voltage']
+
+Case = namedtuple('Case', ['name', 'method', 'path', 'data'])
+
+
+def seed_catalog(variants, batch_size=2000, seed=0):
+    """Create a catalog of the given number of variants with the factories, returns the ids used by the cases
+
+    Products have VARIANTS_PER_PRODUCT variants, 2 tags, a rating and a price history row per variant. Rows are
+    built by the factories and saved with bulk_create batch_size products at a time, without the model signals,
+    so the search index and rating counters are rebuilt at the end. The related products index is not built.
+    """
+    seeded = random.Random(seed)
+    suppliers = Supplier.objects.bulk_create(SupplierFactory.build_batch(max(variants // 1000, 10)))
+    tags = Tag.objects.bulk_create(TagFactory.build_batch(100))
+    products_total = max(variants // VARIANTS_PER_PRODUCT, 1)
+    for start in range(0, products_total, batch_size):
+        products = Product.objects.bulk_create([
+            ProductFactory.build(supplier=seeded.choice(suppliers))
+            for _ in range(min(batch_size, products_total - start))
+        ])
+        Product.tags.through.objects.bulk_create([
+            Product.tags.through(product=product, tag=tag) for product in products for tag in seeded.sample(tags, 2)
+        ])
+        product_variants = ProductVariant.objects.bulk_create([
+            ProductVariantFactory.build(
+                product=product, sku=f'{(start + index) * VARIANTS_PER_PRODUCT + number:08x}',
+                variant_name=seeded.choice(VARIANT_NAMES), variant_value=str(seeded.randint(1, 30)),
+                in_stock=seeded.random() < 0.5,
+            )
+            for index, product in enumerate(products) for number in range(VARIANTS_PER_PRODUCT)
+        ])
+        PriceHistory.objects.bulk_create([
+            PriceHistoryFactory.build(product_variant=variant, price=variant.price) for variant in product_variants
+        ])
+        CustomerRating.objects.bulk_create([
+            CustomerRatingFactory.build(product=product, description='Benchmark') for product in products
+        ])
+        reconcile_ratings([product.id for product in products])
+    update_search_index()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    variant = ProductVariant.objects.filter(in_stock=True).select_related('product').order_by('-id').first()
+    return {
+        'product': variant.product,
+        'variant': variant,
+        'skus': list(ProductVariant.objects.order_by('id').values_list('sku', 'product_id')[:10]),
+    }
+
+
+def get_cases(sample):
+    product = sample['product']
+    variant = sample['variant']
+    bulk = [{'sku': sku, 'product': product_id, 'variant_name': 'size', 'variant_value': 'M', 'price': '9.90'}
+            for sku, product_id in sample['skus']]
+    return [
+        Case('tags.list', 'get', '/api/tags/', {}),
+        Case('suppliers.list', 'get', '/api/suppliers/', {}),
+        Case('products.list', 'get', '/api/products/', {}),
+        Case('products.list.supplier', 'get', '/api/products/', {'supplier': product.supplier_id}),
+        Case('products.list.cursor', 'get', '/api/products/', {'cursor': ''}),
+        Case('products.retrieve', 'get', f'/api/products/{product.id}/', {}),
+        Case('products.detailed', 'get', f'/api/products/{product.id}/detailed/', {}),
+        Case('products.search', 'get', '/api/products/search/', {'q': product.name}),
+        Case('products.export.supplier', 'get', '/api/products/export/', {'supplier': product.supplier_id}),
+        Case('variants.list', 'get', '/api/products/variants/', {}),
+        Case('variants.list.filtered', 'get', '/api/products/variants/',
+             {'variant_name': variant.variant_name, 'variant_value': variant.variant_value, 'in_stock': 'true'}),
+        Case('variants.retrieve', 'get', f'/api/products/variants/{variant.id}/', {}),
+        Case('variants.bulk', 'post', '/api/products/variants/bulk/', bulk),
+        Case('rating.list', 'get', '/api/products/rating/', {'product': product.id}),
+        Case('rating.create', 'post', '/api/products/rating/',
+             {'product': product.id, 'rating': 4, 'description': 'Benchmark'}),
+    ]
+
+
+def get_client():
+    """Client authenticated with an OAuth2 token of the admin and user scopes"""
+    client = Client()
+    client_secret = generate_client_secret()  # Saved hashed, so it is kept here
+    application = Application.objects.create(
+        client_type=Application.CLIENT_CONFIDENTIAL,
+        authorization_grant_type=Application.GRANT_CLIENT_CREDENTIALS,
+        client_secret=client_secret,
+        name='Benchmark',
+    )
+    response = client.post('/oauth2/token/', {
+        'grant_type': 'client_credentials',
+        'client_id': application.client_id,
+        'client_secret': client_secret,
+        'scope': 'admin user',
+    })
+    client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {response.json()["access_token"]}'
+    return client
+
+
+def request(client, case):
+    if case.method == 'get':
+        response = client.get(case.path, case.data)
+    else:
+        response = client.post(case.path, case.data, content_type='application/json')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    if response.status_code >= 300:
+        raise ValueError(f'{case.name} answered {response.status_code}')
+
+
+def measure(function, iterations, warmup=2):
+    """Return the latency percentiles, throughput and query count of calling function iterations times
+
+    The queries are counted on an extra call, so capturing them does not add to the timings.
+    """
+    for _ in range(warmup):
+        function()
+    with CaptureQueriesContext(connection) as context:
+        function()
+    queries = len(context.captured_queries)
+    timings = []
+    for _ in range(iterations):
+        started = perf_counter()
+        function()
+        timings.append(perf_counter() - started)
+    timings.sort()
+    return {
+        'p50_ms': round(timings[(len(timings) - 1) // 2] * 1000, 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+        'throughput_rps': round(len(timings) / sum(timings), 1),
+        'queries': queries,
+    }
+
+
+def run_benchmarks(sample, iterations):
+    """Measure every case and the update_rating task on a seeded catalog, returns the metrics by name"""
+    client = get_client()
+    results = {}
+    for case in get_cases(sample):
+        results[case.name] = measure(lambda: request(client, case), iterations)
+    product_id = sample['product'].id
+    results['tasks.update_rating'] = measure(lambda: update_rating(product_id), iterations)
+    return results
+
+
+def compare(results, baselines, scale, latency_threshold=1.5, query_threshold=0):
+    """Return the regressions of the results against the baselines, as messages
+
+    Query counts must stay within the budget of each case plus query_threshold, at every scale. Latencies may be
+    at most latency_threshold times the baseline of the scale, and throughput at least the baseline divided by it.
+    Cases without a baseline are not checked.
+    """
+    regressions = []
+    budgets = baselines.get('queries', {})
+    scale_baselines = baselines.get('scales', {}).get(scale, {})
+    for name, metrics in results.items():
+        budget = budgets.get(name)
+        if budget is not None and metrics['queries'] > budget + query_threshold:
+            regressions.append(f'{name}: {metrics["queries"]} queries, budget is {budget}')
+        baseline = scale_baselines.get(name)
+        if baseline is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if metrics[metric] > baseline[metric] * latency_threshold:
+                regressions.append(f'{name}: {metric} {metrics[metric]}, baseline is {baseline[metric]}')
+        if metrics['throughput_rps'] < baseline['throughput_rps'] / latency_threshold:
+            regressions.append(f'{name}: throughput_rps {metrics["throughput_rps"]}, '
+                               f'baseline is {baseline["throughput_rps"]}')
+    return regressions
+
+
+def update_baselines(baselines, results, scale):
+    """Record the results as the baselines of the scale and their query counts as the budgets"""
+    baselines.setdefault('queries', {}).update({name: metrics['queries'] for name, metrics in results.items()})
+    baselines.setdefault('scales', {})[scale] = {
+        name: {metric: value for metric, value in metrics.items() if metric != 'queries'}
+        for name, metrics in results.items()
+    }
+    return baselines
@@ -0,0 +1,129 @@
+import time
+from hashlib import md5
+from uuid import uuid4
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+KEY_PREFIX = 'store:response'
+LIST_GENERATION_KEY = f'{KEY_PREFIX}:products:generation'
+STATS = ('hits', 'misses', 'waits')
+LOCK_POLL_INTERVAL = 0.05
+
+
+def product_generation_key(product_id):
+    return f'{KEY_PREFIX}:product:{product_id}:generation'
+
+
+def stats_key(name):
+    return f'{KEY_PREFIX}:stats:{name}'
+
+
+def get_generation(generation_key):
+    # Never fall back to a fixed generation: an evicted generation key would resurrect responses cached under it
+    generation = cache.get(generation_key)
+    if generation is None:
+        cache.add(generation_key, uuid4().hex, timeout=None)
+        generation = cache.get(generation_key)
+    return generation
+
+
+def response_key(scope, variant, product_id=None):
+    """Key of a cached response, product_id=None keys a list that any product change invalidates"""
+    if product_id is None:
+        generation = get_generation(LIST_GENERATION_KEY)
+    else:
+        generation = get_generation(product_generation_key(product_id))
+    digest = md5(variant.encode()).hexdigest()
+    return f'{KEY_PREFIX}:{scope}:{product_id or "list"}:{generation}:{digest}'
+
+
+def increment(name):
+    key = stats_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_stats():
+    values = cache.get_many([stats_key(name) for name in STATS])
+    stats = {name: values.get(stats_key(name), 0) for name in STATS}
+    requests = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / requests if requests else None
+    return stats
+
+
+def get_or_render(key, render):
+    """Return (value, hit) for the key, rendering it on a miss
+
+    Only one caller renders a missing key at a time: the others wait up to RESPONSE_CACHE_LOCK_TIMEOUT for it to be
+    cached instead of running the same queries (a hit when it is), then give up and render and cache it themselves.
+    render() returns None for values that must not be cached.
+    """
+    value = cache.get(key)
+    if value is not None:
+        increment('hits')
+        return value, True
+    lock_key = f'{key}:lock'
+    lock_timeout = settings.RESPONSE_CACHE_LOCK_TIMEOUT
+    if not cache.add(lock_key, 1, timeout=lock_timeout):
+        increment('waits')
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = cache.get(key)
+            if value is not None:
+                increment('hits')
+                return value, True
+        increment('misses')
+        return render_and_set(key, render), False
+    increment('misses')
+    try:
+        value = render_and_set(key, render)
+    finally:
+        cache.delete(lock_key)
+    return value, False
+
+
+def render_and_set(key, render):
+    value = render()
+    if value is not None:
+        cache.set(key, value, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+    return value
+
+
+def written_key(generation_key):
+    return f'{generation_key}:written'
+
+
+def recently_written(product_id=None):
+    """Whether the product (or any product, for lists) changed in the last READ_YOUR_WRITES_WINDOW seconds"""
+    generation_key = LIST_GENERATION_KEY if product_id is None else product_generation_key(product_id)
+    return cache.get(written_key(generation_key)) is not None
+
+
+def bump_generations(keys):
+    cache.set_many({key: uuid4().hex for key in keys}, timeout=None)
+    if settings.DB_REPLICAS:
+        # Replicas may not have the change yet, see store.api.cache.ResponseCacheMixin
+        cache.set_many({written_key(key): 1 for key in keys}, timeout=settings.READ_YOUR_WRITES_WINDOW)
+
+
+def invalidate_products(product_ids):
+    """Drop the cached responses of the products, of the products showing them as related and of the lists"""
+    if not settings.RESPONSE_CACHE:
+        return
+    product_ids = set(product_ids)
+    if product_ids:
+        related_model = apps.get_model(app_label='store', model_name='RelatedProduct')
+        product_ids.update(
+            related_model.objects.filter(related_id__in=product_ids).values_list('product_id', flat=True)
+        )
+    keys = [LIST_GENERATION_KEY, *(product_generation_key(product_id) for product_id in product_ids)]
+    bump_generations(keys)
+    # A reader may cache the old rows again before the transaction commits, so invalidate once more after it
+    transaction.on_commit(lambda: bump_generations(keys))
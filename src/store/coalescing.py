@@ -0,0 +1,59 @@
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+
+DIRTY_KEY = 'store:ratings:dirty'
+WINDOW_KEY = 'store:ratings:window'
+STATS_KEY = 'store:ratings:stats'
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    return redis.Redis.from_url(settings.RATING_REDIS_URL)
+
+
+def mark_rating_dirty(product_id):
+    """Collect a rating event of the product, returns True when it opened a new flush window"""
+    pipeline = get_redis().pipeline()
+    pipeline.sadd(DIRTY_KEY, product_id)
+    pipeline.hincrby(STATS_KEY, 'events', 1)
+    pipeline.set(WINDOW_KEY, 1, nx=True, ex=settings.RATING_FLUSH_INTERVAL * 2)
+    _, _, opened_window = pipeline.execute()
+    return bool(opened_window)
+
+
+def pop_dirty_products():
+    # Closing the window first makes any event received from now on schedule the next flush
+    pipeline = get_redis().pipeline()
+    pipeline.delete(WINDOW_KEY)
+    pipeline.smembers(DIRTY_KEY)
+    pipeline.delete(DIRTY_KEY)
+    _, members, _ = pipeline.execute()
+    return sorted(int(member) for member in members)
+
+
+def record_flush(products):
+    pipeline = get_redis().pipeline()
+    pipeline.hincrby(STATS_KEY, 'flushes', 1)
+    pipeline.hincrby(STATS_KEY, 'products', products)
+    pipeline.execute()
+    return get_stats()
+
+
+def get_stats():
+    """Return how many rating events were received, how many recomputations they turned into and the difference"""
+    pipeline = get_redis().pipeline()
+    pipeline.hgetall(STATS_KEY)
+    pipeline.scard(DIRTY_KEY)
+    stats, pending = pipeline.execute()
+    stats = {key.decode(): int(value) for key, value in stats.items()}
+    events = stats.get('events', 0)
+    products = stats.get('products', 0)
+    return {
+        'events': events,
+        'flushes': stats.get('flushes', 0),
+        'products': products,
+        'pending': pending,
+        'coalesced': events - products - pending,
+    }
@@ -0,0 +1,63 @@
+import json
+import re
+
+from django.db import connection
+
+# Tables that grow with the catalog, a sequential scan over them is a missing index
+LARGE_TABLES = ['store_product', 'store_product_tags', 'store_productvariant', 'store_customerrating',
+                'store_pricehistory']
+
+# SQLite reads a whole table or a whole index with SCAN, and looks rows up with SEARCH
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?$')
+# Django aliases tables of subqueries and repeated joins, e.g. "store_product" U0, SQLite plans show the alias
+SQL_ALIAS = re.compile(r'"(\w+)" (?:AS )?"?([UT]\d+)"?')
+
+
+def explain(sql, params=()):
+    """Return the plan of a query, as EXPLAIN QUERY PLAN details (SQLite) or the EXPLAIN JSON plan (PostgreSQL)
+
+    PostgreSQL plans with sequential scans disabled, so they are only chosen when no index can serve the query,
+    however small the tables are.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+            finally:
+                cursor.execute('RESET enable_seqscan')
+            return json.loads(plan) if isinstance(plan, str) else plan
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def get_partial_indexes():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _postgresql_scans(node):
+    if node.get('Node Type') == 'Seq Scan':
+        yield node['Relation Name']
+    for child in node.get('Plans', []):
+        yield from _postgresql_scans(child)
+
+
+def find_sequential_scans(sql, params=(), tables=LARGE_TABLES):
+    """Return the tables of the list read with a sequential scan by the query
+
+    Partitions count as their parent table. On SQLite full scans of an index (SCAN t USING INDEX i) count too,
+    they read every row of the table in the index order, unless the index is partial.
+    """
+    plan = explain(sql, params)
+    if connection.vendor == 'postgresql':
+        scanned = [name for root in plan for name in _postgresql_scans(root['Plan'])]
+    else:
+        aliases = {alias: table for table, alias in SQL_ALIAS.findall(sql)}
+        partial_indexes = get_partial_indexes()
+        scanned = [aliases.get(match.group(1), match.group(1)) for match in map(SQLITE_SCAN.match, plan)
+                   if match and match.group(2) not in partial_indexes]
+    partition = re.compile(rf'^({"|".join(tables)})(_p\d{{6}}|_default)?$')
+    return sorted({match.group(1) for match in map(partition.match, scanned) if match})
@@ -0,0 +1,66 @@
+import csv
+
+import orjson
+
+from store.api.compiler import compile_serializer
+from store.api.serializers import ProductSerializer
+from store.models import Product
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+CONTENT_TYPES = {NDJSON: 'application/x-ndjson', CSV: 'text/csv; charset=utf-8'}
+CSV_HEADER = ['id', 'supplier', 'name', 'description', 'tags', 'rating', 'variant_id', 'variant_name',
+              'variant_value', 'sku', 'in_stock', 'price']
+CSV_TAG_SEPARATOR = '|'
+
+
+def get_export_queryset(queryset=None, after=None):
+    """Products ordered by id with their supplier, tags and variants, starting after the product id after"""
+    if queryset is None:
+        queryset = Product.objects.all()
+    queryset = queryset.select_related('supplier').prefetch_related('tags', 'variants').defer('search_vector')
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    return queryset.order_by('id')
+
+
+def iter_products(queryset, chunk_size=1000):
+    """Render the products of queryset as ProductSerializer, reading chunk_size rows at a time
+
+    The rows come from a server-side cursor on PostgreSQL, and tags and variants are prefetched for each chunk, so
+    memory use does not grow with the catalog.
+    """
+    render = compile_serializer(ProductSerializer())
+    for product in queryset.iterator(chunk_size=chunk_size):
+        yield render(product)
+
+
+class _Echo:
+    # File-like object for csv.writer, returning the line instead of buffering it
+    def write(self, value):
+        return value
+
+
+def iter_ndjson(products):
+    for product in products:
+        yield orjson.dumps(product, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def iter_csv(products):
+    """One line per variant, products without variants have a line with empty variant columns"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER).encode()
+    for product in products:
+        columns = [product['id'], product['supplier'], product['name'], product['description'],
+                   CSV_TAG_SEPARATOR.join(product['tags']), product['rating']]
+        variants = product['variants'] or [{}]
+        yield ''.join(writer.writerow(columns + [
+            variant.get('id'), variant.get('variant_name'), variant.get('variant_value'), variant.get('sku'),
+            variant.get('in_stock'), variant.get('price'),
+        ]) for variant in variants).encode()
+
+
+def export_catalog(export_format, queryset=None, after=None, chunk_size=1000):
+    """Return an iterator of the encoded lines of the catalog export, in NDJSON or CSV"""
+    products = iter_products(get_export_queryset(queryset, after), chunk_size)
+    return iter_ndjson(products) if export_format == NDJSON else iter_csv(products)
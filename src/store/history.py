@@ -0,0 +1,76 @@
+import weakref
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+
+IMMEDIATE = 'immediate'
+ON_COMMIT = 'on_commit'
+BUFFERED = 'buffered'
+
+
+class PriceHistoryBuffer:
+    """Price history rows of one transaction, written with a single INSERT by the first of their on_commit callbacks
+
+    Each row is queued with its own callback, which is the only strong reference to it. Django drops the callbacks
+    of rolled back transactions and savepoints, so their rows leave the buffer with them, and the buffer itself
+    once none is left.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.flushed = False
+
+    def add(self, row):
+        entry = PriceHistoryEntry(self, row)
+        self.rows.append(weakref.ref(entry))
+        return entry
+
+    def flush(self):
+        if self.flushed:
+            return
+        self.flushed = True
+        rows = [entry().row for entry in self.rows if entry() is not None]
+        model_price_history = apps.get_model(app_label='store', model_name='PriceHistory')
+        model_price_history.objects.bulk_create(rows)
+
+
+class PriceHistoryEntry:
+    """on_commit callback of one buffered row, flushing the whole buffer"""
+
+    def __init__(self, buffer, row):
+        self.buffer = buffer
+        self.row = row
+
+    def __call__(self):
+        self.buffer.flush()
+
+
+# Pending buffer of each connection, dropped when it is flushed or its transaction rolls back
+_buffers = weakref.WeakKeyDictionary()
+
+
+def _get_buffer(connection):
+    buffer_ref = _buffers.get(connection)
+    buffer = buffer_ref() if buffer_ref is not None else None
+    if buffer is None or buffer.flushed:
+        buffer = PriceHistoryBuffer()
+        _buffers[connection] = weakref.ref(buffer)
+    return buffer
+
+
+def write_price_history(product_variant_id, price, using=None):
+    """Write a price history row following settings.PRICE_HISTORY_WRITE"""
+    model_price_history = apps.get_model(app_label='store', model_name='PriceHistory')
+    mode = settings.PRICE_HISTORY_WRITE
+    if mode == ON_COMMIT:
+        transaction.on_commit(
+            lambda: model_price_history.objects.create(product_variant_id=product_variant_id, price=price),
+            using=using,
+        )
+    elif mode == BUFFERED:
+        buffer = _get_buffer(transaction.get_connection(using))
+        row = model_price_history(product_variant_id=product_variant_id, price=price)
+        transaction.on_commit(buffer.add(row), using=using)
+    else:
+        model_price_history.objects.create(product_variant_id=product_variant_id, price=price)
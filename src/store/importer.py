@@ -0,0 +1,253 @@
+import csv
+import logging
+from itertools import islice
+from time import monotonic
+
+import orjson
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from store.api.serializers import CatalogImportProductSerializer
+from store.cache import invalidate_products
+from store.export import NDJSON, CSV, CSV_TAG_SEPARATOR
+from store.models import Supplier, Tag, Product
+from store.search import update_search_index
+from store.tasks import update_related_products
+
+logger = logging.getLogger(__name__)
+
+VARIANT_COLUMNS = ['sku', 'variant_name', 'variant_value', 'in_stock', 'price']
+
+# Staging tables of a chunk, dropped (or rolled back) with its transaction
+CREATE_STAGING_SQL = [
+    'CREATE TEMPORARY TABLE import_product (line integer, supplier_id bigint, name varchar(50), description text, '
+    'product_id bigint)',
+    'CREATE TEMPORARY TABLE import_product_tag (line integer, tag_id bigint)',
+    'CREATE TEMPORARY TABLE import_variant (line integer, sku varchar(8), variant_name varchar(20), '
+    'variant_value varchar(50), in_stock boolean, price numeric(8, 2), previous_price numeric(8, 2), '
+    'previous_product_id bigint)',
+]
+DROP_STAGING_SQL = ['DROP TABLE import_product', 'DROP TABLE import_product_tag', 'DROP TABLE import_variant']
+STAGING_COLUMNS = {
+    'import_product': ['line', 'supplier_id', 'name', 'description'],
+    'import_product_tag': ['line', 'tag_id'],
+    'import_variant': ['line', *VARIANT_COLUMNS],
+}
+
+# Products are matched by supplier and name, with the index of ?supplier=
+MATCH_PRODUCTS_SQL = '''
+UPDATE import_product SET product_id = (
+    SELECT min(product.id) FROM store_product AS product
+    WHERE product.supplier_id = import_product.supplier_id AND product.name = import_product.name
+) WHERE product_id IS NULL
+'''
+UPDATE_PRODUCTS_SQL = '''
+UPDATE store_product SET description = import_product.description, version = store_product.version + 1,
+    updated_at = %s
+FROM import_product WHERE store_product.id = import_product.product_id
+'''
+INSERT_PRODUCTS_SQL = '''
+INSERT INTO store_product (supplier_id, name, description, rating_count, rating_sum, rating_1_count, rating_2_count,
+    rating_3_count, rating_4_count, rating_5_count, version, updated_at)
+SELECT supplier_id, name, description, 0, 0, 0, 0, 0, 0, 0, 1, %s FROM import_product
+WHERE product_id IS NULL ORDER BY line
+'''
+DELETE_PRODUCT_TAGS_SQL = '''
+DELETE FROM store_product_tags WHERE product_id IN (SELECT product_id FROM import_product)
+'''
+INSERT_PRODUCT_TAGS_SQL = '''
+INSERT INTO store_product_tags (product_id, tag_id)
+SELECT DISTINCT import_product.product_id, import_product_tag.tag_id FROM import_product_tag
+JOIN import_product ON import_product.line = import_product_tag.line
+'''
+MATCH_VARIANTS_SQL = '''
+UPDATE import_variant SET previous_price = variant.price, previous_product_id = variant.product_id
+FROM store_productvariant AS variant WHERE variant.sku = import_variant.sku
+'''
+# WHERE true tells SQLite the ON CONFLICT clause belongs to the INSERT, not to the join of the SELECT
+UPSERT_VARIANTS_SQL = '''
+INSERT INTO store_productvariant (product_id, sku, variant_name, variant_value, in_stock, price, version, updated_at)
+SELECT import_product.product_id, import_variant.sku, import_variant.variant_name, import_variant.variant_value,
+    import_variant.in_stock, import_variant.price, 1, %s
+FROM import_variant JOIN import_product ON import_product.line = import_variant.line WHERE true
+ON CONFLICT (sku) DO UPDATE SET product_id = excluded.product_id, variant_name = excluded.variant_name,
+    variant_value = excluded.variant_value, in_stock = excluded.in_stock, price = excluded.price,
+    version = store_productvariant.version + 1, updated_at = excluded.updated_at
+'''
+# As product_variant_post_save, new variants and changed prices get a price history row
+INSERT_PRICE_HISTORY_SQL = '''
+INSERT INTO store_pricehistory (product_variant_id, price, updated_at)
+SELECT variant.id, import_variant.price, %s FROM import_variant
+JOIN store_productvariant AS variant ON variant.sku = import_variant.sku
+WHERE import_variant.previous_price IS NULL OR import_variant.previous_price <> import_variant.price
+'''
+
+
+def read_ndjson(file):
+    """Yield (line number, product) for each line of an NDJSON file, product is None for invalid JSON"""
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, orjson.loads(line)
+        except orjson.JSONDecodeError:
+            yield line_number, None
+
+
+def read_csv(file):
+    """Yield (line number, product) for the lines of a CSV file in the catalog export layout
+
+    Consecutive lines of the same product (by id, or by supplier and name) are its variants.
+    """
+    reader = csv.DictReader(file)
+    product = key = line_number = None
+    for row in reader:
+        row_key = row.get('id') or (row.get('supplier'), row.get('name'))
+        if product is None or row_key != key:
+            if product is not None:
+                yield line_number, product
+            key, line_number = row_key, reader.line_num
+            tags = row.get('tags') or ''
+            product = {
+                'supplier': row.get('supplier'),
+                'name': row.get('name'),
+                'description': row.get('description'),
+                'tags': tags.split(CSV_TAG_SEPARATOR) if tags else [],
+                'variants': [],
+            }
+        if any(row.get(column) for column in VARIANT_COLUMNS):
+            product['variants'].append({column: row.get(column) for column in VARIANT_COLUMNS})
+    if product is not None:
+        yield line_number, product
+
+
+def validate_products(rows):
+    """Validate the (line number, product) rows, returns the valid ones and the error rows"""
+    valid = []
+    errors = []
+    for line_number, product in rows:
+        if not isinstance(product, dict):
+            errors.append({'line': line_number, 'errors': {'non_field_errors': ['Expected a JSON object.']}})
+            continue
+        serializer = CatalogImportProductSerializer(data=product)
+        if not serializer.is_valid():
+            errors.append({'line': line_number, 'product_name': product.get('name'), 'errors': serializer.errors})
+            continue
+        valid.append((line_number, serializer.validated_data))
+    return valid, errors
+
+
+def get_ids_by_name(model, names):
+    """Return {name: id} of the rows of model with the names, creating the missing ones"""
+    model.objects.bulk_create([model(name=name) for name in names], batch_size=1000, ignore_conflicts=True)
+    ids = {}
+    names = list(names)
+    for start in range(0, len(names), 1000):
+        ids.update(model.objects.filter(name__in=names[start:start + 1000]).values_list('name', 'id'))
+    return ids
+
+
+def load_staging(cursor, table, rows):
+    columns = ', '.join(STAGING_COLUMNS[table])
+    if connection.vendor == 'postgresql':
+        with cursor.copy(f'COPY {table} ({columns}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+    else:
+        placeholders = ', '.join(['%s'] * len(STAGING_COLUMNS[table]))
+        cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', rows)
+
+
+def import_chunk(products):
+    """Upsert the validated (line number, product) rows with set-based SQL in one transaction
+
+    Products are keyed by supplier and name and variants by SKU, the later row wins when a key repeats. The tags of
+    an imported product are replaced by the imported ones, and its variants missing from the import are kept.
+    """
+    by_key = {}
+    variant_keys = {}
+    for line_number, product in products:
+        key = (product['supplier'], product['name'])
+        by_key[key] = (by_key[key][0] if key in by_key else line_number, product)
+        for variant in product.get('variants', []):
+            variant_keys[variant['sku']] = (key, variant)
+    supplier_ids = get_ids_by_name(Supplier, {product['supplier'] for _, product in by_key.values()})
+    tag_ids = get_ids_by_name(Tag, {tag for _, product in by_key.values() for tag in product['tags']})
+    product_rows = [(line, supplier_ids[product['supplier']], product['name'], product['description'])
+                    for line, product in by_key.values()]
+    tag_rows = [(line, tag_ids[tag]) for line, product in by_key.values() for tag in product['tags']]
+    variant_rows = [(by_key[key][0], *(variant[column] for column in VARIANT_COLUMNS))
+                    for key, variant in variant_keys.values()]
+    timestamp = connection.ops.adapt_datetimefield_value(now())
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql in CREATE_STAGING_SQL:
+            cursor.execute(sql)
+        load_staging(cursor, 'import_product', product_rows)
+        load_staging(cursor, 'import_product_tag', tag_rows)
+        load_staging(cursor, 'import_variant', variant_rows)
+        cursor.execute(MATCH_PRODUCTS_SQL)
+        cursor.execute(UPDATE_PRODUCTS_SQL, [timestamp])
+        products_updated = cursor.rowcount
+        cursor.execute(INSERT_PRODUCTS_SQL, [timestamp])
+        products_created = cursor.rowcount
+        cursor.execute(MATCH_PRODUCTS_SQL)
+        cursor.execute(DELETE_PRODUCT_TAGS_SQL)
+        cursor.execute(INSERT_PRODUCT_TAGS_SQL)
+        cursor.execute(MATCH_VARIANTS_SQL)
+        cursor.execute(UPSERT_VARIANTS_SQL, [timestamp])
+        cursor.execute(INSERT_PRICE_HISTORY_SQL, [timestamp])
+        price_changes = cursor.rowcount
+        cursor.execute('SELECT product_id FROM import_product')
+        product_ids = {row[0] for row in cursor.fetchall()}
+        cursor.execute('SELECT DISTINCT previous_product_id FROM import_variant WHERE previous_product_id IS NOT NULL')
+        moved_from = {row[0] for row in cursor.fetchall()} - product_ids
+        cursor.execute('SELECT count(*) FROM import_variant WHERE previous_price IS NOT NULL')
+        variants_updated = cursor.fetchone()[0]
+        for sql in DROP_STAGING_SQL:
+            cursor.execute(sql)
+        # The SQL bypasses the save signals, so their work is done here once for the whole chunk
+        Product.objects.filter(id__in=moved_from).touch()
+        invalidate_products(product_ids | moved_from)
+        update_search_index(product_ids)
+        transaction.on_commit(lambda: update_related_products.delay(sorted(product_ids)))
+
+    return {
+        'products_created': products_created,
+        'products_updated': products_updated,
+        'variants_created': len(variant_rows) - variants_updated,
+        'variants_updated': variants_updated,
+        'price_changes': price_changes,
+    }
+
+
+def load_catalog(file, import_format=NDJSON, chunk_size=1000, progress=None):
+    """Import the products, tags and variants of an NDJSON or CSV file (the layouts of the catalog export)
+
+    The file is read and imported chunk_size products at a time, each chunk in its own transaction, so an
+    interrupted import keeps the chunks already imported and can be run again. progress is called with the stats
+    and the new error rows after every chunk. Returns the stats, with the number of error rows.
+    """
+    rows = read_csv(file) if import_format == CSV else read_ndjson(file)
+    stats = {'products': 0, 'errors': 0, 'products_created': 0, 'products_updated': 0, 'variants_created': 0,
+             'variants_updated': 0, 'price_changes': 0}
+    started = monotonic()
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        products, errors = validate_products(chunk)
+        if products:
+            for name, value in import_chunk(products).items():
+                stats[name] += value
+        stats['products'] += len(products)
+        stats['errors'] += len(errors)
+        elapsed = monotonic() - started
+        stats['elapsed_seconds'] = round(elapsed, 3)
+        stats['products_per_second'] = round(stats['products'] / elapsed, 1) if elapsed else None
+        logger.info(f'Imported {stats["products"]} products, {stats["errors"]} errors', extra=stats)
+        for error in errors:
+            logger.warning(f'Invalid product at line {error["line"]}', extra=error)
+        if progress is not None:
+            progress(stats, errors)
+    return stats
@@ -0,0 +1,69 @@
+import json
+import os
+
+from celery import current_app
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from store.benchmarks import SCALES, seed_catalog, run_benchmarks, compare, update_baselines
+
+
+class Command(BaseCommand):
+    help = ('Measure the latency, throughput and queries of the API actions and the update_rating task on seeded '
+            'catalogs, failing on regressions from the baselines (the catalogs are rolled back)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', choices=list(SCALES), dest='scales',
+                            help='Catalog size in variants, repeat for several (default: 1k)')
+        parser.add_argument('--variants', type=int, help='Custom catalog size in variants, instead of the scales')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed calls of each action')
+        parser.add_argument('--baselines', default=os.path.join(settings.BASE_DIR, 'benchmarks.json'),
+                            help='Baselines file')
+        parser.add_argument('--latency-threshold', type=float, default=1.5,
+                            help='Latency may be at most this many times the baseline')
+        parser.add_argument('--query-threshold', type=int, default=0, help='Queries allowed over the budget')
+        parser.add_argument('--update', action='store_true', help='Write the results as the new baselines')
+
+    def handle(self, *args, scales=None, variants=None, iterations=20, baselines=None, latency_threshold=1.5,
+               query_threshold=0, update=False, **options):
+        sizes = {str(variants): variants} if variants else {scale: SCALES[scale] for scale in scales or ['1k']}
+        path = baselines
+        baselines = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                baselines = json.load(file)
+        regressions = []
+        for scale, size in sizes.items():
+            self.stdout.write(f'Seeding {size} variants')
+            results = self.run_scale(size, iterations)
+            for name, metrics in results.items():
+                self.stdout.write(f'  {scale} {name}: p50 {metrics["p50_ms"]} ms, p95 {metrics["p95_ms"]} ms, '
+                                  f'{metrics["throughput_rps"]} req/s, {metrics["queries"]} queries')
+            if update:
+                update_baselines(baselines, results, scale)
+            else:
+                regressions.extend(f'{scale} {regression}' for regression in
+                                   compare(results, baselines, scale, latency_threshold, query_threshold))
+        if update:
+            with open(path, 'w') as file:
+                json.dump(baselines, file, indent=2, sort_keys=True)
+                file.write('\n')
+            self.stdout.write(self.style.SUCCESS(f'Wrote the baselines to {path}'))
+        if regressions:
+            raise CommandError('Regressions from the baselines:\n' + '\n'.join(regressions))
+
+    def run_scale(self, size, iterations):
+        # Cached responses and replicas, which cannot see the uncommitted catalog, would not measure the queries.
+        # Tasks run inline, as nothing about the rolled back catalog must reach the broker.
+        eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+        try:
+            with override_settings(RESPONSE_CACHE=False, DB_REPLICAS=[],
+                                   ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), transaction.atomic():
+                results = run_benchmarks(seed_catalog(size), iterations)
+                transaction.set_rollback(True)
+        finally:
+            current_app.conf.task_always_eager = eager
+        return results
@@ -0,0 +1,49 @@
+from timeit import repeat
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from store.api.planner import plan_queryset
+from store.api.renderers import ORJSONRenderer
+from store.api.serializers import ProductSerializer
+from store.factories import ProductFactory, ProductVariantFactory, TagFactory
+from store.models import Product, ProductVariant
+
+
+class Command(BaseCommand):
+    help = 'Compare the stdlib and orjson renderers on large product pages (the products are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000, help='Products in the page')
+        parser.add_argument('--variants', type=int, default=5, help='Variants per product')
+        parser.add_argument('--repeat', type=int, default=5, dest='repeat_count',
+                            help='Best of this many runs is reported')
+        parser.add_argument('--number', type=int, default=10, help='Renders per run')
+
+    def build_pages(self, products, variants):
+        """Serialized product page, plus raw variant rows with Decimal prices and datetimes"""
+        tags = TagFactory.create_batch(5)
+        for product in ProductFactory.create_batch(products, tags=tags):
+            ProductVariantFactory.create_batch(variants, product=product)
+        queryset = plan_queryset(Product.objects.order_by('id'), ProductSerializer())
+        return {
+            'products': ProductSerializer(queryset, many=True).data,
+            'variant rows': list(ProductVariant.objects.values()),
+        }
+
+    def handle(self, *args, products=1000, variants=5, repeat_count=5, number=10, **options):
+        with transaction.atomic():
+            pages = self.build_pages(products, variants)
+            transaction.set_rollback(True)
+        renderers = {'json': JSONRenderer(), 'orjson': ORJSONRenderer()}
+        for name, data in pages.items():
+            outputs = {label: renderer.render(data) for label, renderer in renderers.items()}
+            same = len(set(outputs.values())) == 1
+            self.stdout.write(f'{name}: {len(outputs["json"])} bytes, same output: {same}')
+            timings = {}
+            for label, renderer in renderers.items():
+                best = min(repeat(lambda: renderer.render(data), number=number, repeat=repeat_count)) / number
+                timings[label] = best
+                self.stdout.write(f'  {label}: {best * 1000:.2f} ms')
+            self.stdout.write(self.style.SUCCESS(f'  orjson is {timings["json"] / timings["orjson"]:.1f}x faster'))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.export import NDJSON, CSV, export_catalog
+
+
+class Command(BaseCommand):
+    help = 'Stream every product with its variants, tags and supplier, ordered by id, as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', choices=[NDJSON, CSV], default=NDJSON,
+                            help='Export format')
+        parser.add_argument('--after', type=int, help='Only export products with a greater id, to resume an export')
+        parser.add_argument('--output', help='File to write, appended to when resuming (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=settings.CATALOG_EXPORT_CHUNK_SIZE,
+                            help='Products read per query')
+
+    def handle(self, *args, export_format=NDJSON, after=None, output=None, chunk_size=1000, **options):
+        lines = export_catalog(export_format, after=after, chunk_size=chunk_size)
+        if export_format == CSV and after is not None:
+            next(lines)  # The header is already in the file being resumed
+        if output is None:
+            for line in lines:
+                self.stdout.write(line.decode(), ending='')
+            return
+        with open(output, 'wb' if after is None else 'ab') as file:
+            file.writelines(lines)
+        self.stderr.write(self.style.SUCCESS(f'Exported the catalog to {output}'))
@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from store.export import NDJSON, CSV
+from store.importer import load_catalog
+
+
+class Command(BaseCommand):
+    help = 'Import products, tags and variants from an NDJSON or CSV file in the layout of the catalog export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', dest='import_format', choices=[NDJSON, CSV],
+                            help='Import format (default: by the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Products imported per transaction')
+        parser.add_argument('--errors', help='File to write the invalid rows to, as NDJSON (default: stderr)')
+
+    def handle(self, *args, path=None, import_format=None, chunk_size=1000, errors=None, **options):
+        if import_format is None:
+            import_format = CSV if path.lower().endswith('.csv') else NDJSON
+        errors_file = open(errors, 'w') if errors else None
+
+        def progress(stats, error_rows):
+            for error in error_rows:
+                line = json.dumps(error, ensure_ascii=False)
+                if errors_file is None:
+                    self.stderr.write(line)
+                else:
+                    errors_file.write(f'{line}\n')
+            self.stdout.write(f'Imported {stats["products"]} products ({stats["products_per_second"]}/s), '
+                              f'{stats["errors"]} errors')
+
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                stats = load_catalog(file, import_format, chunk_size, progress)
+        finally:
+            if errors_file is not None:
+                errors_file.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats["products"]} products: {stats["products_created"]} created, '
+            f'{stats["products_updated"]} updated, {stats["variants_created"]} variants created, '
+            f'{stats["variants_updated"]} variants updated, {stats["price_changes"]} price changes, '
+            f'{stats["errors"]} errors'
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from store.partitions import is_partitioned, create_future_partitions, expire_partitions
+from store.tasks import compact_price_history
+
+
+class Command(BaseCommand):
+    help = 'Create future price history partitions, expire old ones and compact old history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3, help='Monthly partitions created in advance')
+        parser.add_argument('--retention-days', type=int, help='Expire partitions older than this (default: keep)')
+        parser.add_argument('--archive', action='store_true', help='Detach expired partitions instead of dropping')
+        parser.add_argument('--compact-after-days', type=int,
+                            help='Downsample history older than this to one row per variant per day (default: keep)')
+        parser.add_argument('--compact-window-days', type=int, default=7, help='Days compacted before the cutoff')
+
+    def handle(self, *args, months_ahead=3, retention_days=None, archive=False, compact_after_days=None,
+               compact_window_days=7, **options):
+        if is_partitioned():
+            for name in create_future_partitions(months_ahead):
+                self.stdout.write(f'Created partition {name}')
+            if retention_days is not None:
+                for name in expire_partitions(retention_days, archive=archive):
+                    self.stdout.write(f'{"Detached" if archive else "Dropped"} partition {name}')
+        else:
+            self.stdout.write('Price history is not partitioned, skipping partition maintenance')
+        if compact_after_days is not None:
+            deleted = compact_price_history(older_than_days=compact_after_days, window_days=compact_window_days)
+            self.stdout.write(f'Compacted {deleted} price history rows')
+        self.stdout.write(self.style.SUCCESS('Price history maintenance finished'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.tasks import rebuild_related_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the related products index of the whole catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Products rebuilt per query')
+        parser.add_argument('--async', action='store_true', dest='run_async', help='Run in a celery worker')
+
+    def handle(self, *args, chunk_size=1000, run_async=False, **options):
+        if run_async:
+            result = rebuild_related_products.delay(chunk_size=chunk_size)
+            self.stdout.write(self.style.SUCCESS(f'Created task rebuild_related_products {result.id}'))
+            return
+        total = rebuild_related_products(chunk_size=chunk_size)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} related products'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.search import create_search_index
+
+
+class Command(BaseCommand):
+    help = 'Create the product search index when missing and rebuild the search document of every product'
+
+    def handle(self, *args, **options):
+        create_search_index()
+        self.stdout.write(self.style.SUCCESS('Rebuilt the product search index'))
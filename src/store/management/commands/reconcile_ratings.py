@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+from store.tasks import reconcile_ratings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the rating counters of every product from its customer ratings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Products reconciled per query')
+
+    def handle(self, *args, chunk_size=1000, **options):
+        product_ids = Product.objects.order_by('id').values_list('id', flat=True)
+        total = 0
+        last_id = 0
+        while True:
+            chunk = list(product_ids.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            total += reconcile_ratings(chunk)
+            last_id = chunk[-1]
+            self.stdout.write(f'Reconciled {total} products')
+        self.stdout.write(self.style.SUCCESS(f'Reconciled rating counters of {total} products'))
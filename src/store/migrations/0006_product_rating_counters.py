@@ -0,0 +1,69 @@
+# Generated by Django 4.2.4 on 2026-10-18 09:21
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Q
+
+
+def backfill_rating_counters(apps, schema_editor):
+    product_model = apps.get_model('store', 'Product')
+    rating_model = apps.get_model('store', 'CustomerRating')
+    counters = {f'rating_{star}_count': Count('id', filter=Q(rating=star)) for star in range(1, 6)}
+    aggregates = rating_model.objects.order_by().values('product_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **counters,
+    ).order_by('product_id')
+    fields = ['rating_count', 'rating_sum', *counters]
+    products = []
+    for aggregate in aggregates.iterator(chunk_size=1000):
+        products.append(product_model(id=aggregate.pop('product_id'), **aggregate))
+        if len(products) == 1000:
+            product_model.objects.bulk_update(products, fields)
+            products = []
+    product_model.objects.bulk_update(products, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_alter_productvariant_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='1 Star Ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='2 Star Ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='3 Star Ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='4 Star Ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='5 Star Ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Rating Count'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='Rating Sum'),
+        ),
+        migrations.RunPython(backfill_rating_counters, migrations.RunPython.noop),
+    ]
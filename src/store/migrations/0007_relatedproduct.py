@@ -0,0 +1,50 @@
+# Generated by Django 4.2.4 on 2026-10-18 09:23
+
+from django.db import migrations, models
+from django.db.models import Count, F
+import django.db.models.deletion
+
+
+def build_related_products(apps, schema_editor):
+    product_model = apps.get_model('store', 'Product')
+    related_model = apps.get_model('store', 'RelatedProduct')
+    pairs = product_model.tags.through.objects.annotate(related_id=F('tag__products'))\
+        .exclude(related_id=F('product_id')).order_by()\
+        .values_list('product_id', 'related_id').annotate(shared_tags=Count('tag_id'))
+    related_products = []
+    for product_id, related_id, shared_tags in pairs.iterator(chunk_size=1000):
+        related_products.append(related_model(product_id=product_id, related_id=related_id, shared_tags=shared_tags))
+        if len(related_products) == 1000:
+            related_model.objects.bulk_create(related_products)
+            related_products = []
+    related_model.objects.bulk_create(related_products)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_product_rating_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shared_tags', models.PositiveIntegerField(verbose_name='Shared Tags')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='store.product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_from', to='store.product')),
+            ],
+            options={
+                'verbose_name': 'Related Product',
+                'verbose_name_plural': 'Related Products',
+                'ordering': ['product', '-shared_tags', 'related'],
+                'indexes': [models.Index(fields=['product', '-shared_tags', 'related'], name='store_related_ranking_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='relatedproduct',
+            constraint=models.UniqueConstraint(fields=('product', 'related'), name='Related product must be unique'),
+        ),
+        migrations.RunPython(build_related_products, migrations.RunPython.noop),
+    ]
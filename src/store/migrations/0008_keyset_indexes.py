@@ -0,0 +1,29 @@
+# Generated by Django 4.2.4 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerrating',
+            index=models.Index(fields=['-created_at', '-id'], name='store_rating_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pricehistory',
+            index=models.Index(fields=['product_variant', '-updated_at', '-id'], name='store_pricehistory_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='store_product_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['product', 'variant_name', 'variant_value', 'id'], name='store_variant_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 4.2.4 on 2026-10-18 09:30
+
+from datetime import date
+
+from django.db import migrations, models
+from django.utils.timezone import now
+import django.db.models.deletion
+
+
+# Frozen copies of the store.partitions helpers, so later changes to them do not change this migration
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    years, month_index = divmod(month.month - 1 + months, 12)
+    return date(month.year + years, month_index + 1, 1)
+
+
+def create_partition_sql(month):
+    return (
+        f'CREATE TABLE IF NOT EXISTS store_pricehistory_p{month:%Y%m} PARTITION OF store_pricehistory '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def partition_price_history(apps, schema_editor):
+    """Rebuild store_pricehistory as a table partitioned by month on updated_at (PostgreSQL only)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT min(updated_at) FROM store_pricehistory')
+        oldest = cursor.fetchone()[0]
+    current = month_start(now().date())
+    month = month_start(oldest.date()) if oldest else current
+    statements = [
+        'ALTER TABLE store_pricehistory RENAME TO store_pricehistory_unpartitioned',
+        '''CREATE TABLE store_pricehistory (
+            id bigint GENERATED BY DEFAULT AS IDENTITY,
+            price numeric(8, 2) NOT NULL,
+            updated_at timestamp with time zone NOT NULL,
+            product_variant_id bigint NOT NULL,
+            PRIMARY KEY (id, updated_at)
+        ) PARTITION BY RANGE (updated_at)''',
+        'CREATE TABLE store_pricehistory_default PARTITION OF store_pricehistory DEFAULT',
+    ]
+    while month <= add_months(current, 3):
+        statements.append(create_partition_sql(month))
+        month = add_months(month, 1)
+    statements += [
+        'INSERT INTO store_pricehistory (id, price, updated_at, product_variant_id) '
+        'SELECT id, price, updated_at, product_variant_id FROM store_pricehistory_unpartitioned',
+        "SELECT setval(pg_get_serial_sequence('store_pricehistory', 'id'), "
+        'coalesce((SELECT max(id) FROM store_pricehistory), 0) + 1, false)',
+        'DROP TABLE store_pricehistory_unpartitioned',
+        'ALTER TABLE store_pricehistory ADD CONSTRAINT store_pricehistory_product_variant_id_fk '
+        'FOREIGN KEY (product_variant_id) REFERENCES store_productvariant (id) DEFERRABLE INITIALLY DEFERRED',
+        'CREATE INDEX store_pricehistory_recent_idx ON store_pricehistory '
+        '(product_variant_id, updated_at DESC, id DESC) INCLUDE (price)',
+    ]
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='pricehistory',
+            name='store_pricehistory_keyset_idx',
+        ),
+        migrations.AlterField(
+            model_name='pricehistory',
+            name='product_variant',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='price_history', to='store.productvariant'),
+        ),
+        migrations.AddIndex(
+            model_name='pricehistory',
+            index=models.Index(fields=['product_variant', '-updated_at', '-id'], include=('price',), name='store_pricehistory_recent_idx'),
+        ),
+        migrations.RunPython(partition_price_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.4 on 2026-10-18 10:11
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+# Frozen copies of the store.search DDL and fill queries, so later changes to them do not change this migration
+UPDATE_SEARCH_VECTOR_SQL = '''
+UPDATE store_product AS product SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, product.name), 'A') ||
+    setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT string_agg(tag.name, ' ') FROM store_tag AS tag
+        JOIN store_product_tags AS product_tag ON product_tag.tag_id = tag.id
+        WHERE product_tag.product_id = product.id
+    ), '')), 'B') ||
+    setweight(to_tsvector(%(config)s::regconfig, supplier.name), 'B') ||
+    setweight(to_tsvector(%(config)s::regconfig, product.description), 'C')
+FROM store_supplier AS supplier
+WHERE supplier.id = product.supplier_id
+'''
+
+INSERT_FTS_SQL = '''
+INSERT INTO store_product_search (rowid, name, description, tags, supplier)
+SELECT product.id, product.name, product.description, coalesce((
+    SELECT group_concat(tag.name, ' ') FROM store_tag AS tag
+    JOIN store_product_tags AS product_tag ON product_tag.tag_id = tag.id
+    WHERE product_tag.product_id = product.id
+), ''), supplier.name
+FROM store_product AS product
+JOIN store_supplier AS supplier ON supplier.id = product.supplier_id
+'''
+
+
+def create_index(apps, schema_editor):
+    """GIN index of the search vectors on PostgreSQL, FTS5 table on SQLite, filled for the existing products"""
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('CREATE INDEX IF NOT EXISTS store_product_search_idx ON store_product '
+                           'USING gin (search_vector)')
+            cursor.execute(UPDATE_SEARCH_VECTOR_SQL, {'config': settings.SEARCH_CONFIG})
+        elif connection.vendor == 'sqlite':
+            cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS store_product_search USING fts5('
+                           "name, description, tags, supplier, tokenize='unicode61 remove_diacritics 2')")
+            cursor.execute(INSERT_FTS_SQL)
+
+
+def drop_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('DROP INDEX IF EXISTS store_product_search_idx')
+        elif connection.vendor == 'sqlite':
+            cursor.execute('DROP TABLE IF EXISTS store_product_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Search Vector'),
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.4 on 2026-10-18 10:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_product_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerrating',
+            index=models.Index(fields=['product', '-created_at', '-id'], name='store_rating_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['supplier', 'name', 'id'], name='store_product_supplier_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['variant_name', 'variant_value', 'product', 'id'], name='store_variant_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(condition=models.Q(('in_stock', True)), fields=['product', 'variant_name', 'variant_value', 'id'], name='store_variant_in_stock_idx'),
+        ),
+        # The composite indexes start with the foreign keys, whose own indexes are dropped once they exist
+        migrations.AlterField(
+            model_name='customerrating',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='ratings', to='store.product'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='supplier',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='products', to='store.supplier'),
+        ),
+        migrations.AlterField(
+            model_name='productvariant',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='variants', to='store.product'),
+        ),
+    ]
@@ -1,76 +1,230 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
-
-
-class Tag(models.Model):
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, NullIf
+from django.utils.timezone import now
+
+
+class TrackChangesMixin:
+    """Remember the field values loaded from the database so signal handlers can react only to real changes"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.track_changes()
+        return instance
+
+    def track_changes(self):
+        # Deferred fields are not in __dict__ and are left out instead of being loaded
+        self._loaded_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+    def get_changed_fields(self):
+        """Return the attnames changed since load or last save, every loaded field for unsaved instances"""
+        loaded_values = getattr(self, '_loaded_values', {})
+        changed = set()
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue
+            if field.attname not in loaded_values or loaded_values[field.attname] != self.__dict__[field.attname]:
+                changed.add(field.attname)
+        return changed
+
+    def has_changed(self, field_name):
+        return self._meta.get_field(field_name).attname in self.get_changed_fields()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.track_changes()
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None:
+            self.track_changes()
+            return
+        # Loading a deferred field must not forget the pending changes of the other fields
+        loaded_values = getattr(self, '_loaded_values', {})
+        for field_name in fields:
+            attname = self._meta.get_field(field_name).attname
+            loaded_values[attname] = self.__dict__.get(attname)
+        self._loaded_values = loaded_values
+
+
+class VersionedQuerySet(models.QuerySet):
+    def touch(self):
+        """Bump the version of the rows so conditional requests see them as changed"""
+        return self.update(version=F('version') + 1, updated_at=now())
+
+
+class Tag(TrackChangesMixin, models.Model):
     class Meta:
         verbose_name = 'Tag'
         verbose_name_plural = 'Tags'
         ordering = ['name']
     name = models.CharField('Name', max_length=50, blank=False, null=False, unique=True)
     description = models.CharField('Description', max_length=100, blank=True, null=True)
+    version = models.PositiveBigIntegerField('Version', default=1, editable=False)
+    updated_at = models.DateTimeField('Updated At', auto_now=True)
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
 
-class Supplier(models.Model):
+class Supplier(TrackChangesMixin, models.Model):
     class Meta:
         verbose_name = 'Supplier'
         verbose_name_plural = 'Suppliers'
         ordering = ['name']
     name = models.CharField('Name', max_length=100, blank=False, null=False, unique=True)
+    version = models.PositiveBigIntegerField('Version', default=1, editable=False)
+    updated_at = models.DateTimeField('Updated At', auto_now=True)
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
 
-class Product(models.Model):
+class ProductQuerySet(VersionedQuerySet):
+    def add_rating(self, rating, amount=1):
+        """Atomically add (or remove with a negative amount) a rating to the counters of the products
+
+        The rating is derived from the counters in the same UPDATE, whose expressions read the values before it.
+        """
+        return self.update(**{
+            'version': F('version') + 1,
+            'updated_at': now(),
+            'rating_count': F('rating_count') + amount,
+            'rating_sum': F('rating_sum') + rating * amount,
+            f'rating_{rating}_count': F(f'rating_{rating}_count') + amount,
+            'rating': Cast(F('rating_sum') + rating * amount, FloatField()) / NullIf(F('rating_count') + amount, 0),
+        })
+
+    def replace_rating(self, previous, rating):
+        """Atomically replace a rating of the products by another one, deriving the rating in the same UPDATE"""
+        difference = rating - previous
+        return self.update(**{
+            'version': F('version') + 1,
+            'updated_at': now(),
+            'rating_sum': F('rating_sum') + difference,
+            f'rating_{previous}_count': F(f'rating_{previous}_count') - 1,
+            f'rating_{rating}_count': F(f'rating_{rating}_count') + 1,
+            'rating': Cast(F('rating_sum') + difference, FloatField()) / NullIf(F('rating_count'), 0),
+        })
+
+    def update_rating(self):
+        """Derive the rating of the products from their counters"""
+        return self.update(
+            rating=Cast('rating_sum', FloatField()) / NullIf('rating_count', 0),
+            version=F('version') + 1,
+            updated_at=now(),
+        )
+
+
+class Product(TrackChangesMixin, models.Model):
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
         ordering = ['name']
-    supplier = models.ForeignKey(Supplier, on_delete=models.PROTECT, related_name='products')
+        indexes = [
+            models.Index(fields=['name', 'id'], name='store_product_keyset_idx'),
+            # ?supplier= sorted by name, also the index of the foreign key
+            models.Index(fields=['supplier', 'name', 'id'], name='store_product_supplier_idx'),
+        ]
+    objects = ProductQuerySet.as_manager()
+    supplier = models.ForeignKey(Supplier, on_delete=models.PROTECT, related_name='products', db_index=False)
     name = models.CharField('Name', max_length=50, blank=False, null=False)
     description = models.TextField('Description', blank=False, null=False)
     tags = models.ManyToManyField(Tag, related_name='products')
     rating = models.FloatField('Rating', null=True, blank=True)
+    rating_count = models.PositiveIntegerField('Rating Count', default=0)
+    rating_sum = models.PositiveIntegerField('Rating Sum', default=0)
+    rating_1_count = models.PositiveIntegerField('1 Star Ratings', default=0)
+    rating_2_count = models.PositiveIntegerField('2 Star Ratings', default=0)
+    rating_3_count = models.PositiveIntegerField('3 Star Ratings', default=0)
+    rating_4_count = models.PositiveIntegerField('4 Star Ratings', default=0)
+    rating_5_count = models.PositiveIntegerField('5 Star Ratings', default=0)
+    version = models.PositiveBigIntegerField('Version', default=1, editable=False)
+    updated_at = models.DateTimeField('Updated At', auto_now=True)
+    # Maintained by store.search.update_search_index, GIN indexed on PostgreSQL (SQLite uses a FTS5 table instead)
+    search_vector = SearchVectorField('Search Vector', null=True, editable=False)
 
     @property
     def related_products(self):
-        return Product.objects.filter(tags__in=self.tags.all()).distinct().exclude(id=self.id)[:10]
+        """Products sharing the most tags with this one, read from the RelatedProduct index"""
+        ordering = ['-related_from__shared_tags', 'related_from__related_id']
+        return Product.objects.filter(related_from__product=self).order_by(*ordering)[:10]
 
     def __str__(self):
         return self.name
 
 
-class ProductVariant(models.Model):
+class RelatedProduct(models.Model):
+    class Meta:
+        verbose_name = 'Related Product'
+        verbose_name_plural = 'Related Products'
+        ordering = ['product', '-shared_tags', 'related']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='Related product must be unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-shared_tags', 'related'], name='store_related_ranking_idx'),
+        ]
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_to')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_from')
+    shared_tags = models.PositiveIntegerField('Shared Tags')
+
+    def __str__(self):
+        return f'{self.product.name} related to {self.related.name}'
+
+
+class ProductVariant(TrackChangesMixin, models.Model):
     class Meta:
         verbose_name = 'Product Variant'
         verbose_name_plural = 'Product Variants'
         ordering = ['product', 'variant_name', 'variant_value']
-    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='variants')
+        indexes = [
+            # Also the index of the product foreign key
+            models.Index(fields=['product', 'variant_name', 'variant_value', 'id'], name='store_variant_keyset_idx'),
+            # ?variant_name= and ?variant_value= (with or without product), only variants in stock for ?in_stock=true
+            models.Index(fields=['variant_name', 'variant_value', 'product', 'id'], name='store_variant_value_idx'),
+            models.Index(fields=['product', 'variant_name', 'variant_value', 'id'], condition=models.Q(in_stock=True),
+                         name='store_variant_in_stock_idx'),
+        ]
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='variants', db_index=False)
     variant_name = models.CharField('Variant Name', max_length=20, blank=False, null=False)
     variant_value = models.CharField('Variant Value', max_length=50, blank=False, null=False)
     sku = models.CharField('SKU', max_length=8, blank=False, null=False, unique=True)
     in_stock = models.BooleanField('In Stock',  blank=True, default=False)
     price = models.DecimalField('Price', max_digits=8, decimal_places=2, blank=False, null=False)
+    version = models.PositiveBigIntegerField('Version', default=1, editable=False)
+    updated_at = models.DateTimeField('Updated At', auto_now=True)
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.product.name} - {self.variant_name}:{self.variant_value}'
 
 
-class CustomerRating(models.Model):
+class CustomerRating(TrackChangesMixin, models.Model):
     class Meta:
         verbose_name = 'Customer Rating'
         verbose_name_plural = 'Customer Ratings'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='store_rating_keyset_idx'),
+            # ?product= sorted by -created_at, also the index of the foreign key
+            models.Index(fields=['product', '-created_at', '-id'], name='store_rating_product_idx'),
+        ]
         constraints = [
             models.CheckConstraint(
                 check=models.Q(rating__gte=1) & models.Q(rating__lte=5),
                 name="Rating must be between 1 and 5",
             )
         ]
-    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='ratings')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='ratings', db_index=False)
     rating = models.IntegerField('Rating', blank=False, null=False)
     description = models.TextField('Description', max_length=100, blank=False, null=False)
     created_at = models.DateTimeField('Created At', auto_now_add=True)
@@ -84,7 +238,13 @@ class PriceHistory(models.Model):
         verbose_name = 'Price History'
         verbose_name_plural = 'Price History'
         ordering = ['-updated_at']
-    product_variant = models.ForeignKey(ProductVariant, on_delete=models.PROTECT, related_name='price_history')
+        indexes = [
+            # Covers the "last 10 prices of a variant" reads with an index only scan (per partition on PostgreSQL)
+            models.Index(fields=['product_variant', '-updated_at', '-id'], include=['price'],
+                         name='store_pricehistory_recent_idx'),
+        ]
+    product_variant = models.ForeignKey(ProductVariant, on_delete=models.PROTECT, related_name='price_history',
+                                        db_index=False)
     price = models.DecimalField('Price', max_digits=8, decimal_places=2, blank=False, null=False)
     updated_at = models.DateTimeField('Updated At', auto_now_add=True)
 
@@ -0,0 +1,84 @@
+import re
+from datetime import date, timedelta
+
+from django.db import connection
+from django.utils.timezone import now
+
+TABLE = 'store_pricehistory'
+PARTITION_PATTERN = re.compile(rf'^{TABLE}_p(\d{{4}})(\d{{2}})$')
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    years, month_index = divmod(month.month - 1 + months, 12)
+    return date(month.year + years, month_index + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y%m}'
+
+
+def create_partition_sql(month):
+    return (
+        f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {TABLE} '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABLE])
+        return cursor.fetchone() is not None
+
+
+def get_partitions():
+    """Return the monthly partitions of the price history table as {month: name}"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass',
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def create_future_partitions(months_ahead=3, today=None):
+    """Create the partitions of the current month and the next months_ahead months"""
+    current = month_start(today or now().date())
+    existing = get_partitions()
+    created = []
+    with connection.cursor() as cursor:
+        for months in range(months_ahead + 1):
+            month = add_months(current, months)
+            if month not in existing:
+                cursor.execute(create_partition_sql(month))
+                created.append(partition_name(month))
+    return created
+
+
+def expire_partitions(retention_days, archive=False, today=None):
+    """Drop (or detach as standalone archive tables) the partitions whose rows are all older than retention_days"""
+    cutoff = (today or now().date()) - timedelta(days=retention_days)
+    expired = []
+    with connection.cursor() as cursor:
+        for month, name in sorted(get_partitions().items()):
+            if add_months(month, 1) > cutoff:
+                continue
+            if archive:
+                cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+            else:
+                cursor.execute(f'DROP TABLE {name}')
+            expired.append(name)
+    return expired
@@ -0,0 +1,118 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchHeadline
+from django.db import connection
+from django.db.models import F, FloatField, TextField
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'store_product_search'
+SNIPPET_START = '<b>'
+SNIPPET_STOP = '</b>'
+
+# Product name, then tags and supplier name, then description, as the A, B and C weights of the tsvector
+UPDATE_SEARCH_VECTOR_SQL = '''
+UPDATE store_product AS product SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, product.name), 'A') ||
+    setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT string_agg(tag.name, ' ') FROM store_tag AS tag
+        JOIN store_product_tags AS product_tag ON product_tag.tag_id = tag.id
+        WHERE product_tag.product_id = product.id
+    ), '')), 'B') ||
+    setweight(to_tsvector(%(config)s::regconfig, supplier.name), 'B') ||
+    setweight(to_tsvector(%(config)s::regconfig, product.description), 'C')
+FROM store_supplier AS supplier
+WHERE supplier.id = product.supplier_id
+'''
+
+INSERT_FTS_SQL = f'''
+INSERT INTO {FTS_TABLE} (rowid, name, description, tags, supplier)
+SELECT product.id, product.name, product.description, coalesce((
+    SELECT group_concat(tag.name, ' ') FROM store_tag AS tag
+    JOIN store_product_tags AS product_tag ON product_tag.tag_id = tag.id
+    WHERE product_tag.product_id = product.id
+), ''), supplier.name
+FROM store_product AS product
+JOIN store_supplier AS supplier ON supplier.id = product.supplier_id
+'''
+
+
+def create_search_index():
+    """Create the GIN index of the search vectors (PostgreSQL) or the FTS5 table (SQLite) and fill it"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('CREATE INDEX IF NOT EXISTS store_product_search_idx ON store_product '
+                           'USING gin (search_vector)')
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+                           "name, description, tags, supplier, tokenize='unicode61 remove_diacritics 2')")
+    update_search_index()
+
+
+def drop_search_index():
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('DROP INDEX IF EXISTS store_product_search_idx')
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def update_search_index(product_ids=None):
+    """Rebuild the search document of the products from their name, description, tags and supplier
+
+    Every product is rebuilt when product_ids is None. Deleted products are dropped from the SQLite FTS5 table,
+    on PostgreSQL their vector goes away with the row.
+    """
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            params = {'config': settings.SEARCH_CONFIG}
+            sql = UPDATE_SEARCH_VECTOR_SQL
+            if product_ids is not None:
+                sql += ' AND product.id = ANY(%(product_ids)s)'
+                params['product_ids'] = product_ids
+            cursor.execute(sql, params)
+        elif connection.vendor == 'sqlite':
+            if product_ids is None:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+                cursor.execute(INSERT_FTS_SQL)
+                return
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+            cursor.execute(f'{INSERT_FTS_SQL} WHERE product.id IN ({placeholders})', product_ids)
+
+
+def get_fts_query(text):
+    # Every word must match, quoted so the FTS5 query syntax in the text is searched as plain words
+    return ' '.join(f'"{word}"' for word in re.findall(r'\w+', text))
+
+
+def search_products(queryset, text):
+    """Filter the products matching text, annotated with search_rank and search_snippet and ordered by rank
+
+    PostgreSQL takes websearch syntax (quotes, OR, -word) and ranks with ts_rank on the stored vector. SQLite
+    matches every word of text on the FTS5 table and ranks with bm25, so the rank scales differ.
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(text, config=settings.SEARCH_CONFIG, search_type='websearch')
+        queryset = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query),
+            search_snippet=SearchHeadline('description', query, config=settings.SEARCH_CONFIG,
+                                          start_sel=SNIPPET_START, stop_sel=SNIPPET_STOP),
+        )
+    else:
+        fts_query = get_fts_query(text)
+        if not fts_query:
+            return queryset.none()
+        match = f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+        correlated = f'{match} AND {FTS_TABLE}.rowid = store_product.id'
+        queryset = queryset.filter(id__in=RawSQL(f'SELECT rowid {match}', [fts_query])).annotate(
+            search_rank=RawSQL(f'SELECT -bm25({FTS_TABLE}, 10.0, 2.0, 4.0, 4.0) {correlated}', [fts_query],
+                               output_field=FloatField()),
+            search_snippet=RawSQL(f"SELECT snippet({FTS_TABLE}, 1, %s, %s, '...', 32) {correlated}",
+                                  [SNIPPET_START, SNIPPET_STOP, fts_query], output_field=TextField()),
+        )
+    return queryset.defer('search_vector').order_by('-search_rank', 'id')
@@ -1,20 +1,156 @@
 import logging
 
 from django.apps import apps
+from django.conf import settings
+from django.db import transaction
 
-from store.tasks import update_rating
+from bringel.jwt import revoke_token
+from store.cache import invalidate_products
+from store.coalescing import mark_rating_dirty
+from store.history import write_price_history
+from store.search import update_search_index
+from store.tasks import flush_ratings, update_related_products
 
 logger = logging.getLogger(__name__)
 
 
-def customer_rating_post_save(sender, instance, **__):
-    logger.info("Received customer_rating_post_save", extra={"product_id": instance.product.id})
-    update_rating.delay(instance.product.id)
-    logger.info('Created task update_rating', extra={'product_id': instance.product.id})
+def coalesce_rating(product_id):
+    if mark_rating_dirty(product_id):
+        flush_ratings.apply_async(countdown=settings.RATING_FLUSH_INTERVAL)
+        logger.info('Created task flush_ratings', extra={'product_id': product_id})
 
 
-def product_variant_post_save(sender, instance, **__):
+def customer_rating_post_save(sender, instance, created=False, **__):
+    logger.info("Received customer_rating_post_save", extra={"product_id": instance.product_id})
+    if settings.RATING_COALESCE:
+        coalesce_rating(instance.product_id)
+        previous_product_id = getattr(instance, '_loaded_values', {}).get('product_id', instance.product_id)
+        if previous_product_id != instance.product_id:
+            coalesce_rating(previous_product_id)
+        return
+    model_product = apps.get_model(app_label='store', model_name='Product')
+    if created:
+        model_product.objects.filter(id=instance.product_id).add_rating(instance.rating)
+        invalidate_products([instance.product_id])
+        return
+    # An edited rating moves its score between the counters, from the values it was loaded with
+    previous = getattr(instance, '_loaded_values', {})
+    previous_product_id = previous.get('product_id', instance.product_id)
+    previous_rating = previous.get('rating', instance.rating)
+    if previous_product_id != instance.product_id:
+        model_product.objects.filter(id=previous_product_id).add_rating(previous_rating, amount=-1)
+        model_product.objects.filter(id=instance.product_id).add_rating(instance.rating)
+    elif previous_rating != instance.rating:
+        model_product.objects.filter(id=instance.product_id).replace_rating(previous_rating, instance.rating)
+    else:
+        return
+    invalidate_products({previous_product_id, instance.product_id})
+
+
+def customer_rating_post_delete(sender, instance, **__):
+    logger.info("Received customer_rating_post_delete", extra={"product_id": instance.product_id})
+    if settings.RATING_COALESCE:
+        coalesce_rating(instance.product_id)
+        return
+    model_product = apps.get_model(app_label='store', model_name='Product')
+    model_product.objects.filter(id=instance.product_id).add_rating(instance.rating, amount=-1)
+    invalidate_products([instance.product_id])
+
+
+def versioned_pre_save(sender, instance, **__):
+    if not instance._state.adding:
+        instance.version += 1
+
+
+def touch_products(**filters):
+    model_product = apps.get_model(app_label='store', model_name='Product')
+    products = model_product.objects.filter(**filters)
+    products.touch()
+    invalidate_products(products.values_list('id', flat=True))
+
+
+def product_post_save(sender, instance, **__):
+    invalidate_products([instance.id])
+    # Always, a full save writes back the search vector loaded with the instance
+    update_search_index([instance.id])
+
+
+def product_post_delete(sender, instance, **__):
+    invalidate_products([instance.id])
+    update_search_index([instance.id])
+
+
+def tag_post_save(sender, instance, created=False, **__):
+    if not created and instance.has_changed('name'):
+        logger.info("Tag renamed, touching its products", extra={"tag_id": instance.id})
+        touch_products(tags=instance)
+        update_search_index(instance.products.values_list('id', flat=True))
+
+
+def tag_pre_delete(sender, instance, **__):
+    # The cascade deletes the product links without m2m_changed, so the products are only known before it
+    instance._deleted_product_ids = list(instance.products.values_list('id', flat=True))
+
+
+def tag_post_delete(sender, instance, **__):
+    product_ids = getattr(instance, '_deleted_product_ids', [])
+    logger.info("Received tag_post_delete", extra={"tag_id": instance.id, "product_ids": product_ids})
+    if product_ids:
+        touch_products(id__in=product_ids)
+        update_search_index(product_ids)
+        queue_related_products_update(product_ids)
+
+
+def supplier_post_save(sender, instance, created=False, **__):
+    if not created and instance.has_changed('name'):
+        logger.info("Supplier renamed, touching its products", extra={"supplier_id": instance.id})
+        touch_products(supplier=instance)
+        update_search_index(instance.products.values_list('id', flat=True))
+
+
+def product_variant_post_save(sender, instance, created=False, update_fields=None, **__):
     logger.info("Received product_variant_post_save", extra={"product_variant_id": instance.id})
+    # A variant moved to another product changes both products
+    product_ids = {instance.product_id, getattr(instance, '_loaded_values', {}).get('product_id', instance.product_id)}
+    touch_products(id__in=product_ids)
+    price_saved = update_fields is None or 'price' in update_fields
+    if not created and not (price_saved and instance.has_changed('price')):
+        logger.info('Price did not change', extra={'product_variant_id': instance.id})
+        return
     logger.info('Updating price history', extra={'product_variant_id': instance.id})
-    model_price_history = apps.get_model(app_label='store', model_name='PriceHistory')
-    model_price_history.objects.create(product_variant_id=instance.id, price=instance.price)
+    write_price_history(instance.id, instance.price)
+
+
+def product_variant_post_delete(sender, instance, **__):
+    logger.info("Received product_variant_post_delete", extra={"product_variant_id": instance.id})
+    touch_products(id=instance.product_id)
+
+
+def queue_related_products_update(product_ids):
+    # After commit, so the worker does not rebuild the index from the tags before the change
+    transaction.on_commit(lambda: update_related_products.delay(product_ids))
+    logger.info('Created task update_related_products', extra={'product_ids': product_ids})
+
+
+def product_tags_m2m_changed(sender, instance, action, reverse, pk_set, **__):
+    if reverse and action == 'pre_clear':
+        # The cleared products are only known before the clear happens
+        instance._cleared_product_ids = list(instance.products.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        product_ids = list(pk_set or getattr(instance, '_cleared_product_ids', []))
+    else:
+        product_ids = [instance.id]
+    logger.info("Received product_tags_m2m_changed", extra={"product_ids": product_ids, "action": action})
+    if product_ids:
+        touch_products(id__in=product_ids)
+        update_search_index(product_ids)
+        queue_related_products_update(product_ids)
+
+
+def access_token_post_delete(sender, instance, **__):
+    # Revoked tokens are deleted, deny them to the stateless JWT authentication too
+    logger.info("Received access_token_post_delete", extra={"access_token_id": instance.id})
+    revoke_token(instance.token)
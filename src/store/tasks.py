@@ -1,20 +1,160 @@
 import logging
+from datetime import timedelta
 
 from celery import shared_task
 from django.apps import apps
-from django.db.models import Avg
+from django.db import transaction
+from django.db.models import Count, Sum, Q, F, Window
+from django.db.models.functions import RowNumber
+from django.utils.timezone import now
 
+from store.cache import invalidate_products
+from store.coalescing import pop_dirty_products, record_flush
 
 logger = logging.getLogger(__name__)
 
+RATING_STARS = range(1, 6)
+
 
 @shared_task(serializer='json')
 def update_rating(product_id):
     logger.info(f'Updating rating of product {product_id}', extra={'product_id': product_id})
     product_model = apps.get_model(app_label='store', model_name='Product')
-    product = product_model.objects.get(id=product_id)
-    aggregate = product.ratings.aggregate(rating=Avg('rating'))
-    rating = aggregate['rating']
+    product_model.objects.filter(id=product_id).update_rating()
+    invalidate_products([product_id])
+    rating = product_model.objects.values_list('rating', flat=True).get(id=product_id)
     logger.info(f'New rating of product {product_id}: {rating}', extra={'product_id': product_id, 'rating': rating})
-    product.rating = rating
-    product.save()
+
+
+def reconcile_ratings(product_ids):
+    """Rebuild the rating counters of the given products from their ratings with one grouped query"""
+    product_model = apps.get_model(app_label='store', model_name='Product')
+    rating_model = apps.get_model(app_label='store', model_name='CustomerRating')
+    counters = {f'rating_{star}_count': Count('id', filter=Q(rating=star)) for star in RATING_STARS}
+    aggregates = rating_model.objects.filter(product_id__in=product_ids).order_by().values('product_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **counters,
+    )
+    aggregates = {aggregate.pop('product_id'): aggregate for aggregate in aggregates}
+    products = []
+    for product_id in product_ids:
+        product = product_model(id=product_id, rating_count=0, rating_sum=0, **{name: 0 for name in counters})
+        for name, value in aggregates.get(product_id, {}).items():
+            setattr(product, name, value)
+        product.rating = product.rating_sum / product.rating_count if product.rating_count else None
+        product.version = F('version') + 1
+        product.updated_at = now()
+        products.append(product)
+    fields = ['rating', 'rating_count', 'rating_sum', *counters, 'version', 'updated_at']
+    product_model.objects.bulk_update(products, fields)
+    invalidate_products(product_ids)
+    return len(products)
+
+
+@shared_task(serializer='json')
+def flush_ratings(chunk_size=1000):
+    """Recompute every product that received ratings since the last flush"""
+    product_ids = pop_dirty_products()
+    for start in range(0, len(product_ids), chunk_size):
+        reconcile_ratings(product_ids[start:start + chunk_size])
+    stats = record_flush(len(product_ids))
+    logger.info(f'Flushed ratings of {len(product_ids)} products', extra=stats)
+    return stats
+
+
+def shared_tag_counts(product_ids):
+    """Return (product_id, related_id, shared_tags) for every product sharing tags with the given products"""
+    product_model = apps.get_model(app_label='store', model_name='Product')
+    product_tags = product_model.tags.through.objects.filter(product_id__in=product_ids)
+    return product_tags.annotate(related_id=F('tag__products')).exclude(related_id=F('product_id')).order_by()\
+        .values_list('product_id', 'related_id').annotate(shared_tags=Count('tag_id'))
+
+
+@shared_task(serializer='json')
+def update_related_products(product_ids):
+    """Refresh the related products index of the products whose tags changed, in both directions"""
+    logger.info('Updating related products', extra={'product_ids': product_ids})
+    related_model = apps.get_model(app_label='store', model_name='RelatedProduct')
+    changed = set(product_ids)
+    related_products = []
+    for product_id, related_id, shared_tags in shared_tag_counts(product_ids):
+        related_products.append(related_model(product_id=product_id, related_id=related_id, shared_tags=shared_tags))
+        if related_id not in changed:
+            related_products.append(
+                related_model(product_id=related_id, related_id=product_id, shared_tags=shared_tags)
+            )
+    with transaction.atomic():
+        previous = related_model.objects.filter(Q(product_id__in=changed) | Q(related_id__in=changed))
+        touched = set(previous.values_list('product_id', flat=True))
+        touched.update(related_product.product_id for related_product in related_products)
+        previous.delete()
+        related_model.objects.bulk_create(related_products, batch_size=1000)
+        # Products whose related list changed must look modified to conditional requests
+        apps.get_model(app_label='store', model_name='Product').objects.filter(id__in=touched).touch()
+        invalidate_products(touched)
+    return len(related_products)
+
+
+@shared_task(serializer='json')
+def rebuild_related_products(chunk_size=1000):
+    """Rebuild the related products index of the whole catalog"""
+    product_model = apps.get_model(app_label='store', model_name='Product')
+    related_model = apps.get_model(app_label='store', model_name='RelatedProduct')
+    product_ids = product_model.objects.order_by('id').values_list('id', flat=True)
+    total = 0
+    last_id = 0
+    while True:
+        chunk = list(product_ids.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+        related_products = [
+            related_model(product_id=product_id, related_id=related_id, shared_tags=shared_tags)
+            for product_id, related_id, shared_tags in shared_tag_counts(chunk)
+        ]
+        with transaction.atomic():
+            related_model.objects.filter(product_id__in=chunk).delete()
+            related_model.objects.bulk_create(related_products, batch_size=1000)
+        total += len(related_products)
+        last_id = chunk[-1]
+    logger.info(f'Rebuilt {total} related products', extra={'related_products': total})
+    return total
+
+
+@shared_task(serializer='json')
+def compact_price_history(older_than_days=90, window_days=7, batch_size=1000):
+    """Keep only the last price of each variant per day for the window_days days before older_than_days ago"""
+    model_price_history = apps.get_model(app_label='store', model_name='PriceHistory')
+    cutoff = now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=older_than_days)
+    deleted = 0
+    for days in range(window_days, 0, -1):
+        day = model_price_history.objects.filter(
+            updated_at__gte=cutoff - timedelta(days=days),
+            updated_at__lt=cutoff - timedelta(days=days - 1),
+        )
+        position = Window(RowNumber(), partition_by=[F('product_variant_id')],
+                          order_by=[F('updated_at').desc(), F('id').desc()])
+        ids = list(day.annotate(position=position).filter(position__gt=1).values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            deleted += day.filter(id__in=ids[start:start + batch_size]).delete()[0]
+    logger.info(f'Compacted {deleted} price history rows', extra={'deleted': deleted})
+    return deleted
+
+
+@shared_task(bind=True, serializer='json')
+def import_catalog(self, path, import_format='ndjson', chunk_size=1000, max_errors=1000):
+    """Import a catalog file readable by the workers, reporting the stats as the PROGRESS state after every chunk
+
+    Returns the stats and the first max_errors error rows.
+    """
+    from store.importer import load_catalog  # The importer needs the serializers, which need the models loaded
+
+    error_rows = []
+
+    def progress(stats, errors):
+        error_rows.extend(errors[:max_errors - len(error_rows)])
+        self.update_state(state='PROGRESS', meta=stats)
+
+    with open(path, newline='', encoding='utf-8') as file:
+        stats = load_catalog(file, import_format, chunk_size, progress)
+    return {**stats, 'error_rows': error_rows}
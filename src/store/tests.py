@@ -1,14 +1,32 @@
+import csv
+import json
+import os
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
 from itertools import cycle
+from tempfile import TemporaryDirectory
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
 
 from store.admin import ReadOnlyAdminMixin
+from store.benchmarks import compare, update_baselines
+from store.cache import get_or_render, get_stats as get_cache_stats, invalidate_products, response_key
+from store.coalescing import get_stats
+from store.export import export_catalog
 from store.factories import CustomerRatingFactory, ProductVariantFactory, ProductFactory, PriceHistoryFactory, \
     TagFactory, SupplierFactory
-from store.models import Tag, Product
-from store.signals import customer_rating_post_save, product_variant_post_save
-from store.tasks import update_rating
+from store.importer import load_catalog
+from store.models import Tag, Product, RelatedProduct, ProductVariant, PriceHistory, CustomerRating
+from store.signals import product_variant_post_save
+from store.partitions import add_months, create_partition_sql
+from store.search import search_products, get_fts_query, update_search_index
+from store.tasks import update_rating, flush_ratings, compact_price_history, import_catalog
 
 
 class TagTestCase(TestCase):
@@ -36,20 +54,134 @@ class ReadOnlyAdminMixinTestCase(TestCase):
 class SignalsTestCase(TestCase):
 
     @patch('store.tasks.update_rating.delay')
-    def test_customer_rating_post_save_calls_update_rating(self, mock):
-        customer_rating = CustomerRatingFactory()
-        mock.reset_mock()
-        customer_rating_post_save(None, customer_rating)
-        self.assertTrue(mock.called)
-        self.assertEqual(mock.call_count, 1)
+    def test_customer_rating_signals_derive_the_rating_without_a_task(self, mock):
+        product = ProductFactory()
+        ratings = [CustomerRatingFactory(product=product, rating=rating) for rating in (2, 5)]
+        self.assertEqual(Product.objects.get(id=product.id).rating, 3.5)
+        ratings[0].delete()
+        self.assertEqual(Product.objects.get(id=product.id).rating, 5)
+        ratings[1].delete()
+        self.assertIsNone(Product.objects.get(id=product.id).rating)
+        mock.assert_not_called()
+
+    def test_edited_rating_updates_the_counters(self):
+        product, other = ProductFactory.create_batch(2)
+        CustomerRatingFactory(product=product, rating=2)
+        rating = CustomerRatingFactory(product=product, rating=4)
+        rating = CustomerRating.objects.get(id=rating.id)
+        rating.rating = 5
+        rating.save()
+        product = Product.objects.get(id=product.id)
+        self.assertEqual((product.rating, product.rating_sum, product.rating_4_count, product.rating_5_count),
+                         (3.5, 7, 0, 1))
+        rating.product = other
+        rating.save()
+        product = Product.objects.get(id=product.id)
+        other = Product.objects.get(id=other.id)
+        self.assertEqual((product.rating, product.rating_count, product.rating_5_count), (2, 1, 0))
+        self.assertEqual((other.rating, other.rating_count, other.rating_5_count), (5, 1, 1))
 
     def test_product_variant_post_save_creates_history(self):
         product_variant = ProductVariantFactory()
         previous_history_count = product_variant.price_history.count()
+        product_variant.price += 1
         product_variant_post_save(None, product_variant)
         history_count = product_variant.price_history.count()
         self.assertEqual(history_count - previous_history_count, 1)
 
+    def test_product_variant_post_save_skips_history_without_price_change(self):
+        product_variant = ProductVariantFactory()
+        product_variant.in_stock = not product_variant.in_stock
+        product_variant.save()
+        product_variant = ProductVariant.objects.get(id=product_variant.id)
+        product_variant.variant_value = 'other'
+        product_variant.save()
+        self.assertEqual(product_variant.price_history.count(), 1)
+
+    def test_product_variant_post_save_skips_history_when_price_not_in_update_fields(self):
+        product_variant = ProductVariantFactory()
+        product_variant.price += 1
+        product_variant.save(update_fields=['in_stock'])
+        self.assertEqual(product_variant.price_history.count(), 1)
+
+    @override_settings(PRICE_HISTORY_WRITE='on_commit')
+    def test_product_variant_post_save_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            product_variant = ProductVariantFactory()
+        self.assertEqual(product_variant.price_history.count(), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(product_variant.price_history.count(), 1)
+
+    @override_settings(PRICE_HISTORY_WRITE='buffered')
+    def test_product_variant_post_save_buffered_writes_once_per_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                product_variants = ProductVariantFactory.create_batch(3)
+                product_variants[0].price += 1
+                product_variants[0].save()
+        with self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(PriceHistory.objects.count(), 4)
+
+    @override_settings(PRICE_HISTORY_WRITE='buffered')
+    def test_product_variant_post_save_buffered_discards_rolled_back_savepoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                ProductVariantFactory()
+                try:
+                    with transaction.atomic():
+                        ProductVariantFactory()
+                        raise ValueError
+                except ValueError:
+                    pass
+        self.assertEqual(PriceHistory.objects.count(), 1)
+
+    @override_settings(PRICE_HISTORY_WRITE='buffered')
+    def test_product_variant_post_save_buffered_writes_after_rolled_back_savepoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        ProductVariantFactory()
+                        raise ValueError
+                except ValueError:
+                    pass
+                ProductVariantFactory()
+        self.assertEqual(PriceHistory.objects.count(), 1)
+
+
+class TrackChangesMixinTestCase(TestCase):
+    def test_loaded_instance_has_no_changes(self):
+        product_variant = ProductVariant.objects.get(id=ProductVariantFactory().id)
+        self.assertEqual(product_variant.get_changed_fields(), set())
+
+    def test_changed_fields(self):
+        product_variant = ProductVariant.objects.get(id=ProductVariantFactory().id)
+        product_variant.price += 1
+        product_variant.product = ProductFactory()
+        self.assertEqual(product_variant.get_changed_fields(), {'price', 'product_id'})
+        self.assertTrue(product_variant.has_changed('product'))
+        self.assertFalse(product_variant.has_changed('sku'))
+
+    def test_deferred_fields_are_not_loaded(self):
+        product_variant = ProductVariant.objects.only('id').get(id=ProductVariantFactory().id)
+        with self.assertNumQueries(0):
+            self.assertEqual(product_variant.get_changed_fields(), set())
+
+    def test_refresh_of_deferred_field_keeps_changes(self):
+        product_variant = ProductVariant.objects.only('id', 'price').get(id=ProductVariantFactory().id)
+        product_variant.price += 1
+        self.assertEqual(product_variant.version, 1)
+        self.assertEqual(product_variant.get_changed_fields(), {'price'})
+
+    def test_save_resets_changes(self):
+        product_variant = ProductVariantFactory()
+        product_variant.price += 1
+        product_variant.save()
+        self.assertEqual(product_variant.get_changed_fields(), set())
+
 
 class TasksTestCase(TestCase):
     def test_update_rating_calculates_the_average_of_ratings(self):
@@ -76,9 +208,10 @@ class ModelsTestCase(TestCase):
     def test_product_related_returns_has_same_tags(self):
         tags_cycle = cycle(TagFactory.create_batch(10))
         products = ProductFactory.create_batch(100)
-        for product in products:
-            for _ in range(3):
-                product.tags.add(next(tags_cycle))
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in products:
+                for _ in range(3):
+                    product.tags.add(next(tags_cycle))
         original_product_tags = set(products[0].tags.all())
         for related_product in products[0].related_products:
             related_products_tags = set(related_product.tags.all())
@@ -86,12 +219,14 @@ class ModelsTestCase(TestCase):
 
     def test_product_related_returns_only_10_products(self):
         tag = TagFactory()
-        products = ProductFactory.create_batch(100, tags=[tag])
+        with self.captureOnCommitCallbacks(execute=True):
+            products = ProductFactory.create_batch(100, tags=[tag])
         self.assertEqual(products[0].related_products.count(), 10)
 
     def test_product_related_returns_only_distinct_products(self):
         tag = TagFactory()
-        products = ProductFactory.create_batch(100, tags=[tag])
+        with self.captureOnCommitCallbacks(execute=True):
+            products = ProductFactory.create_batch(100, tags=[tag])
         related_products_id = set()
         for related_product in products[0].related_products:
             related_products_id.add(related_product.id)
@@ -99,7 +234,8 @@ class ModelsTestCase(TestCase):
 
     def test_product_related_returns_not_include_self(self):
         tag = TagFactory()
-        products = ProductFactory.create_batch(100, tags=[tag])
+        with self.captureOnCommitCallbacks(execute=True):
+            products = ProductFactory.create_batch(100, tags=[tag])
         related_products_id = set()
         for related_product in products[0].related_products:
             related_products_id.add(related_product.id)
@@ -123,3 +259,516 @@ class ModelsTestCase(TestCase):
         price_history = PriceHistoryFactory()
         expected = f'{price_history.product_variant} price update at {price_history.updated_at}'
         self.assertEqual(str(price_history), expected)
+
+
+class RatingCountersTestCase(TestCase):
+    def test_new_customer_rating_updates_counters(self):
+        product = ProductFactory()
+        CustomerRatingFactory(product=product, rating=4)
+        CustomerRatingFactory(product=product, rating=2)
+        product.refresh_from_db()
+        self.assertEqual(product.rating_count, 2)
+        self.assertEqual(product.rating_sum, 6)
+        self.assertEqual(product.rating_4_count, 1)
+        self.assertEqual(product.rating_2_count, 1)
+        self.assertEqual(product.rating_5_count, 0)
+        self.assertAlmostEqual(product.rating, 3.0)
+
+    def test_deleted_customer_rating_updates_counters(self):
+        product = ProductFactory()
+        CustomerRatingFactory(product=product, rating=4)
+        CustomerRatingFactory(product=product, rating=2).delete()
+        product.refresh_from_db()
+        self.assertEqual(product.rating_count, 1)
+        self.assertEqual(product.rating_2_count, 0)
+        self.assertAlmostEqual(product.rating, 4.0)
+
+    def test_update_rating_without_ratings_is_none(self):
+        product = ProductFactory()
+        update_rating(product.id)
+        product.refresh_from_db()
+        self.assertIsNone(product.rating)
+
+    def test_update_rating_runs_constant_queries(self):
+        product = ProductFactory()
+        CustomerRatingFactory.create_batch(20, product=product)
+        with self.assertNumQueries(2):
+            update_rating(product.id)
+
+    def test_reconcile_ratings_command_rebuilds_counters(self):
+        products = ProductFactory.create_batch(3)
+        for product in products:
+            CustomerRatingFactory.create_batch(4, product=product)
+        Product.objects.update(rating=None, rating_count=0, rating_sum=0, rating_1_count=7)
+        call_command('reconcile_ratings', chunk_size=2, stdout=StringIO())
+        for product in products:
+            ratings = list(product.ratings.values_list('rating', flat=True))
+            product.refresh_from_db()
+            self.assertEqual(product.rating_count, 4)
+            self.assertEqual(product.rating_sum, sum(ratings))
+            self.assertEqual(product.rating_1_count, ratings.count(1))
+            self.assertAlmostEqual(product.rating, sum(ratings) / 4)
+
+
+class FakeRedis:
+    """Minimal in memory stand-in of the redis commands used by store.coalescing"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self):
+        return FakeRedisPipeline(self)
+
+    def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(str(member).encode())
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def scard(self, key):
+        return len(self.data.get(key, set()))
+
+    def delete(self, key):
+        return int(self.data.pop(key, None) is not None)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def hincrby(self, key, field, amount):
+        values = self.data.setdefault(key, {})
+        values[field.encode()] = int(values.get(field.encode(), 0)) + amount
+        return values[field.encode()]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+
+class FakeRedisPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+        return command
+
+    def execute(self):
+        return [method(*args, **kwargs) for method, args, kwargs in self.commands]
+
+
+@override_settings(RATING_COALESCE=True, RATING_FLUSH_INTERVAL=10)
+class RatingCoalescingTestCase(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch('store.coalescing.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('store.tasks.flush_ratings.apply_async')
+    def test_ratings_of_same_product_schedule_one_flush(self, mock):
+        product = ProductFactory()
+        CustomerRatingFactory.create_batch(5, product=product)
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(mock.call_args.kwargs, {'countdown': 10})
+        self.assertEqual(get_stats()['pending'], 1)
+        product.refresh_from_db()
+        self.assertEqual(product.rating_count, 0)
+
+    @patch('store.tasks.flush_ratings.apply_async')
+    def test_flush_ratings_recomputes_dirty_products(self, _):
+        products = ProductFactory.create_batch(3)
+        for product in products:
+            CustomerRatingFactory.create_batch(4, product=product)
+        stats = flush_ratings()
+        self.assertEqual(stats, {'events': 12, 'flushes': 1, 'products': 3, 'pending': 0, 'coalesced': 9})
+        for product in products:
+            ratings = list(product.ratings.values_list('rating', flat=True))
+            product.refresh_from_db()
+            self.assertEqual(product.rating_count, 4)
+            self.assertAlmostEqual(product.rating, sum(ratings) / 4)
+
+    @patch('store.tasks.flush_ratings.apply_async')
+    def test_flush_reopens_window(self, mock):
+        product = ProductFactory()
+        CustomerRatingFactory(product=product)
+        flush_ratings()
+        CustomerRatingFactory(product=product)
+        self.assertEqual(mock.call_count, 2)
+
+
+class RelatedProductsTestCase(TestCase):
+    def test_related_products_are_ranked_by_shared_tags(self):
+        tags = TagFactory.create_batch(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = ProductFactory(tags=tags)
+            one_tag = ProductFactory(tags=tags[:1])
+            three_tags = ProductFactory(tags=tags)
+            two_tags = ProductFactory(tags=tags[1:])
+            ProductFactory(tags=[TagFactory()])
+        self.assertEqual(list(product.related_products), [three_tags, two_tags, one_tag])
+
+    def test_removed_tag_updates_index_in_both_directions(self):
+        tag = TagFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            product, other = ProductFactory.create_batch(2, tags=[tag])
+        self.assertEqual(list(other.related_products), [product])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.tags.remove(tag)
+        self.assertEqual(list(other.related_products), [])
+        self.assertFalse(RelatedProduct.objects.exists())
+
+    def test_reverse_tag_changes_update_index(self):
+        tag = TagFactory()
+        product, other = ProductFactory.create_batch(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.products.add(product, other)
+        self.assertEqual(list(product.related_products), [other])
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.products.clear()
+        self.assertEqual(list(product.related_products), [])
+
+    @patch('store.tasks.update_related_products.delay')
+    def test_tag_changes_update_index_after_commit(self, mock):
+        tag = TagFactory()
+        product = ProductFactory()
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.tags.add(tag)
+        mock.assert_not_called()
+        for callback in callbacks:
+            callback()
+        mock.assert_called_once_with([product.id])
+
+    def test_deleted_tag_updates_index(self):
+        tag = TagFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            product, other = ProductFactory.create_batch(2, tags=[tag])
+        self.assertEqual(list(product.related_products), [other])
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.delete()
+        self.assertEqual(list(product.related_products), [])
+        self.assertFalse(RelatedProduct.objects.exists())
+
+    def test_rebuild_related_products_command(self):
+        tag = TagFactory()
+        products = ProductFactory.create_batch(5, tags=[tag])
+        RelatedProduct.objects.all().delete()
+        call_command('rebuild_related_products', chunk_size=2, stdout=StringIO())
+        self.assertEqual(RelatedProduct.objects.count(), 20)
+        self.assertEqual(products[0].related_products.count(), 4)
+
+    def test_related_products_is_a_single_query(self):
+        tag = TagFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            product = ProductFactory.create_batch(20, tags=[tag])[0]
+        with self.assertNumQueries(1):
+            self.assertEqual(len(product.related_products), 10)
+
+
+class PriceHistoryMaintenanceTestCase(TestCase):
+    def create_history(self, product_variant, updated_at, price):
+        history = PriceHistoryFactory(product_variant=product_variant, price=price)
+        PriceHistory.objects.filter(id=history.id).update(updated_at=updated_at)
+        return history
+
+    def test_compact_price_history_keeps_last_price_per_variant_per_day(self):
+        product_variant = ProductVariantFactory()
+        other_variant = ProductVariantFactory()
+        day = now().replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=100)
+        self.create_history(product_variant, day, 1)
+        last = self.create_history(product_variant, day + timedelta(hours=2), 2)
+        other = self.create_history(other_variant, day, 3)
+        recent = self.create_history(product_variant, now() - timedelta(days=1), 4)
+        recent_duplicate = self.create_history(product_variant, now() - timedelta(days=1, hours=1), 5)
+        deleted = compact_price_history(older_than_days=90, window_days=30)
+        self.assertEqual(deleted, 1)
+        old = PriceHistory.objects.filter(updated_at__lt=now() - timedelta(days=2))
+        self.assertEqual(set(old.values_list('id', flat=True)), {last.id, other.id})
+        self.assertEqual(PriceHistory.objects.filter(id__in=[recent.id, recent_duplicate.id]).count(), 2)
+
+    def test_maintain_price_history_skips_partitions_on_sqlite(self):
+        out = StringIO()
+        call_command('maintain_price_history', compact_after_days=90, stdout=out)
+        self.assertIn('not partitioned', out.getvalue())
+
+    def test_partition_sql(self):
+        self.assertEqual(add_months(date(2024, 11, 1), 3), date(2025, 2, 1))
+        self.assertEqual(
+            create_partition_sql(date(2024, 12, 1)),
+            "CREATE TABLE IF NOT EXISTS store_pricehistory_p202412 PARTITION OF store_pricehistory "
+            "FOR VALUES FROM ('2024-12-01') TO ('2025-01-01')",
+        )
+
+
+@override_settings(RESPONSE_CACHE=True, RESPONSE_CACHE_LOCK_TIMEOUT=5)
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_get_or_render_counts_hits_and_misses(self):
+        self.assertEqual(get_or_render('key', lambda: 'value'), ('value', False))
+        self.assertEqual(get_or_render('key', lambda: 'other'), ('value', True))
+        self.assertEqual(get_cache_stats(), {'hits': 1, 'misses': 1, 'waits': 0, 'hit_ratio': 0.5})
+
+    def test_get_or_render_does_not_cache_none(self):
+        get_or_render('key', lambda: None)
+        self.assertEqual(get_or_render('key', lambda: 'value'), ('value', False))
+
+    def test_get_or_render_waits_for_the_renderer_holding_the_lock(self):
+        cache.add('key:lock', 1)
+        with patch('store.cache.time.sleep', side_effect=lambda _: cache.set('key', 'rendered elsewhere')):
+            self.assertEqual(get_or_render('key', self.fail), ('rendered elsewhere', True))
+        self.assertEqual(get_cache_stats(), {'hits': 1, 'misses': 0, 'waits': 1, 'hit_ratio': 1})
+
+    @override_settings(RESPONSE_CACHE_LOCK_TIMEOUT=0)
+    def test_get_or_render_renders_when_the_lock_expires(self):
+        cache.add('key:lock', 1)
+        self.assertEqual(get_or_render('key', lambda: 'value'), ('value', False))
+        self.assertEqual(get_cache_stats(), {'hits': 0, 'misses': 1, 'waits': 1, 'hit_ratio': 0})
+        self.assertEqual(get_or_render('key', self.fail), ('value', True))
+
+    def test_invalidate_products_changes_product_and_list_keys(self):
+        product = ProductFactory()
+        other = ProductFactory()
+        keys = [response_key('retrieve', '', product.id), response_key('retrieve', '', other.id),
+                response_key('list', '/api/products/')]
+        invalidate_products([product.id])
+        self.assertNotEqual(response_key('retrieve', '', product.id), keys[0])
+        self.assertEqual(response_key('retrieve', '', other.id), keys[1])
+        self.assertNotEqual(response_key('list', '/api/products/'), keys[2])
+
+    def test_invalidate_products_includes_products_showing_them_as_related(self):
+        tag = TagFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            product, related = ProductFactory.create_batch(2, tags=[tag])
+        key = response_key('detailed', '', product.id)
+        invalidate_products([related.id])
+        self.assertNotEqual(response_key('detailed', '', product.id), key)
+
+    def test_evicted_generation_does_not_resurrect_old_responses(self):
+        product = ProductFactory()
+        key = response_key('retrieve', '', product.id)
+        cache.set(key, 'old')
+        cache.delete(f'store:response:product:{product.id}:generation')
+        self.assertNotEqual(response_key('retrieve', '', product.id), key)
+
+
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        self.supplier = SupplierFactory(name='Malharia Azul')
+        self.tag = TagFactory(name='inverno')
+        self.shirt = ProductFactory(name='Camiseta de algodão', description='Camiseta leve de algodão orgânico',
+                                    supplier=self.supplier)
+        self.coat = ProductFactory(name='Casaco', description='Casaco forrado de lã', tags=[self.tag])
+
+    def search(self, text):
+        return list(search_products(Product.objects.all(), text))
+
+    def test_searches_name_description_tags_and_supplier(self):
+        self.assertEqual(self.search('algodao'), [self.shirt])
+        self.assertEqual(self.search('inverno'), [self.coat])
+        self.assertEqual(self.search('malharia'), [self.shirt])
+        self.assertEqual(self.search('casaco lã'), [self.coat])
+        self.assertEqual(self.search('casaco algodão'), [])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_ranks_and_highlights_matches(self):
+        ProductFactory(name='Meia', description='Meia de algodão')
+        results = self.search('algodão')
+        self.assertEqual(results[0], self.shirt)  # Name matches rank higher
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+        self.assertIn('<b>algodão</b>', results[0].search_snippet)
+
+    def test_index_follows_changes(self):
+        self.tag.name = 'verão'
+        self.tag.save()
+        self.assertEqual(self.search('verão'), [self.coat])
+        self.assertEqual(self.search('inverno'), [])
+        self.supplier.name = 'Tecelagem'
+        self.supplier.save()
+        self.assertEqual(self.search('tecelagem'), [self.shirt])
+        self.shirt.tags.add(self.tag)
+        self.assertEqual(set(self.search('verão')), {self.shirt, self.coat})
+        self.coat.name = 'Jaqueta'
+        self.coat.save()
+        self.assertEqual(self.search('jaqueta'), [self.coat])
+        coat_id = self.coat.id
+        self.coat.delete()
+        self.assertEqual(self.search('jaqueta'), [])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM store_product_search WHERE rowid = %s', [coat_id])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_deleted_tag_leaves_the_index(self):
+        self.tag.delete()
+        self.assertEqual(self.search('inverno'), [])
+        self.assertEqual(self.search('casaco'), [self.coat])
+
+    def test_rebuild_whole_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM store_product_search')
+        self.assertEqual(self.search('casaco'), [])
+        update_search_index()
+        self.assertEqual(self.search('casaco'), [self.coat])
+
+    def test_fts_query_quotes_words(self):
+        self.assertEqual(get_fts_query('camiseta "azul" OR NEAR(x'), '"camiseta" "azul" "OR" "NEAR" "x"')
+
+
+class CatalogExportTestCase(TestCase):
+    def test_export_command_resumes_csv(self):
+        products = sorted(ProductFactory.create_batch(3), key=lambda product: product.id)
+        ProductVariantFactory.create_batch(2, product=products[0])
+        with TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'catalog.csv')
+            call_command('export_catalog', export_format='csv', output=output, chunk_size=2, stderr=StringIO())
+            with open(output) as file:
+                exported = file.read()
+            Product.objects.filter(id=products[2].id).update(name='Changed')
+            call_command('export_catalog', export_format='csv', output=output, after=products[1].id,
+                         stderr=StringIO())
+            with open(output) as file:
+                rows = list(csv.DictReader(file))
+        self.assertEqual(len(exported.splitlines()), 5)
+        ids = [str(product.id) for product in products]
+        self.assertEqual([row['id'] for row in rows], [ids[0], ids[0], ids[1], ids[2], ids[2]])
+        self.assertEqual(rows[-1]['name'], 'Changed')
+
+    def test_export_command_writes_ndjson_to_stdout(self):
+        product = ProductFactory()
+        out = StringIO()
+        call_command('export_catalog', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['id'], product.id)
+
+
+class CatalogImportTestCase(TestCase):
+    def lines(self, *products):
+        return StringIO(''.join(f'{json.dumps(product)}\n' for product in products))
+
+    def load(self, file, import_format='ndjson', chunk_size=2):
+        progress = []
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = load_catalog(file, import_format, chunk_size, lambda *args: progress.append(args))
+        return stats, progress
+
+    def test_imports_products_tags_and_variants(self):
+        existing = SupplierFactory(name='Malharia Azul')
+        file = self.lines(
+            {'supplier': 'Malharia Azul', 'name': 'Casaco', 'description': 'Casaco de lã', 'tags': ['inverno'],
+             'variants': [{'sku': 'CAS-P', 'variant_name': 'size', 'variant_value': 'P', 'price': '99.90'},
+                          {'sku': 'CAS-M', 'variant_name': 'size', 'variant_value': 'M', 'price': '99.90',
+                           'in_stock': True}]},
+            {'supplier': 'Tecelagem', 'name': 'Cachecol', 'description': 'Cachecol', 'tags': ['inverno', 'lã']},
+            {'supplier': 'Tecelagem', 'name': 'Luva', 'description': 'Luva', 'variants': [{'sku': 'LUV'}]},
+        )
+        stats, progress = self.load(StringIO(file.getvalue() + '{"name"\n'))
+        self.assertEqual(stats['products'], 2)
+        self.assertEqual(stats['products_created'], 2)
+        self.assertEqual(stats['variants_created'], 2)
+        self.assertEqual(stats['price_changes'], 2)
+        self.assertEqual(stats['errors'], 2)
+        self.assertEqual([len(errors) for _, errors in progress], [0, 2])
+        self.assertEqual([error['line'] for _, errors in progress for error in errors], [3, 4])
+        self.assertIn('variants', progress[1][1][0]['errors'])
+        coat = Product.objects.get(name='Casaco')
+        self.assertEqual(coat.supplier, existing)
+        self.assertEqual([tag.name for tag in coat.tags.all()], ['inverno'])
+        self.assertEqual(coat.variants.get(sku='CAS-M').price, Decimal('99.90'))
+        self.assertTrue(coat.variants.get(sku='CAS-M').in_stock)
+        self.assertEqual(PriceHistory.objects.filter(product_variant__product=coat).count(), 2)
+        scarf = Product.objects.get(name='Cachecol')
+        self.assertEqual(list(scarf.related_products), [coat])
+        self.assertEqual(search_products(Product.objects.all(), 'tecelagem').get(), scarf)
+
+    def test_reimport_updates_in_place(self):
+        tag = TagFactory(name='verão')
+        product = ProductFactory(name='Camiseta', description='Antiga', tags=[tag, TagFactory()])
+        variant = ProductVariantFactory(product=product, sku='CAM-1', price=Decimal('10.00'))
+        kept = ProductVariantFactory(product=product, sku='CAM-2', price=Decimal('10.00'))
+        moved = ProductVariantFactory(sku='MOV-1', price=Decimal('5.00'))
+        PriceHistory.objects.all().delete()
+        version = Product.objects.get(id=product.id).version
+        variant_row = {'variant_name': 'size', 'variant_value': 'M'}
+        file = self.lines({
+            'supplier': product.supplier.name, 'name': 'Camiseta', 'description': 'Nova', 'tags': ['verão'],
+            'variants': [{'sku': 'CAM-1', 'price': '12.00', **variant_row},
+                         {'sku': 'MOV-1', 'price': '5.00', **variant_row}],
+        })
+        with patch('store.importer.invalidate_products') as invalidate:
+            stats, _ = self.load(file)
+        self.assertEqual((stats['products_created'], stats['products_updated']), (0, 1))
+        self.assertEqual((stats['variants_created'], stats['variants_updated'], stats['price_changes']), (0, 2, 1))
+        product.refresh_from_db()
+        self.assertEqual(product.description, 'Nova')
+        self.assertEqual(product.version, version + 1)
+        self.assertEqual(list(product.tags.all()), [tag])
+        self.assertEqual(set(product.variants.values_list('sku', flat=True)), {'CAM-1', 'CAM-2', 'MOV-1'})
+        self.assertEqual(PriceHistory.objects.get().product_variant_id, variant.id)
+        self.assertEqual(ProductVariant.objects.get(id=kept.id).version, kept.version)
+        self.assertEqual(set(invalidate.call_args[0][0]), {product.id, moved.product_id})
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_csv_export_round_trip(self):
+        product = ProductFactory(tags=TagFactory.create_batch(2))
+        ProductVariantFactory.create_batch(2, product=product)
+        ProductFactory()
+        file = StringIO(b''.join(export_catalog('csv')).decode())
+        stats, _ = self.load(file, 'csv')
+        self.assertEqual((stats['products'], stats['products_updated'], stats['errors']), (2, 2, 0))
+        self.assertEqual((stats['variants_updated'], stats['price_changes']), (2, 0))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(product.tags.count(), 2)
+
+    def test_import_command_and_task(self):
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.ndjson')
+            errors = os.path.join(directory, 'errors.ndjson')
+            with open(path, 'w') as file:
+                file.write(self.lines({'supplier': 'Tecelagem', 'name': 'Luva', 'description': 'Luva'}, []).read())
+            out = StringIO()
+            call_command('import_catalog', path, errors=errors, stdout=out)
+            self.assertIn('1 created', out.getvalue())
+            with open(errors) as file:
+                self.assertEqual(json.loads(file.read())['line'], 2)
+            result = import_catalog.delay(path).get()
+        self.assertEqual((result['products_updated'], result['errors']), (1, 1))
+        self.assertEqual(result['error_rows'][0]['line'], 2)
+
+
+class BenchmarkTestCase(TestCase):
+    def test_actions_stay_within_query_budgets(self):
+        # The budgets of benchmarks.json hold at any scale, latencies are only compared on the benchmark host
+        out = StringIO()
+        call_command('benchmark', variants=50, iterations=1, stdout=out)
+        self.assertIn('products.detailed', out.getvalue())
+
+    def test_compare_reports_regressions(self):
+        results = {'products.list': {'p50_ms': 10, 'p95_ms': 30, 'throughput_rps': 50, 'queries': 8}}
+        baselines = update_baselines({}, results, '1k')
+        self.assertEqual(compare(results, baselines, '1k'), [])
+        self.assertEqual(compare(results, baselines, '100k'), [])
+        slower = {'products.list': {'p50_ms': 16, 'p95_ms': 40, 'throughput_rps': 30, 'queries': 9}}
+        self.assertEqual(compare(slower, baselines, '1k'), [
+            'products.list: 9 queries, budget is 8',
+            'products.list: p50_ms 16, baseline is 10',
+            'products.list: throughput_rps 30, baseline is 50',
+        ])
+        self.assertEqual(compare(slower, baselines, '100k', query_threshold=1), [])
+
+    def test_update_writes_baselines(self):
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchmarks.json')
+            call_command('benchmark', variants=10, iterations=1, baselines=path, update=True, stdout=StringIO())
+            with open(path) as file:
+                baselines = json.load(file)
+            baselines['queries']['products.list'] -= 1
+            with open(path, 'w') as file:
+                json.dump(baselines, file)
+            with self.assertRaisesMessage(CommandError, '10 products.list: '):
+                call_command('benchmark', variants=10, iterations=1, baselines=path, latency_threshold=100,
+                             stdout=StringIO())
+        self.assertEqual(set(baselines['scales']['10']), set(baselines['queries']))
@@ -1,10 +1,11 @@
 from django.urls import path, include
 
-from store.api.routes import router
+from store.api.routes import router, async_urlpatterns
 from store.api.swagger import swagger_urls
 
 app_name = 'store'
 urlpatterns = [
     path('api/', include(router.urls)),
+    path('api/async/', include(async_urlpatterns)),
 ]
 urlpatterns.extend(swagger_urls)